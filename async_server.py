@@ -0,0 +1,281 @@
+import asyncio
+import logging
+from camea_protocol import FrameDecoder
+from errors import SocketCorrupted
+from logging_setup import truncated
+from metrics import CONNECTIONS
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class SessionConnection:
+    """
+    Class represented socket-like adapter over the asyncio stream of
+    a single CAMEA Management Software connection.
+    Allows the blocking services (CameaService) to answer the request
+    from a worker thread while the connection itself is owned by the event loop.
+    Writes from the worker threads wait until the data is flushed; writes
+    from the loop itself can not wait, they are flushed by the connection
+    handler before it reads on, and are refused once MAX_BUFFERED bytes
+    are waiting for the client that does not read.
+
+    Constants:
+    -----------
+    MAX_BUFFERED - maximum quantity of bytes buffered for the client by the writes from the loop
+
+    Parameters:
+    -----------
+    loop: asyncio event loop
+        Loop that owns the connection
+    writer: asyncio.StreamWriter
+        Stream writer of the connection
+    timeout: int
+        Timeout in seconds for the single write
+
+    Methods:
+    -----------
+    sendall(data) --> None
+        Writes data to the connection and waits until it is flushed
+    sendmsg(buffers) --> int
+        Writes the list of buffers to the connection and waits until they are flushed
+    getpeername() --> tuple
+        Returns the remote address of the connection
+    """
+
+    MAX_BUFFERED = 16 * 1024 * 1024
+
+    def __init__(self, loop, writer, timeout):
+        self.loop = loop
+        self.writer = writer
+        self.timeout = timeout
+
+    def __in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def __write(self, buffers):
+        self.writer.writelines(buffers)
+        await self.writer.drain()
+
+    def sendall(self, data) -> None:
+        """
+        Writes data to the connection and waits until it is flushed
+
+        Parameters:
+        -----------
+        data: bytes
+            Data to send
+
+        Output:
+        -----------
+        """
+        self.sendmsg([data])
+
+    def sendmsg(self, buffers) -> int:
+        """
+        Writes the list of buffers to the connection and waits until they are flushed
+
+        Parameters:
+        -----------
+        buffers: list
+            Bytes-like objects to send
+
+        Output:
+        -----------
+        Quantity of sent bytes
+        """
+        if self.writer.is_closing():
+            raise ConnectionResetError('connection is closed')
+        if self.__in_loop():
+            # waiting for the loop from its own thread would block it forever,
+            # the transport buffers the data and the connection handler drains it
+            if self.writer.transport.get_write_buffer_size() > SessionConnection.MAX_BUFFERED:
+                raise ConnectionResetError('client does not read the sent data')
+            self.writer.writelines(buffers)
+            return sum(memoryview(buffer).nbytes for buffer in buffers)
+        future = asyncio.run_coroutine_threadsafe(self.__write(buffers), self.loop)
+        future.result(self.timeout)
+        return sum(memoryview(buffer).nbytes for buffer in buffers)
+
+    def getpeername(self):
+        """
+        Returns the remote address of the connection
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Remote address tuple (ip, port)
+        """
+        return self.writer.get_extra_info('peername')
+
+
+class AsyncCameaServer:
+    """
+    Class represented asyncio server that serves many CAMEA Management
+    Software connections at once.
+    Every connection has its own frame decoder, handshake and keep alive
+    timer, while CameaService and VidarService of the processor are shared
+    between all the connections.
+
+    Constants:
+    -----------
+    HANDSHAKE - handshake message sent to the connected client
+    KEEP_ALIVE - keep alive message sent to the connected clients
+    KEEP_ALIVE_INTERVAL - interval between keep alive messages in seconds
+
+    Parameters:
+    -----------
+    processor: QUERY_PROCESSOR
+        Processor with the shared services and settings
+
+    Methods:
+    -----------
+    run() --> None
+        Runs the server until it is stopped
+    stop(msg) --> None
+        Stops the server
+    """
+
+    HANDSHAKE = bytes(b'\x48\x53\x78\x78')
+    KEEP_ALIVE = bytes(b'\x4b\x41\x78\x78\x00\x00\x00\x00\x00\x00\x00\x00')
+    KEEP_ALIVE_INTERVAL = 3
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.config = processor.config
+        self.sessions = set()
+        self.loop = None
+        self.server = None
+
+    async def __send_keep_alive(self, writer, address):
+        while not writer.is_closing():
+            await asyncio.sleep(AsyncCameaServer.KEEP_ALIVE_INTERVAL)
+            try:
+                writer.write(AsyncCameaServer.KEEP_ALIVE)
+                await writer.drain()
+                logger.debug("Keep alive was sent to %s", address)
+            except (ConnectionError, OSError) as e:
+                logger.error('An error occurred while sending keep alive to : '
+                             + f'Camea Management System {address}: {e}')
+                return
+
+    def __process_frames(self, frames, conn, address, session):
+        if self.processor.journal:
+            self.processor.journal.record(frames, session)
+        for frame in frames:
+            logger.debug("Received data: %s from %s", truncated(frame), address)
+            if frame.is_detection_request():
+                logger.info("Received data: %s from %s", truncated(frame), address)
+                logger.debug("DetectionRequest catched")
+                # process the message in the worker pool with delay
+                self.processor.submit_DetectionRequest(frame=frame, conn=conn)
+            else:
+                logger.debug('not a DetectionRequest')
+
+    async def __handle_client(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        logger.debug('Get connection request from Camea Management System')
+        CONNECTIONS.inc()
+        settings = self.processor.settings
+        timeout = settings.timeout
+        buffer_size = settings.buffer
+
+        # sending handshake to Camea Management System
+        try:
+            writer.write(AsyncCameaServer.HANDSHAKE)
+            await writer.drain()
+            logger.info("Connection established with: " + str(address))
+        except ConnectionError as e:
+            logger.error("Failed to establish connection with Camea Management system:"
+                         + str(e))
+            writer.close()
+            return
+
+        conn = SessionConnection(self.loop, writer, timeout)
+        keep_alive_task = asyncio.create_task(self.__send_keep_alive(writer, address))
+        self.sessions.add(writer)
+        decoder = FrameDecoder()
+        session = self.processor.journal.session() if self.processor.journal else None
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(buffer_size), timeout)
+                if not data:
+                    raise SocketCorrupted("connection was closed by the peer")
+                self.__process_frames(decoder.feed(data), conn, address, session)
+                # the answers written from the loop are flushed before reading on,
+                # so the client that does not read them is not read either
+                await asyncio.wait_for(writer.drain(), timeout)
+        except ConnectionResetError as e:
+            logger.error(f'Connection with Camea Management system {address} '
+                         + f'was closed by Camea: {e}')
+        except SocketCorrupted as e:
+            logger.error(f'Connection with Camea Management system {address} '
+                         + f'was corrupted: {e}')
+        except asyncio.TimeoutError:
+            logger.error(f'Connection to Camea Management system {address} '
+                         + 'was closed due to timeout')
+        except Exception as e:
+            logger.error(f'An error occured during runtime with {address}: {e}')
+        finally:
+            keep_alive_task.cancel()
+            self.processor.detection_executor.cancel(conn)
+            self.sessions.discard(writer)
+            writer.close()
+
+    async def __serve(self):
+        self.loop = asyncio.get_running_loop()
+        host = self.config['service']['host']
+        port = self.config.getint('service', 'port')
+        self.server = await asyncio.start_server(self.__handle_client, host, port)
+        logger.info(f"Service started at {host}:{port} in asyncio mode")
+
+        # Configure timeout server termination if set
+        operating_time = self.config.getint('service', 'operating_time')
+        if operating_time > 0:
+            self.loop.call_later(operating_time * 60, self.stop, 'running time expired')
+            logger.info(f"Terminate timer set for {operating_time} minutes")
+
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def stop(self, msg: str) -> None:
+        """
+        Stops the server
+
+        Parameters:
+        -----------
+        msg: str
+            Reason of the termination
+
+        Output:
+        -----------
+        """
+        logger.info(f'Service was terminated: {msg}')
+        for writer in list(self.sessions):
+            writer.close()
+        if self.server:
+            self.server.close()
+
+    def run(self) -> None:
+        """
+        Runs the server until it is stopped
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        try:
+            asyncio.run(self.__serve())
+        except KeyboardInterrupt:
+            logger.info('Service was terminated: keyboard interrupt')
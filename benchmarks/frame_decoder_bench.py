@@ -0,0 +1,68 @@
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from camea_protocol import FrameDecoder  # noqa: E402
+
+
+def make_frame(msg_id: int, body: str) -> bytes:
+    body = body.encode('ISO-8859-1')
+    return (b'DAtP' + msg_id.to_bytes(2, 'little') + b'\x00\x00'
+            + len(body).to_bytes(4, 'little') + body)
+
+
+def make_stream(frames: int, body_size: int) -> bytes:
+    stream = bytearray()
+    for i in range(frames):
+        body = (f'msg:DetectionRequest|RequestID:{i}|ImageTime:20231206T130000000+0200'
+                + '|ToleranceMS:500|Extra:')
+        body = body + 'x' * max(0, body_size - len(body))
+        stream += make_frame(i % 0x10000, body)
+        stream += b'KAxx' + bytes(8)
+    return bytes(stream)
+
+
+def regex_splitter(stream: bytes, chunk: int) -> int:
+    # the splitter used by socket_server.py before the FrameDecoder
+    count = 0
+    buffer = str()
+    for i in range(0, len(stream), chunk):
+        buffer = buffer + stream[i:i + chunk].decode('ISO-8859-1')
+        splitted_buffer = re.findall(r'.+?(?=DAtP|Hsxx|KAxx|$)', buffer, flags=re.DOTALL)
+        if len(splitted_buffer) > 1:
+            count += len(splitted_buffer) - 1
+            buffer = splitted_buffer[-1]
+    return count
+
+
+def frame_decoder(stream: bytes, chunk: int) -> int:
+    count = 0
+    decoder = FrameDecoder()
+    for i in range(0, len(stream), chunk):
+        count += len(decoder.feed(stream[i:i + chunk]))
+    return count
+
+
+def bench(name, fn, stream, chunk):
+    start = time.perf_counter()
+    count = fn(stream, chunk)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>14}: {count:>7} frames in {elapsed:8.3f} s, '
+          + f'{len(stream) / elapsed / 1_000_000:8.2f} MB/s')
+
+
+if __name__ == '__main__':
+    # python benchmarks/frame_decoder_bench.py
+    scenarios = [
+        ('small frames', 20_000, 120, 1024),
+        ('fragmented', 5_000, 120, 16),
+        ('large frames', 20, 200_000, 1024),
+    ]
+    for title, frames, body_size, chunk in scenarios:
+        stream = make_stream(frames, body_size)
+        print(f'{title}: {frames} frames of {body_size} bytes, recv chunk {chunk} bytes')
+        bench('regex splitter', regex_splitter, stream, chunk)
+        bench('frame decoder', frame_decoder, stream, chunk)
+        print()
@@ -0,0 +1,359 @@
+import argparse
+import base64
+import configparser
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from camea_protocol import DATA, KEEP_ALIVE, FrameDecoder, encode_frame  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class FakeVidar:
+    """
+    Vidar HTTP API stand-in: querydb returns a few rows around the middle
+    of the requested frametimems range, every row shows up ingestion_lag seconds
+    after its frametime; getdata returns images of the given size
+    """
+
+    def __init__(self, latency: float, image_size: int, rows: int = 3,
+                 ingestion_lag: float = 0.0):
+        self.port = free_port()
+        self.requests = 0
+        image = base64.b64encode(b'\x89PNG' + bytes(image_size)).decode()
+        lp_image = image[:2048]
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                fake.requests += 1
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                cmd = query.get('cmd', [''])[0]
+                if cmd == 'querydb':
+                    numbers = [int(n) for n in re.findall(r'\d{10,}', query['sql'][0])]
+                    middle = ((min(numbers) + max(numbers)) // 2 if numbers
+                              else int(time.time() * 1_000))
+                    ingested = (time.time() - ingestion_lag) * 1_000
+                    body = '<result>' + ''.join(
+                        f'<row><ID value="{middle + i * 40}"/>'
+                        + f'<FRAMETIMEMS value="{middle + i * 40}"/>'
+                        + '<ZONE_NAME value="1"/></row>' for i in range(rows)
+                        if middle + i * 40 <= ingested) + '</result>'
+                elif cmd == 'getdata':
+                    id = query['id'][0]
+                    body = (f'<result><ID value="{id}"/><capture><frametimems value="{id}"/>'
+                            + '</capture><anpr><text value="AA1234AA"/>'
+                            + '<country value="UA"/></anpr>'
+                            + f'<images><lp_img value="{lp_image}"/>'
+                            + f'<normal_img value="{image}"/></images></result>')
+                else:
+                    body = '<result/>'
+                time.sleep(latency)
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeCameaDB:
+    """
+    Camea DB stand-in: answers the KAxx handshake and keep alives,
+    acknowledges every uploaded DAtP frame with its message id
+    """
+
+    def __init__(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        self.uploads = 0
+        self.bytes = 0
+        self.__lock = threading.Lock()
+
+    def __handle(self, conn):
+        decoder = FrameDecoder(max_frame_size=256 * 1024 * 1024)
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(1024 * 1024)
+                except OSError:
+                    return
+                if not data:
+                    return
+                for frame in decoder.feed(data):
+                    if frame.marker == KEEP_ALIVE:
+                        conn.sendall(KEEP_ALIVE + bytes(8))
+                    elif frame.marker == DATA:
+                        with self.__lock:
+                            self.uploads += 1
+                            self.bytes += len(frame.body)
+                        conn.sendall(b''.join(encode_frame(frame.msg_id, {'msg': 'OK'})))
+
+    def __accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.__handle, args=(conn,), daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def stop(self):
+        self.server.close()
+
+
+class FakeCameaManagement:
+    """
+    Camea Management System stand-in: sends framed DetectionRequests
+    at the constant rate and records the latency of every response
+    """
+
+    def __init__(self, port: int, rate: float, duration: float, units: list = None):
+        self.port = port
+        self.rate = rate
+        self.duration = duration
+        # requests are addressed to the units in turn, without UnitID if not given
+        self.units = units or [None]
+        self.sent = dict()
+        self.latencies = []
+        self.not_found_latencies = []
+        self.found = 0
+        self.not_found = 0
+        self.__done = threading.Event()
+
+    def __connect(self, timeout: float = 15.0) -> socket.socket:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn = socket.create_connection(('127.0.0.1', self.port))
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        # wait for the handshake
+        conn.recv(4)
+        return conn
+
+    def __receive(self, conn):
+        decoder = FrameDecoder()
+        while not self.__done.is_set():
+            try:
+                data = conn.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+            now = time.perf_counter()
+            for frame in decoder.feed(data):
+                if frame.marker != DATA:
+                    continue
+                sent_at = self.sent.pop(frame.fields.get('RequestID'), None)
+                if sent_at is None:
+                    continue
+                self.latencies.append(now - sent_at)
+                if frame.fields.get('ImageID') == 'NULL':
+                    self.not_found += 1
+                    self.not_found_latencies.append(now - sent_at)
+                else:
+                    self.found += 1
+
+    def run(self, drain_timeout: float) -> float:
+        conn = self.__connect()
+        conn.settimeout(1.0)
+        receiver = threading.Thread(target=self.__receive, args=(conn,), daemon=True)
+        receiver.start()
+        start = time.perf_counter()
+        total = int(self.rate * self.duration)
+        for i in range(total):
+            # open loop: the requests are sent on schedule regardless of the responses
+            delay = start + i / self.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            now = datetime.now(timezone.utc)
+            image_time = now.strftime('%Y%m%dT%H%M%S%f')[:-3] + '+0000'
+            unit = self.units[i % len(self.units)]
+            body = (f'msg:DetectionRequest|RequestID:{i}|ImageTime:{image_time}'
+                    + '|ToleranceMS:500'
+                    + (f'|UnitID:{unit}' if unit else '')).encode('ISO-8859-1')
+            frame = (DATA + (i % 0x10000).to_bytes(2, 'little') + b'\x00\x00'
+                     + len(body).to_bytes(4, 'little') + body)
+            self.sent[str(i)] = time.perf_counter()
+            conn.sendall(frame)
+        deadline = time.monotonic() + drain_timeout
+        while self.sent and time.monotonic() < deadline:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        self.__done.set()
+        conn.close()
+        return elapsed
+
+
+def write_config(directory: str, args, port: int, vidars: list, db: FakeCameaDB):
+    vidar = vidars[0]
+    config = configparser.ConfigParser()
+    config['service'] = {'host': '127.0.0.1', 'port': port, 'module_id': 'LOADTEST',
+                         'mode': args.mode, 'operating_time': 0,
+                         'server_mode': args.server_mode}
+    config['settings'] = {'buffer': 65536, 'timezone': 'UTC', 'timeout': 60,
+                          'camera_unit_id': 'LOADTEST', 'workers': args.workers,
+                          'max_pending': args.max_pending, 'deadline': args.deadline}
+    config['vidar'] = {'ip': f'127.0.0.1:{vidar.port}', 'tolerance': 500, 'zone': 0,
+                       'timeout': args.delay, 'retries': 0, 'cache_size': args.cache_size,
+                       'adaptive': int(args.adaptive), 'max_wait': args.max_wait or args.delay}
+    config['camea_db'] = {'ip': '127.0.0.1', 'port': db.port,
+                          'connections': args.db_connections, 'spares': 1}
+    for i, extra in enumerate(vidars[1:], start=2):
+        config[f'camera:lane{i}'] = {'unit_id': f'LANE{i}', 'module_id': f'LOADTEST{i}',
+                                     'ip': f'127.0.0.1:{extra.port}'}
+    with open(os.path.join(directory, 'config.ini'), 'w') as f:
+        config.write(f)
+    os.makedirs(os.path.join(directory, 'logs'), exist_ok=True)
+
+
+def stop_server(server: subprocess.Popen):
+    if os.name == 'posix':
+        server.send_signal(signal.SIGINT)
+    else:
+        server.terminate()
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def peak_rss() -> str:
+    if resource is None:
+        return 'n/a'
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    megabytes = rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+    return f'{megabytes:.1f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='socket_server.py load test with local fakes')
+    parser.add_argument('--rate', type=float, default=20, help='DetectionRequests per second')
+    parser.add_argument('--duration', type=float, default=10, help='test duration in seconds')
+    parser.add_argument('--delay', type=int, default=0, help='[vidar] timeout of the server')
+    parser.add_argument('--mode', default='VIDAR', choices=('VIDAR', 'TEST'))
+    parser.add_argument('--server-mode', default='blocking', choices=('blocking', 'asyncio'))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-pending', type=int, default=1000)
+    parser.add_argument('--deadline', type=float, default=0,
+                        help='[settings] deadline in seconds since ImageTime, 0 disables it')
+    parser.add_argument('--db-connections', type=int, default=1)
+    parser.add_argument('--cache-size', type=int, default=64, help='[vidar] cache_size in MB')
+    parser.add_argument('--vidar-latency', type=float, default=0.01,
+                        help='fake Vidar response latency in seconds')
+    parser.add_argument('--image-size', type=int, default=200_000,
+                        help='fake Vidar vehicle image size in bytes')
+    parser.add_argument('--vidar-lag', type=float, default=0.0,
+                        help='fake Vidar ingestion lag of the transit rows in seconds')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='enable [vidar] adaptive readiness polling')
+    parser.add_argument('--max-wait', type=float, default=0,
+                        help='[vidar] max_wait, defaults to --delay')
+    parser.add_argument('--cameras', type=int, default=1,
+                        help='quantity of cameras served by the server, each with its fake Vidar')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    args = parser.parse_args()
+
+    vidars = [FakeVidar(latency=args.vidar_latency, image_size=args.image_size,
+                        ingestion_lag=args.vidar_lag) for _ in range(args.cameras)]
+    db = FakeCameaDB()
+    for vidar in vidars:
+        vidar.start()
+    db.start()
+
+    directory = tempfile.mkdtemp(prefix='loadtest_')
+    port = free_port()
+    write_config(directory, args, port, vidars, db)
+    with open(os.path.join(directory, 'server.out'), 'w') as output:
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'socket_server.py')],
+                                  cwd=directory, stdout=output, stderr=subprocess.STDOUT)
+    try:
+        # the first camera is the default one, it is addressed without UnitID
+        units = [None] + [f'LANE{i}' for i in range(2, args.cameras + 1)]
+        client = FakeCameaManagement(port=port, rate=args.rate, duration=args.duration,
+                                     units=units)
+        elapsed = client.run(drain_timeout=args.delay + 30)
+    finally:
+        stop_server(server)
+        for vidar in vidars:
+            vidar.stop()
+        db.stop()
+
+    answered = len(client.latencies)
+    print(f'requests:   {int(args.rate * args.duration)} sent, {answered} answered '
+          + f'({client.found} found, {client.not_found} not found)')
+    print(f'throughput: {answered / elapsed:.1f} responses/s, '
+          + f'{db.uploads} uploads ({db.bytes / 1024 / 1024:.1f} MB) acked by Camea DB')
+    print(f'latency:    p50 {percentile(client.latencies, 0.5) * 1000:.1f} ms, '
+          + f'p99 {percentile(client.latencies, 0.99) * 1000:.1f} ms, '
+          + f'max {max(client.latencies, default=float("nan")) * 1000:.1f} ms')
+    if client.not_found_latencies:
+        print(f'not found:  p50 {percentile(client.not_found_latencies, 0.5) * 1000:.1f} ms, '
+              + f'p99 {percentile(client.not_found_latencies, 0.99) * 1000:.1f} ms')
+    print(f'vidar:      {sum(vidar.requests for vidar in vidars)} HTTP requests ('
+          + ', '.join(str(vidar.requests) for vidar in vidars) + ' per camera)')
+    print(f'peak RSS:   {peak_rss()}')
+    if args.keep:
+        print(f'working directory: {directory}')
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # python benchmarks/loadtest.py --rate 50 --duration 20 --delay 0
+    main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vidar_parser import QueryDbParser  # noqa: E402
+
+
+# stand-ins for the other cffresult columns returned by 'select *'
+OTHER_COLUMNS = ['TEXT', 'COUNTRY', 'CONFIDENCE', 'LANE', 'DIRECTION', 'SPEED', 'CATEGORY',
+                 'COLOR', 'MAKE', 'FRAMETIME', 'EXPOSURE', 'GAIN', 'POS_X', 'POS_Y', 'WIDTH',
+                 'HEIGHT', 'CHARHEIGHT', 'TRIGGER', 'UNIT', 'STATE', 'LPTYPE', 'RESULTTYPE']
+
+
+def make_response(rows: int, all_columns: bool) -> bytes:
+    start = 1_701_867_600_000
+    body = ['<result>']
+    for i in range(rows):
+        body.append(f'<row><ID value="{1_000_000 + i}"/>'
+                    + f'<FRAMETIMEMS value="{start + i * 200}"/>'
+                    + f'<ZONE_NAME value="{i % 3 + 1}"/>')
+        if all_columns:
+            body.extend(f'<{column} value="value {i}"/>' for column in OTHER_COLUMNS)
+        body.append('</row>')
+    body.append('</result>')
+    return ''.join(body).encode()
+
+
+def element_tree(data: bytes) -> list:
+    # the parser used by vidar_service.py before the QueryDbParser
+    root = ET.fromstring(data)
+    rows = []
+    for row in root.findall('row'):
+        zone = row.find('ZONE_NAME')
+        rows.append((int(row.find('FRAMETIMEMS').get('value')),
+                     row.find('ID').get('value'),
+                     zone.get('value') if zone is not None else None))
+    return rows
+
+
+def expat(data: bytes) -> list:
+    return QueryDbParser().parse_bytes(data)
+
+
+def bench(name, fn, data, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        rows = fn(data)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    fn(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:>26}: {len(rows):>6} rows of {len(data) / 1_000:8.1f} kB '
+          + f'in {elapsed * 1_000:7.2f} ms, peak {peak / 1_000_000:6.2f} MB')
+
+
+if __name__ == '__main__':
+    # python benchmarks/querydb_parser_bench.py
+    # rows of the tolerance range at 5 rows per second
+    scenarios = [
+        ('±500 ms', 5, 2_000),
+        ('±60 s', 600, 50),
+        ('±10 min', 6_000, 5),
+    ]
+    for title, rows, repeat in scenarios:
+        print(f'{title}: {rows} rows')
+        bench('select *, element tree', element_tree, make_response(rows, True), repeat)
+        bench('select *, expat', expat, make_response(rows, True), repeat)
+        bench('projected, element tree', element_tree, make_response(rows, False), repeat)
+        bench('projected, expat', expat, make_response(rows, False), repeat)
+        print()
@@ -0,0 +1,133 @@
+import argparse
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from camea_protocol import DATA, HANDSHAKES, FrameDecoder  # noqa: E402
+from journal import read_journal  # noqa: E402
+from loadtest import percentile  # noqa: E402
+
+IMAGE_TIME = re.compile(rb'ImageTime:(\d{8}T\d{9}[+-]\d{4})')
+
+
+def retime(frame, shift: float) -> bytes:
+    # move ImageTime of the request by shift seconds, so it matches the live data
+    def replace(match):
+        dt = datetime.strptime(match.group(1).decode(), '%Y%m%dT%H%M%S%f%z')
+        dt = dt + timedelta(seconds=shift)
+        return ('ImageTime:' + dt.strftime('%Y%m%dT%H%M%S%f')[:-3]
+                + dt.strftime('%z')).encode()
+    body = IMAGE_TIME.sub(replace, frame.body)
+    return (frame.marker + frame.msg_id.to_bytes(2, 'little') + b'\x00\x00'
+            + len(body).to_bytes(4, 'little') + body)
+
+
+class Session:
+    """
+    Replayed Camea Management connection: sends the recorded frames and
+    records the latency of every DetectionRequestRepeat by RequestID
+    """
+
+    def __init__(self, host: str, port: int, results: dict):
+        self.conn = socket.create_connection((host, port))
+        # wait for the handshake
+        self.conn.recv(4)
+        self.conn.settimeout(1.0)
+        self.sent = dict()
+        self.results = results
+        self.closed = threading.Event()
+        threading.Thread(target=self.__receive, daemon=True).start()
+
+    def __receive(self):
+        decoder = FrameDecoder()
+        while not self.closed.is_set():
+            try:
+                data = self.conn.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+            now = time.perf_counter()
+            for frame in decoder.feed(data):
+                if frame.marker != DATA:
+                    continue
+                sent_at = self.sent.pop(frame.fields.get('RequestID'), None)
+                if sent_at is None:
+                    continue
+                self.results['latencies'].append(now - sent_at)
+                key = 'not_found' if frame.fields.get('ImageID') == 'NULL' else 'found'
+                self.results[key] += 1
+
+    def send(self, frame, data: bytes):
+        if frame.is_detection_request():
+            self.sent[frame.fields.get('RequestID')] = time.perf_counter()
+            self.results['sent'] += 1
+        self.conn.sendall(data)
+
+    def close(self):
+        self.closed.set()
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays the capture journal into the server')
+    parser.add_argument('journal', help='journal captured with [service] journal')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=58777)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed factor, 0 to send as fast as possible')
+    parser.add_argument('--retime', action='store_true',
+                        help='shift ImageTime of the requests to the replay time')
+    parser.add_argument('--drain', type=float, default=30,
+                        help='time to wait for the outstanding responses in seconds')
+    args = parser.parse_args()
+
+    results = {'sent': 0, 'found': 0, 'not_found': 0, 'latencies': []}
+    sessions = dict()
+    first = None
+    start = time.perf_counter()
+    for arrived_at, session_id, frame in read_journal(args.journal):
+        if frame.marker in HANDSHAKES:
+            continue
+        if first is None:
+            first = arrived_at
+        if args.speed > 0:
+            delay = start + (arrived_at - first) / args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if session_id not in sessions:
+            sessions[session_id] = Session(args.host, args.port, results)
+        data = frame.to_bytes()
+        if args.retime and frame.is_detection_request():
+            data = retime(frame, time.time() - arrived_at)
+        sessions[session_id].send(frame, data)
+    sent_elapsed = time.perf_counter() - start
+
+    deadline = time.monotonic() + args.drain
+    while any(session.sent for session in sessions.values()) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    for session in sessions.values():
+        session.close()
+
+    latencies = results['latencies']
+    print(f'requests:   {results["sent"]} sent in {sent_elapsed:.1f} s over {len(sessions)} '
+          + f'connections, {len(latencies)} answered ({results["found"]} found, '
+          + f'{results["not_found"]} not found)')
+    print(f'throughput: {len(latencies) / elapsed:.1f} responses/s')
+    print(f'latency:    p50 {percentile(latencies, 0.5) * 1000:.1f} ms, '
+          + f'p99 {percentile(latencies, 0.99) * 1000:.1f} ms, '
+          + f'max {max(latencies, default=float("nan")) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    # python benchmarks/replay.py journal/capture.bin --speed 2 --retime
+    main()
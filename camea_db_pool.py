@@ -0,0 +1,510 @@
+import collections
+import logging
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from camea_protocol import DATA, KEEP_ALIVE as KEEP_ALIVE_MARKER, FrameDecoder, send_frame
+from logging_setup import truncated
+from metrics import REGISTRY
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+RECONNECTS = REGISTRY.counter('camea_db_reconnects_total',
+                              'Broken Camea DB connections that were replaced')
+UNMATCHED = REGISTRY.counter('camea_db_unmatched_frames_total',
+                             'Camea DB frames that were not taken as the ack of any upload')
+
+KEEP_ALIVE = bytes(b'\x4b\x41\x78\x78\x00\x00\x00\x00\x00\x00\x00\x00')
+
+
+class CameaDBConnection:
+    """
+    Class represented single handshaken connection to the Camea Database.
+    All the outbound frames (uploads and keep alive messages) are written by
+    the single writer thread fed by the queue, so frames never interleave.
+    Uploads are pipelined: the next frame is written without waiting for the
+    previous ack, the reader thread matches acks back and measures the ack RTT.
+    By default any frame received from Camea DB acks the oldest upload waiting
+    for the ack, as the reply read after the upload did before pipelining.
+    With ack_by_id only the DAtP frame carrying the message id of the upload
+    acks it; keep alive replies are ignored, any other frame is logged and counted
+    in camea_db_unmatched_frames_total, the uploads it was meant to ack are failed
+    once the ack timeout expires.
+    Once the connection is broken, every upload waiting for the ack or queued
+    for writing is failed with the connection error.
+
+    Constants:
+    -----------
+    HANDSHAKE_TIMEOUT - time to wait for the connection and the handshake reply in seconds
+
+    Parameters:
+    -----------
+    db_ip: str
+        Camea Database IP address
+    db_port: int
+        Camea Database PORT
+    buffer: int
+        Quantity of bytes to read from the socket
+    max_in_flight: int
+        Maximum quantity of uploads waiting for the ack
+    on_broken: callable
+        Called with the connection once it is broken
+    ack_by_id: bool
+        Match acks to the uploads by the message id instead of the sending order
+
+    Methods:
+    -----------
+    send(msg_id, buffers) --> Future
+        Queues the encoded frame, the future gets (response, ack RTT)
+    send_keep_alive() --> None
+        Queues keep alive message
+    in_flight() --> int
+        Returns quantity of uploads waiting for the ack
+    expire(timeout) --> None
+        Breaks the connection if any upload is waiting for the ack longer than timeout
+    stats() --> dict
+        Returns ack statistics
+    close() --> None
+        Closes the connection
+    """
+
+    HANDSHAKE_TIMEOUT = 11
+
+    def __init__(self, db_ip: str, db_port: int, buffer: int,
+                 max_in_flight: int = 8, on_broken=None, ack_by_id: bool = False):
+        self.DB_IP = db_ip
+        self.DB_PORT = db_port
+        self.buffer = buffer
+        self.healthy = True
+        self.on_broken = on_broken
+        self.ack_by_id = ack_by_id
+        self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        logger.info(f'Connecting to Camea DB at {self.DB_IP}: {self.DB_PORT}')
+        try:
+            # the silent Camea DB must not hang the pool refill or the service start
+            self.conn.settimeout(CameaDBConnection.HANDSHAKE_TIMEOUT)
+            self.conn.connect((self.DB_IP, self.DB_PORT))
+            # handshake
+            self.conn.sendall(KEEP_ALIVE)
+            logger.info(f"Handshake was sent to {self.conn.getpeername()}")
+            s2_response = str(self.conn.recv(self.buffer), 'ISO-8859-1')
+            self.conn.settimeout(None)
+        except OSError:
+            self.conn.close()
+            raise
+        logger.info((f"Received data: '{s2_response}'"
+                    + f"from {self.DB_IP}:{self.DB_PORT}"))
+
+        self.__outbox = queue.Queue()
+        # msg_id: (future, sent_at), ordered by sending
+        self.__pending = collections.OrderedDict()
+        self.__in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.__lock = threading.Lock()
+        self.__acks = 0
+        self.__rtt_total = 0.0
+        self.__rtt_max = 0.0
+        self.__writer = threading.Thread(target=self.__write, name='camea_db_writer', daemon=True)
+        self.__reader = threading.Thread(target=self.__read, name='camea_db_reader', daemon=True)
+        self.__writer.start()
+        self.__reader.start()
+
+    def __drain_outbox(self) -> list:
+        futures = []
+        while True:
+            try:
+                item = self.__outbox.get_nowait()
+            except queue.Empty:
+                return futures
+            if item is not None and item[2] is not None:
+                futures.append(item[2])
+
+    def __fail(self, futures: list, error: Exception):
+        for future in futures:
+            self.__in_flight.release()
+            future.set_exception(error)
+
+    def __break(self, error: Exception, expected: bool = False):
+        with self.__lock:
+            if not self.healthy:
+                return
+            self.healthy = False
+            futures = [future for future, _ in self.__pending.values()]
+            self.__pending.clear()
+            # send() enqueues under the lock, so nothing is queued after the drain
+            futures += self.__drain_outbox()
+            self.__outbox.put(None)
+        if not expected:
+            logger.error(f'Connection to Camea DB is broken: {error}')
+        self.__fail(futures, error)
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+        if self.on_broken:
+            self.on_broken(self)
+
+    def __write(self):
+        while True:
+            item = self.__outbox.get()
+            if item is None:
+                break
+            msg_id, buffers, future = item
+            with self.__lock:
+                healthy = self.healthy
+                if healthy and future is not None:
+                    # registered before writing, the ack may come before send_frame returns
+                    self.__pending[msg_id] = (future, time.monotonic())
+            if not healthy:
+                if future is not None:
+                    self.__fail([future], ConnectionResetError('connection is closed'))
+                continue
+            try:
+                send_frame(self.conn, buffers)
+            except OSError as e:
+                self.__break(e)
+        # the uploads queued after the sentinel are failed, so they are spooled by the caller
+        with self.__lock:
+            futures = self.__drain_outbox()
+        self.__fail(futures, ConnectionResetError('connection is closed'))
+
+    def __acknowledge(self, frame):
+        with self.__lock:
+            if self.ack_by_id and frame.msg_id in self.__pending:
+                future, sent_at = self.__pending.pop(frame.msg_id)
+            elif not self.ack_by_id and self.__pending:
+                # acks come in the sending order
+                _, (future, sent_at) = self.__pending.popitem(last=False)
+            else:
+                if frame.marker != KEEP_ALIVE_MARKER:
+                    UNMATCHED.inc()
+                    logger.warning("Camea DB ack does not match any upload: '%s'",
+                                   truncated(frame))
+                return
+            rtt = time.monotonic() - sent_at
+            self.__acks += 1
+            self.__rtt_total += rtt
+            self.__rtt_max = max(self.__rtt_max, rtt)
+        self.__in_flight.release()
+        future.set_result((frame.text, rtt))
+
+    def __read(self):
+        decoder = FrameDecoder()
+        while self.healthy:
+            try:
+                data = self.conn.recv(self.buffer)
+                if not data:
+                    raise ConnectionResetError('connection was closed by Camea DB')
+            except OSError as e:
+                self.__break(e)
+                return
+            for frame in decoder.feed(data):
+                if not self.ack_by_id or frame.marker == DATA:
+                    self.__acknowledge(frame)
+                elif frame.marker != KEEP_ALIVE_MARKER:
+                    # only the DAtP frames are taken as acks, see the class docstring
+                    UNMATCHED.inc()
+                    logger.warning("Unexpected Camea DB %s frame: '%s'",
+                                   frame.marker, truncated(frame))
+
+    def send(self, msg_id: int, buffers: list, timeout: float = None) -> Future:
+        """
+        Queues the encoded frame for the writer thread
+
+        Parameters:
+        -----------
+        msg_id: int
+            Message id of the frame
+        buffers: list
+            Frame buffers produced by camea_protocol.encode_frame()
+        timeout: float
+            Time to wait while too many uploads are waiting for the ack
+
+        Output:
+        -----------
+        Future with (Camea DB response, ack RTT in seconds) result
+        """
+        if not self.healthy:
+            raise ConnectionResetError('connection is closed')
+        if not self.__in_flight.acquire(timeout=timeout):
+            raise ConnectionError('too many uploads are waiting for Camea DB ack')
+        future = Future()
+        with self.__lock:
+            # the connection may be broken while waiting for the free slot
+            if self.healthy:
+                self.__outbox.put((msg_id, buffers, future))
+                return future
+        self.__in_flight.release()
+        raise ConnectionResetError('connection is closed')
+
+    def send_keep_alive(self) -> None:
+        """
+        Queues keep alive message
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.__outbox.put((None, [KEEP_ALIVE], None))
+        logger.debug("Keep alive was queued to %s:%s", self.DB_IP, self.DB_PORT)
+
+    def in_flight(self) -> int:
+        """
+        Returns quantity of uploads waiting for the ack
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Quantity of uploads
+        """
+        with self.__lock:
+            return len(self.__pending)
+
+    def expire(self, timeout: float) -> None:
+        """
+        Breaks the connection if any upload is waiting for the ack longer than timeout
+
+        Parameters:
+        -----------
+        timeout: float
+            Ack timeout in seconds
+
+        Output:
+        -----------
+        """
+        now = time.monotonic()
+        with self.__lock:
+            expired = any(now - sent_at > timeout for _, sent_at in self.__pending.values())
+        if expired:
+            self.__break(TimeoutError('Camea DB ack timeout'))
+
+    def stats(self) -> dict:
+        """
+        Returns ack statistics
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Dictionary:
+            'acks', 'in_flight', 'rtt_avg', 'rtt_max' (seconds)
+        """
+        with self.__lock:
+            return {'acks': self.__acks,
+                    'in_flight': len(self.__pending),
+                    'rtt_avg': self.__rtt_total / self.__acks if self.__acks else 0.0,
+                    'rtt_max': self.__rtt_max}
+
+    def close(self) -> None:
+        """
+        Closes the connection
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.on_broken = None
+        self.__break(ConnectionResetError('connection was closed'), expected=True)
+
+
+class CameaDBPool:
+    """
+    Class represented pool of handshaken connections to the Camea Database
+    along with pre-connected warm spares.
+    Uploads are spread over the connections by the quantity of uploads waiting
+    for the ack. A broken connection is replaced with the spare at once, new
+    connections are established by the background thread out of the upload path.
+
+    Constants:
+    -----------
+    RECONNECT_INTERVAL - pause between failed connection attempts in seconds
+    ACK_TIMEOUT - time to wait for the upload ack in seconds
+
+    Parameters:
+    -----------
+    db_ip: str
+        Camea Database IP address
+    db_port: int
+        Camea Database PORT
+    buffer: int
+        Quantity of bytes to read from the socket
+    size: int
+        Quantity of connections used for uploads
+    spares: int
+        Quantity of pre-connected spare connections
+    max_in_flight: int
+        Maximum quantity of uploads waiting for the ack per connection
+    ack_by_id: bool
+        Match acks to the uploads by the message id, see CameaDBConnection
+
+    Methods:
+    -----------
+    submit(msg_id, buffers, timeout) --> Future
+        Queues the encoded frame to the least loaded connection
+    keep_alive() --> None
+        Sends keep alive messages over all the connections
+    stats() --> list
+        Returns ack statistics of the upload connections
+    close() --> None
+        Closes all the connections
+    """
+
+    RECONNECT_INTERVAL = 1
+    ACK_TIMEOUT = 11
+
+    def __init__(self, db_ip: str, db_port: int, buffer: int, size: int = 1, spares: int = 1,
+                 max_in_flight: int = 8, ack_by_id: bool = False):
+        self.DB_IP = db_ip
+        self.DB_PORT = db_port
+        self.buffer = buffer
+        self.size = size
+        self.spares = spares
+        self.max_in_flight = max_in_flight
+        self.ack_by_id = ack_by_id
+        self.__active = []
+        self.__spares = []
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        self.__refill_event = threading.Event()
+
+        # the upload connections are established at once, the spares in background
+        for _ in range(self.size):
+            self.__active.append(self.__create_connection())
+        self.__refill_thread = threading.Thread(target=self.__refill, name='camea_db_refill',
+                                                daemon=True)
+        self.__refill_thread.start()
+
+    def __create_connection(self) -> CameaDBConnection:
+        return CameaDBConnection(db_ip=self.DB_IP, db_port=self.DB_PORT, buffer=self.buffer,
+                                 max_in_flight=self.max_in_flight, on_broken=self.__discard,
+                                 ack_by_id=self.ack_by_id)
+
+    def __refill(self):
+        while not self.__closed.is_set():
+            with self.__lock:
+                missing_active = self.size - len(self.__active)
+                missing_spares = self.spares - len(self.__spares)
+            if missing_active <= 0 and missing_spares <= 0:
+                self.__refill_event.wait()
+                self.__refill_event.clear()
+                continue
+            try:
+                conn = self.__create_connection()
+            except OSError as e:
+                logger.error(f'Failed to connect to Camea DB at {self.DB_IP}:{self.DB_PORT}: {e}')
+                self.__closed.wait(CameaDBPool.RECONNECT_INTERVAL)
+                continue
+            with self.__lock:
+                if self.__closed.is_set():
+                    closed = True
+                elif len(self.__active) < self.size:
+                    closed = False
+                    self.__active.append(conn)
+                else:
+                    closed = False
+                    self.__spares.append(conn)
+            if closed:
+                conn.close()
+
+    def __discard(self, conn: CameaDBConnection):
+        with self.__lock:
+            if conn in self.__active:
+                self.__active.remove(conn)
+                RECONNECTS.inc()
+                # take the healthy spare in place of the broken connection
+                while self.__spares:
+                    spare = self.__spares.pop(0)
+                    if spare.healthy:
+                        self.__active.append(spare)
+                        logger.info('Broken Camea DB connection was replaced with the spare one')
+                        break
+            elif conn in self.__spares:
+                self.__spares.remove(conn)
+        self.__refill_event.set()
+
+    def submit(self, msg_id: int, buffers: list, timeout: float = None) -> Future:
+        """
+        Queues the encoded frame to the least loaded connection
+
+        Parameters:
+        -----------
+        msg_id: int
+            Message id of the frame
+        buffers: list
+            Frame buffers produced by camea_protocol.encode_frame()
+        timeout: float
+            Time to wait while too many uploads are waiting for the ack
+
+        Output:
+        -----------
+        Future with (Camea DB response, ack RTT in seconds) result
+        """
+        with self.__lock:
+            connections = [conn for conn in self.__active if conn.healthy]
+        if not connections:
+            raise ConnectionError('no Camea DB connection is available')
+        conn = min(connections, key=lambda conn: conn.in_flight())
+        return conn.send(msg_id=msg_id, buffers=buffers, timeout=timeout)
+
+    def keep_alive(self) -> None:
+        """
+        Sends keep alive messages over all the connections,
+        breaks the connections with the expired acks
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        with self.__lock:
+            connections = self.__active + self.__spares
+        for conn in connections:
+            conn.expire(CameaDBPool.ACK_TIMEOUT)
+            if conn.healthy:
+                conn.send_keep_alive()
+
+    def stats(self) -> list:
+        """
+        Returns ack statistics of the upload connections
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        List of dictionaries, see CameaDBConnection.stats()
+        """
+        with self.__lock:
+            connections = list(self.__active)
+        return [conn.stats() for conn in connections]
+
+    def close(self) -> None:
+        """
+        Closes all the connections
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.__closed.set()
+        self.__refill_event.set()
+        with self.__lock:
+            connections = self.__active + self.__spares
+            self.__active = []
+            self.__spares = []
+        for conn in connections:
+            conn.close()
@@ -0,0 +1,412 @@
+import logging
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# frame markers of the CAMEA TCP/IP protocol
+DATA = b'DAtP'
+KEEP_ALIVE = b'KAxx'
+HANDSHAKES = (b'Hsxx', b'HSxx')
+MARKERS = (DATA, KEEP_ALIVE) + HANDSHAKES
+# marker (4 bytes) + message id (2 bytes) + reserved (2 bytes) + body length (4 bytes)
+HEADER_SIZE = 12
+MARKER_SIZE = 4
+# values of this size and larger are sent as separate buffers without copying
+LARGE_VALUE = 4096
+# maximum quantity of buffers passed to the single sendmsg call
+IOV_MAX = 1024
+# unframed text messages of the CAMEA Push System end with one of these bytes
+# or where the next message starts
+TEXT_TERMINATORS = (b'\x00', b'\r', b'\n')
+MESSAGE_START = b'msg:'
+
+
+def parse_fields(body: str) -> dict:
+    """
+    Parses the body of the CAMEA message 'key:value|key:value|...'
+
+    Parameters:
+    -----------
+    body: str
+        Message body
+
+    Output:
+    -----------
+    Dictionary:
+        'key': value
+    """
+    fields = dict()
+    for item in body.split('|'):
+        key, _, value = item.partition(':')
+        fields[key] = value.replace(':', '')
+    return fields
+
+
+class Frame:
+    """
+    Class represented single framed message of the CAMEA TCP/IP protocol.
+    The body is kept as raw bytes, decoding and parsing of the
+    'key:value|...' fields are done lazily on the first access.
+
+    Parameters:
+    -----------
+    marker: bytes
+        Frame marker (DAtP, KAxx, Hsxx)
+    msg_id: int
+        Message id from the frame header
+    body: bytes
+        Raw frame body
+
+    Methods:
+    -----------
+    text --> str
+        Frame body decoded in ISO-8859-1 format
+    fields --> dict
+        Parsed frame body fields
+    is_detection_request() --> bool
+        Checks if the frame carries the DetectionRequest message
+    to_bytes() --> bytes
+        Returns the frame encoded as it is sent over the wire
+    """
+
+    __slots__ = ('marker', 'msg_id', 'body', '__text', '__fields')
+
+    def __init__(self, marker: bytes, msg_id: int, body: bytes):
+        self.marker = marker
+        self.msg_id = msg_id
+        self.body = body
+        self.__text = None
+        self.__fields = None
+
+    def __repr__(self):
+        return f'Frame({self.marker!r}, {self.msg_id}, {self.text!r})'
+
+    def __str__(self):
+        return self.text
+
+    @property
+    def text(self) -> str:
+        if self.__text is None:
+            self.__text = self.body.decode('ISO-8859-1').rstrip('\x00')
+        return self.__text
+
+    @property
+    def fields(self) -> dict:
+        if self.__fields is None:
+            self.__fields = parse_fields(self.text)
+        return self.__fields
+
+    def is_detection_request(self) -> bool:
+        """
+        Checks if the frame carries the DetectionRequest message
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        True for the DetectionRequest message
+        """
+        return self.marker == DATA and b'msg:DetectionRequest' in self.body
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns the frame encoded as it is sent over the wire
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Frame bytes, handshakes are encoded as the bare marker
+        """
+        if self.marker in HANDSHAKES:
+            return self.marker
+        return (self.marker + self.msg_id.to_bytes(2, 'little') + b'\x00\x00'
+                + len(self.body).to_bytes(4, 'little') + self.body)
+
+
+class FrameDecoder:
+    """
+    Class represented incremental decoder of the CAMEA TCP/IP byte stream.
+    Received chunks are appended to the internal bytearray buffer, frames are
+    cut using the length field of the header, so every byte is looked at
+    only once no matter how the stream was fragmented.
+    Unknown data is skipped up to the next known frame marker.
+
+    Parameters:
+    -----------
+    max_frame_size: int
+        Maximum allowed frame body length, longer headers are treated as corrupted
+
+    Methods:
+    -----------
+    feed(data) --> list
+        Appends received bytes and returns the list of complete frames
+    buffered() --> int
+        Returns quantity of buffered bytes of the incomplete frame
+    """
+
+    COMPACT_THRESHOLD = 65536
+
+    def __init__(self, max_frame_size: int = 16 * 1024 * 1024):
+        self.max_frame_size = max_frame_size
+        self.__buffer = bytearray()
+        self.__start = 0
+
+    def buffered(self) -> int:
+        """
+        Returns quantity of buffered bytes of the incomplete frame
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Quantity of bytes
+        """
+        return len(self.__buffer) - self.__start
+
+    def __resync(self, start: int) -> int:
+        # search the next known marker after the current position
+        positions = [self.__buffer.find(marker, start + 1) for marker in MARKERS]
+        positions = [position for position in positions if position >= 0]
+        if positions:
+            return min(positions)
+        # keep the tail that may be the beginning of the marker
+        return max(start + 1, len(self.__buffer) - MARKER_SIZE + 1)
+
+    def feed(self, data) -> list:
+        """
+        Appends received bytes and returns the list of complete frames
+
+        Parameters:
+        -----------
+        data: bytes-like object
+            Chunk received from the socket
+
+        Output:
+        -----------
+        List of Frame objects
+        """
+        frames = []
+        buffer = self.__buffer
+        buffer += data
+        start = self.__start
+        end = len(buffer)
+        with memoryview(buffer) as view:
+            while end - start >= MARKER_SIZE:
+                marker = bytes(view[start:start + MARKER_SIZE])
+                if marker in HANDSHAKES:
+                    frames.append(Frame(marker, 0, b''))
+                    start += MARKER_SIZE
+                    continue
+                if marker not in MARKERS:
+                    skipped = self.__resync(start)
+                    logger.debug('Skipped %s bytes of unknown data', skipped - start)
+                    start = skipped
+                    continue
+                if end - start < HEADER_SIZE:
+                    break
+                length = int.from_bytes(view[start + 8:start + HEADER_SIZE], 'little')
+                if length > self.max_frame_size:
+                    logger.error('Frame length %s exceeds the limit, frame skipped', length)
+                    start = self.__resync(start)
+                    continue
+                if end - start < HEADER_SIZE + length:
+                    break
+                msg_id = int.from_bytes(view[start + 4:start + 6], 'little')
+                body = bytes(view[start + HEADER_SIZE:start + HEADER_SIZE + length])
+                frames.append(Frame(marker, msg_id, body))
+                start += HEADER_SIZE + length
+
+        # drop the consumed bytes once they outweigh the incomplete tail
+        if start >= FrameDecoder.COMPACT_THRESHOLD or start * 2 >= end:
+            del buffer[:start]
+            start = 0
+        self.__start = start
+        return frames
+
+
+class PushDecoder:
+    """
+    Class represented incremental decoder of the CAMEA Push System stream.
+    A stream that starts with the known frame marker is cut into frames by
+    the FrameDecoder. Otherwise the stream is the sequence of the text messages
+    'msg:...|key:value|...' ending with the NUL or line terminator or where the
+    next message starts; the text message that is not followed by anything
+    stays buffered until flush() is called.
+
+    Parameters:
+    -----------
+    max_frame_size: int
+        Maximum allowed message length, longer messages are skipped
+
+    Methods:
+    -----------
+    feed(data) --> list
+        Appends received bytes and returns the list of complete DAtP frames
+    flush() --> list
+        Returns the buffered text message as the complete one
+    buffered() --> int
+        Returns quantity of buffered bytes of the incomplete message
+    """
+
+    def __init__(self, max_frame_size: int = 1024 * 1024):
+        self.max_frame_size = max_frame_size
+        self.__frames = None
+        self.__buffer = bytearray()
+
+    def buffered(self) -> int:
+        """
+        Returns quantity of buffered bytes of the incomplete message
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Quantity of bytes
+        """
+        if self.__frames is not None:
+            return self.__frames.buffered()
+        return len(self.__buffer)
+
+    def feed(self, data) -> list:
+        """
+        Appends received bytes and returns the list of complete DAtP frames,
+        text messages are returned as the DAtP frames with message id 0
+
+        Parameters:
+        -----------
+        data: bytes-like object
+            Chunk received from the socket
+
+        Output:
+        -----------
+        List of Frame objects
+        """
+        if self.__frames is not None:
+            return [frame for frame in self.__frames.feed(data) if frame.marker == DATA]
+        self.__buffer += data
+        if len(self.__buffer) < MARKER_SIZE:
+            return []
+        if bytes(self.__buffer[:MARKER_SIZE]) in MARKERS:
+            # the stream is framed, the buffered bytes are passed to the frame decoder
+            self.__frames = FrameDecoder(max_frame_size=self.max_frame_size)
+            data = bytes(self.__buffer)
+            self.__buffer.clear()
+            return self.feed(data)
+        return self.__split_text()
+
+    def __split_text(self) -> list:
+        frames = []
+        buffer = self.__buffer
+        start = 0
+        while True:
+            ends = [buffer.find(terminator, start) for terminator in TEXT_TERMINATORS]
+            ends.append(buffer.find(MESSAGE_START, start + 1))
+            ends = [end for end in ends if end >= 0]
+            if not ends:
+                break
+            end = min(ends)
+            if buffer[start:end].strip():
+                frames.append(Frame(DATA, 0, bytes(buffer[start:end])))
+            start = end if buffer.startswith(MESSAGE_START, end) else end + 1
+        del buffer[:start]
+        if len(buffer) > self.max_frame_size:
+            logger.error(f'Text message length exceeds {self.max_frame_size}, message skipped')
+            buffer.clear()
+        return frames
+
+    def flush(self) -> list:
+        """
+        Returns the buffered text message as the complete one,
+        incomplete frames of the framed stream stay buffered
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        List of Frame objects
+        """
+        if self.__frames is not None or not self.__buffer.strip():
+            return []
+        frame = Frame(DATA, 0, bytes(self.__buffer))
+        self.__buffer.clear()
+        return [frame]
+
+
+def encode_frame(msg_id: int, fields: dict) -> list:
+    """
+    Encodes the CAMEA DAtP message 'key:value|key:value|...' into the list of
+    buffers ready for the scatter-gather send. The length header is computed
+    up front, bytes-like values (images) are referenced as they are and never
+    copied, small parts are merged into a single buffer.
+
+    Parameters:
+    -----------
+    msg_id: int
+        Message id
+    fields: dict
+        Message fields, values are str, int or bytes-like objects
+
+    Output:
+    -----------
+    List of bytes-like objects, the first one is the frame header
+    """
+    buffers = []
+    small = []
+    length = 0
+    for i, (key, value) in enumerate(fields.items()):
+        prefix = (('|' if i else '') + f'{key}:').encode('UTF-8')
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = memoryview(value).cast('B')
+        else:
+            value = str(value).encode('UTF-8')
+        length += len(prefix) + len(value)
+        small.append(prefix)
+        if len(value) >= LARGE_VALUE:
+            buffers.append(b''.join(small))
+            buffers.append(value)
+            small = []
+        else:
+            small.append(value)
+    if small:
+        buffers.append(b''.join(small))
+    header = DATA + msg_id.to_bytes(2, 'little') + b'\x00\x00' + length.to_bytes(4, 'little')
+    return [header] + buffers
+
+
+def send_frame(conn, buffers: list) -> None:
+    """
+    Sends the encoded frame with the scatter-gather socket.sendmsg,
+    continues after partial sends until all the buffers are sent.
+    Falls back to sendall of every buffer where sendmsg is not available (Windows)
+
+    Parameters:
+    -----------
+    conn: socket object
+        Established connection
+    buffers: list
+        Buffers produced by encode_frame()
+
+    Output:
+    -----------
+    """
+    if not hasattr(conn, 'sendmsg'):
+        for buffer in buffers:
+            conn.sendall(buffer)
+        return
+    buffers = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer)]
+    while buffers:
+        sent = conn.sendmsg(buffers[:IOV_MAX])
+        while sent:
+            if sent >= buffers[0].nbytes:
+                sent -= buffers[0].nbytes
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
@@ -1,16 +1,27 @@
 import atexit
+import functools
 import logging
 import schedule
 import socket
 import time
 import threading
 from datetime import datetime
+from camea_db_pool import CameaDBPool
+from camea_protocol import encode_frame
 from errors import SocketCorrupted
-from image_generator import ImageGenerator
+from image_generator import ImageGenerator, parse_size
+from logging_setup import truncated
+from metrics import REGISTRY
 
 # set logger
 logger = logging.getLogger(__name__)
 
+ACK_LATENCY = REGISTRY.histogram('detection_stage_seconds',
+                                 'Duration of the DetectionRequest processing stages',
+                                 labels={'stage': 'camea_db_ack'})
+UPLOAD_ERRORS = REGISTRY.counter('camea_db_upload_errors_total',
+                                 'Uploads that were not acknowledged by Camea DB')
+
 
 class CameaService:
     """
@@ -19,35 +30,50 @@ class CameaService:
 
     Constants:
     -----------
+    CONNECTION_TIMEOUT - time to wait for the free Camea DB connection in seconds
 
     Parameters:
     db_ip
         Camea Database for image storing IP address
     db_port
         Camea Database for image storing PORT
+    buffer
+        Quantity of bytes to read from the socket
+    connections
+        Quantity of Camea Database connections used for uploads in parallel
+    spares
+        Quantity of pre-connected spare Camea Database connections
+    ack_by_id
+        Match Camea Database acks to the uploads by the message id
 
     Methods:
-    send_image_found_response(conn, id, img, request, config, lp, country) --> None
+    send_image_found_response(conn, id, img, request, config, lp, country, module_id) --> None
         Sends the response to the CAMEA DB Management Software query
         with the found image credentials
-    send_image_not_found_response(conn, id, img, request, config, lp, country) --> None
+    send_image_not_found_response(conn, id, request, config, module_id) --> None
         Sends the response to the CAMEA DB Management Software query
         that image was not found
-    send_stab_image_data(id, dt_response, request, config) --> None
+    send_stab_image_data(id, dt_response, request, config, module_id) --> Future
         Sends the autogenerated stab images to the Camea Database
-    send_image_data(id, dt_response, request, config, img) --> None
+    send_image_data(id, dt_response, request, config, img, module_id) --> Future
         Sends the received from the Vidar DB image to the Camea Database
     close_camea_db_connection() --> None
         Closes the connection to Camea DB
     """
 
-    def __init__(self, db_ip: str, db_port: int, buffer: int):
+    CONNECTION_TIMEOUT = 11
+
+    def __init__(self, db_ip: str, db_port: int, buffer: int,
+                 connections: int = 1, spares: int = 1, ack_by_id: bool = False):
         self.DB_IP = db_ip
         self.DB_PORT = db_port
         self.buffer = buffer
 
-        # initiate Camea DB connection
-        self.conn = self.__create_connection()
+        # initiate Camea DB connections
+        self.pool = CameaDBPool(db_ip=self.DB_IP, db_port=self.DB_PORT, buffer=self.buffer,
+                                size=connections, spares=spares, ack_by_id=ack_by_id)
+        # optional UploadSpool the failed uploads are written to, see spool.py
+        self.spool = None
 
         def __run_scheduler(interval=1):
             scheduler_event = threading.Event()
@@ -64,16 +90,8 @@ class CameaService:
             return scheduler_event
 
         def __send_keep_alive_2():
-            try:
-                self.conn.sendall(bytearray(b'\x4b\x41\x78\x78\x00\x00\x00\x00\x00\x00\x00\x00'))
-                logger.debug(f"Keep alive was sent to {self.conn.getpeername()}")
-            except ConnectionResetError as e:
-                logger.error(f'Connection to Camea DB was reset by the peer: {e}')
-                self.conn = self.__create_connection()
-            except socket.error as e:
-                logger.error('An error occurred while sending keep alive to : '
-                             + f'Camea DB: {e}')
-                self.conn = self.__create_connection()
+            # broken connections are replaced by the pool
+            self.pool.keep_alive()
 
         # Start the background thread
         self.stop_scheduler = __run_scheduler()
@@ -89,19 +107,24 @@ class CameaService:
     def __shutdown(self):
         schedule.clear()
         self.stop_scheduler.set()
-        self.conn.close()
-
-    def __create_connection(self):
-        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        logger.info(f'Connecting to Camea DB at {self.DB_IP}: {self.DB_PORT}')
-        conn.connect((self.DB_IP, self.DB_PORT))
-        # handshake
-        conn.sendall(bytearray(b'\x4b\x41\x78\x78\x00\x00\x00\x00\x00\x00\x00\x00'))
-        logger.info(f"Handshake was sent to {conn.getpeername()}")
-        s2_response = str(conn.recv(self.buffer), 'ascii')
-        logger.info((f"Received data: '{s2_response}'"
-                    + f"from {self.DB_IP}:{self.DB_PORT}"))
-        return conn
+        self.pool.close()
+
+    def __spool(self, msg_id: int, buffers: list):
+        if self.spool is not None and self.spool.append(msg_id, buffers):
+            logger.warning(f'Upload {msg_id} was spooled to be replayed to Camea DB')
+
+    def __upload_done(self, msg_id, buffers, future):
+        try:
+            s2_response, rtt = future.result()
+        except Exception as e:
+            UPLOAD_ERRORS.inc()
+            logger.error(f'Images were not delivered to Camea DB: {e}')
+            self.__spool(msg_id, buffers)
+            return
+        ACK_LATENCY.observe(rtt)
+        logger.info("Send images to CAMEA DB at %s:%s", self.DB_IP, self.DB_PORT)
+        logger.debug("Camea DB response: '%s' from %s:%s, ack RTT %.1f ms",
+                     truncated(s2_response), self.DB_IP, self.DB_PORT, rtt * 1000)
 
     def __large_detection_template(self, moduleId: str, dt_response: datetime) -> dict:
         response = dict()
@@ -127,17 +150,13 @@ class CameaService:
         response['TimeDet'] = response_time
         return response
 
-    def __camea_format(self, id: int, response_str: str):
-        img_response = (bytearray(b'\x44\x41\x74\x50')
-                        + id.to_bytes(2, 'little')
-                        + bytearray(b'\x00\x00')
-                        + len(response_str).to_bytes(4, 'little')
-                        + response_str.encode('UTF-8'))
-        return img_response
+    def __camea_format(self, id: int, response: dict) -> bytes:
+        return b''.join(encode_frame(msg_id=id, fields=response))
 
     def send_image_found_response(self, conn: socket, id: int, dt_response: datetime,
                                   request: dict, config: dict,
-                                  lp: str = 'AA1234AA', country: str = 'UA') -> None:
+                                  lp: str = 'AA1234AA', country: str = 'UA',
+                                  module_id: str = None) -> None:
         """
         Sends the response to the CAMEA DB Management Software query
         with the found image credentials
@@ -158,31 +177,34 @@ class CameaService:
             Licence plate text
         country: str
             Licence plate country code
+        module_id: str
+            Module id of the camera, the [service] module_id if not given
 
         Output:
         -----------
         """
-        response = self.__detection_request_template(moduleId=config['service']['module_id'],
+        response = self.__detection_request_template(moduleId=(module_id
+                                                               or config['service']['module_id']),
                                                      requestId=request['RequestID'],
                                                      dt_response=dt_response)
         response['LP'] = lp
         response['ILPC'] = country
         response['IsDetection'] = 1 if lp else 0
 
-        response_str = '|'.join([f'{key}:{value}' for key, value in response.items()])
-        response_bytes = self.__camea_format(id=id, response_str=response_str)
+        response_bytes = self.__camea_format(id=id, response=response)
 
         try:
             conn.sendall(response_bytes)
-            logger.info(f"Response to CAMEA DB Management Software at {conn.getpeername()}"
-                        + f"has been sent: {response_bytes}")
+            logger.info("Response to CAMEA DB Management Software at %s has been sent: %s",
+                        conn.getpeername(), truncated(response_bytes))
         except ConnectionResetError:
             raise SocketCorrupted("can't send response message, socket was closed by peer")
         except AttributeError:
             raise SocketCorrupted("can't send response message, non-socket object")
 
     def send_image_not_found_response(self, conn: socket, id: int,
-                                      request: dict, config: dict) -> None:
+                                      request: dict, config: dict,
+                                      module_id: str = None) -> None:
         """
         Sends the response to the CAMEA DB Management Software query
         with the found image credentials
@@ -203,30 +225,31 @@ class CameaService:
             Licence plate text
         country: str
             Licence plate country code
+        module_id: str
+            Module id of the camera, the [service] module_id if not given
 
         Output:
         -----------
         """
         response = dict()
         response['msg'] = 'DetectionRequestRepeat'
-        response['ModuleID'] = config['service']['module_id']
+        response['ModuleID'] = module_id or config['service']['module_id']
         response['RequestID'] = request['RequestID']
         response['ImageID'] = 'NULL'
 
-        response_str = '|'.join([f'{key}:{value}' for key, value in response.items()])
-        response_bytes = self.__camea_format(id=id, response_str=response_str)
+        response_bytes = self.__camea_format(id=id, response=response)
 
         try:
             conn.sendall(response_bytes)
-            logger.info("Response to CAMEA DB Management Software has been sent: "
-                        + f"{response_bytes}")
+            logger.info("Response to CAMEA DB Management Software has been sent: %s",
+                        truncated(response_bytes))
         except ConnectionResetError:
             raise SocketCorrupted("can't send response message, socket was closed by peer")
         except AttributeError:
             raise SocketCorrupted("can't send response message, non-socket object")
 
     def send_stab_image_data(self, id: int, dt_response: datetime,
-                             request: dict, config: dict) -> None:
+                             request: dict, config: dict, module_id: str = None):
         """
         Sends the autogenerated stab images to the Camea Database
 
@@ -240,21 +263,31 @@ class CameaService:
             Original DetectionRequest data from the CAMEA DB Management Software
         config: config
             Query Processor settings
+        module_id: str
+            Module id of the camera, the [service] module_id if not given
 
         Output:
         -----------
+        Future of the upload, see send_image_data()
         """
-        image_generator = ImageGenerator('AA 1234 AA')
+        # images are drawn once and then served from the cache as bytes,
+        # so the frame encoder sends them without copying
+        image_generator = ImageGenerator(
+            'AA 1234 AA',
+            image_size=parse_size(config.get('test', 'image_size', fallback='1920x1080')),
+            lpr_image_size=parse_size(config.get('test', 'lpr_image_size', fallback='400x100')),
+            image_format=config.get('test', 'image_format', fallback='PNG'),
+            quality=config.getint('test', 'jpeg_quality', fallback=85))
         img = dict()
         img['LP'] = 'AA1234AA'
         img['ILPC'] = 'UA'
-        img['LpJpeg'] = image_generator.generate_lpr_image_base64()
-        img['FullImage64'] = image_generator.generate_image_base64()
-        self.send_image_data(id=id, dt_response=dt_response, request=request,
-                             config=config, img=img)
+        img['LpJpeg'] = image_generator.lpr_image_base64()
+        img['FullImage64'] = image_generator.image_base64()
+        return self.send_image_data(id=id, dt_response=dt_response, request=request,
+                                    config=config, img=img, module_id=module_id)
 
     def send_image_data(self, id: int, dt_response: datetime,
-                        request: dict, config: dict, img: dict) -> None:
+                        request: dict, config: dict, img: dict, module_id: str = None):
         """
         Sends the received from the Vidar DB image to the Camea Database
 
@@ -270,30 +303,37 @@ class CameaService:
             Query Processor settings
         img: dict
             Image received from the Vidar database
+        module_id: str
+            Module id of the camera, the [service] module_id if not given
 
         Output:
         -----------
-        # """
-        response = self.__large_detection_template(moduleId=config['service']['module_id'],
+        Future with (Camea DB response, ack RTT) that is done once Camea DB
+        acknowledges the upload, None if the upload was not queued.
+        Failed uploads are written to the spool if it is attached
+        """
+        response = self.__large_detection_template(moduleId=(module_id
+                                                             or config['service']['module_id']),
                                                    dt_response=dt_response)
         response['LPText'] = img['LP']
         response['ILPC'] = img['ILPC']
         response['LpJpeg'] = img['LpJpeg']
         response['FullImage64'] = img['FullImage64']
 
-        response_str = '|'.join([f'{key}:{value}' for key, value in response.items()])
-        img_response = self.__camea_format(id=id, response_str=response_str)
+        # images are written with scatter-gather send without joining into one message
+        img_response = encode_frame(msg_id=id, fields=response)
 
         try:
-            self.conn.sendall(img_response)
-            s2_response = str(self.conn.recv(config.getint('settings', 'buffer')), 'ascii')
-            logger.info(("Send images to CAMEA DB at "
-                         + f"{config['camea_db']['ip']}:{config['camea_db']['port']}"))
-            logger.debug((f"Camea DB response: '{s2_response}'"
-                         + f"from {config['camea_db']['ip']}:{config['camea_db']['port']}"))
-        except ConnectionResetError as e:
-            logger.error(f'Connection to Camea DB was reset by the peer: {e}')
-            self.conn = self.__create_connection()
+            # the frame is pipelined by the connection writer, the ack is handled in callback
+            future = self.pool.submit(msg_id=id, buffers=img_response,
+                                      timeout=CameaService.CONNECTION_TIMEOUT)
+        except ConnectionError as e:
+            UPLOAD_ERRORS.inc()
+            logger.error(f'Images were not sent to Camea DB: {e}')
+            self.__spool(id, img_response)
+            return None
+        future.add_done_callback(functools.partial(self.__upload_done, id, img_response))
+        return future
 
     def close_camea_db_connection(self):
         """
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class _Task:
+    # claimed by the worker that runs it, by the expiry or by the cancelling
+    __slots__ = ('tag', 'fn', 'args', 'kwargs', 'on_expired', 'claimed')
+
+    def __init__(self, tag, fn, args, kwargs, on_expired):
+        self.tag = tag
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_expired = on_expired
+        self.claimed = False
+
+
+class DelayedExecutor:
+    """
+    Class represented delayed execution stage: a timer queue that releases
+    every submitted task at its due time into a bounded worker pool.
+    Submitting never blocks the caller, so socket reads and keep alive
+    messages keep flowing while the tasks are waiting for their time.
+    A task may be given the expiry time: if it has not been started by then
+    (it is still waiting for the due time or for a free worker), it is dropped
+    and its expiry callback is run by the separate thread at once.
+
+    Constants:
+    -----------
+
+    Parameters:
+    -----------
+    workers: int
+        Quantity of worker threads that run the released tasks
+    max_pending: int
+        Maximum quantity of tasks waiting for the due time or for a free worker,
+        new tasks are rejected when the limit is reached
+
+    Methods:
+    -----------
+    submit(delay, fn, *args, tag=None, expires_at=None, on_expired=None, **kwargs) --> bool
+        Schedules fn(*args, **kwargs) to be run in the worker pool after delay seconds
+    cancel(tag) --> int
+        Cancels not yet released tasks with the given tag
+    pending() --> int
+        Returns quantity of tasks that are scheduled or running
+    shutdown() --> None
+        Stops the timer thread and the worker pool
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.__timers = []
+        self.__expiries = []
+        self.__counter = itertools.count()
+        self.__pending = 0
+        self.__running = True
+        self.__condition = threading.Condition()
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+        # expiry callbacks are not queued behind the busy workers
+        self.__expiry_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='expiry')
+        self.__timer_thread = threading.Thread(target=self.__run_timer, name='timer', daemon=True)
+        self.__timer_thread.start()
+
+    def __next_at(self):
+        times = [heap[0][0] for heap in (self.__timers, self.__expiries) if heap]
+        return min(times) if times else None
+
+    def __run_timer(self):
+        while True:
+            with self.__condition:
+                while self.__running:
+                    next_at = self.__next_at()
+                    if next_at is not None and next_at <= time.monotonic():
+                        break
+                    self.__condition.wait(next_at - time.monotonic()
+                                          if next_at is not None else None)
+                if not self.__running:
+                    return
+                now = time.monotonic()
+                expired = []
+                while self.__expiries and self.__expiries[0][0] <= now:
+                    task = heapq.heappop(self.__expiries)[2]
+                    if not task.claimed:
+                        task.claimed = True
+                        self.__pending -= 1
+                        expired.append(task)
+                released = []
+                while self.__timers and self.__timers[0][0] <= now:
+                    task = heapq.heappop(self.__timers)[2]
+                    if not task.claimed:
+                        released.append(task)
+            try:
+                for task in expired:
+                    self.__expiry_pool.submit(self.__expire, task)
+                for task in released:
+                    self.__pool.submit(self.__run_task, task)
+            except RuntimeError:
+                # pool was shut down
+                return
+
+    def __expire(self, task):
+        try:
+            task.on_expired()
+        except Exception as e:
+            logger.exception(e)
+
+    def __run_task(self, task):
+        with self.__condition:
+            if task.claimed:
+                # expired while waiting for a free worker
+                return
+            task.claimed = True
+        try:
+            task.fn(*task.args, **task.kwargs)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            self.__task_done()
+
+    def __task_done(self):
+        with self.__condition:
+            self.__pending -= 1
+
+    def submit(self, delay: float, fn, *args, tag=None, expires_at: float = None,
+               on_expired=None, **kwargs) -> bool:
+        """
+        Schedules fn(*args, **kwargs) to be run in the worker pool after delay seconds
+
+        Parameters:
+        -----------
+        delay: float
+            Delay in seconds before the task is released to the worker pool
+        fn: callable
+            Task to run
+        tag: hashable
+            Optional tag to cancel the task with
+        expires_at: float
+            Optional time.monotonic() after which the task is not started
+        on_expired: callable
+            Called without arguments instead of the task once it expires
+
+        Output:
+        -----------
+        True if the task was scheduled, False if it was rejected
+        """
+        with self.__condition:
+            if not self.__running:
+                return False
+            if self.__pending >= self.max_pending:
+                logger.error(f'Task was rejected: {self.__pending} tasks are already pending')
+                return False
+            self.__pending += 1
+            task = _Task(tag, fn, args, kwargs, on_expired)
+            seq = next(self.__counter)
+            heapq.heappush(self.__timers, (time.monotonic() + delay, seq, task))
+            if expires_at is not None and on_expired is not None:
+                heapq.heappush(self.__expiries, (expires_at, seq, task))
+            self.__condition.notify()
+        return True
+
+    def cancel(self, tag) -> int:
+        """
+        Cancels not yet released tasks with the given tag
+
+        Parameters:
+        -----------
+        tag: hashable
+            Tag that was used during submitting
+
+        Output:
+        -----------
+        Quantity of cancelled tasks
+        """
+        with self.__condition:
+            timers = []
+            cancelled = 0
+            for timer in self.__timers:
+                task = timer[2]
+                if task.tag == tag and not task.claimed:
+                    task.claimed = True
+                    cancelled += 1
+                elif not task.claimed:
+                    timers.append(timer)
+            if len(timers) != len(self.__timers):
+                heapq.heapify(timers)
+                self.__timers = timers
+                self.__pending -= cancelled
+                self.__condition.notify()
+        return cancelled
+
+    def pending(self) -> int:
+        """
+        Returns quantity of tasks that are scheduled or running
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Quantity of pending tasks
+        """
+        with self.__condition:
+            return self.__pending
+
+    def shutdown(self) -> None:
+        """
+        Stops the timer thread and the worker pool,
+        not yet released tasks are dropped
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        with self.__condition:
+            self.__running = False
+            self.__timers.clear()
+            self.__expiries.clear()
+            self.__condition.notify()
+        self.__pool.shutdown(wait=False, cancel_futures=True)
+        self.__expiry_pool.shutdown(wait=False, cancel_futures=True)
@@ -4,3 +4,11 @@ class IncorrectCameaQuery(Exception):
 
 class SocketCorrupted(TimeoutError):
     pass
+
+
+class VidarQueryRejected(Exception):
+    pass
+
+
+class VidarUnavailable(VidarQueryRejected):
+    pass
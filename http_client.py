@@ -0,0 +1,221 @@
+import logging
+import requests
+import threading
+import time
+from requests.adapters import HTTPAdapter
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class EndpointStats:
+    """
+    Class represented latency statistics of the single HTTP endpoint
+
+    Parameters:
+    -----------
+
+    Methods:
+    -----------
+    record(elapsed, ok) --> None
+        Records the result of the single request
+    as_dict() --> dict
+        Returns the statistics as dictionary
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        """
+        Records the result of the single request
+
+        Parameters:
+        -----------
+        elapsed: float
+            Request duration in seconds
+        ok: bool
+            True if the request was successful
+
+        Output:
+        -----------
+        """
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total += elapsed
+        self.last = elapsed
+        self.max = max(self.max, elapsed)
+
+    def as_dict(self) -> dict:
+        """
+        Returns the statistics as dictionary
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Dictionary:
+            'count', 'errors', 'retries', 'avg', 'max', 'last' (seconds)
+        """
+        return {'count': self.count,
+                'errors': self.errors,
+                'retries': self.retries,
+                'avg': self.total / self.count if self.count else 0.0,
+                'max': self.max,
+                'last': self.last}
+
+
+class VidarHttpClient:
+    """
+    Class represented pooled keep-alive HTTP client for the Vidar camera.
+    Keeps the TCP connections warm between requests, applies connect/read
+    deadlines to every request and retries failed requests within the
+    retry budget: every request earns a part of the retry, so retries can
+    not multiply the load on the camera when it is down.
+
+    Constants:
+    -----------
+    RETRY_STATUSES - HTTP statuses that are worth retrying
+
+    Parameters:
+    -----------
+    connect_timeout: float
+        Connect deadline in seconds
+    read_timeout: float
+        Read deadline in seconds
+    retries: int
+        Maximum quantity of retries of the single request
+    pool_size: int
+        Maximum quantity of kept alive connections per host
+    retry_ratio: float
+        Part of the retry earned by every request
+    hosts: int
+        Quantity of the Vidar units the client is shared by
+
+    Methods:
+    -----------
+    get(url, endpoint, stream, retry) --> requests.Response
+        Sends GET request to the url
+    stats() --> dict
+        Returns latency statistics per endpoint
+    close() --> None
+        Closes all the pooled connections
+    """
+
+    RETRY_STATUSES = {502, 503, 504}
+    MAX_RETRY_TOKENS = 10.0
+
+    def __init__(self, connect_timeout: float = 2.0, read_timeout: float = 5.0,
+                 retries: int = 2, pool_size: int = 4, retry_ratio: float = 0.2,
+                 hosts: int = 1):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.retry_ratio = retry_ratio
+        self.__retry_tokens = VidarHttpClient.MAX_RETRY_TOKENS
+        self.__stats = dict()
+        self.__lock = threading.Lock()
+        self.session = requests.Session()
+        # one connection pool is kept per host
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __endpoint_stats(self, endpoint: str) -> EndpointStats:
+        if endpoint not in self.__stats:
+            self.__stats[endpoint] = EndpointStats()
+        return self.__stats[endpoint]
+
+    def __earn_retry(self):
+        with self.__lock:
+            self.__retry_tokens = min(VidarHttpClient.MAX_RETRY_TOKENS,
+                                      self.__retry_tokens + self.retry_ratio)
+
+    def __spend_retry(self, endpoint: str) -> bool:
+        with self.__lock:
+            if self.__retry_tokens < 1:
+                return False
+            self.__retry_tokens -= 1
+            self.__endpoint_stats(endpoint).retries += 1
+            return True
+
+    def get(self, url: str, endpoint: str, stream: bool = False,
+            retry: bool = True) -> requests.Response:
+        """
+        Sends GET request to the url
+
+        Parameters:
+        -----------
+        url: str
+            Request url
+        endpoint: str
+            Endpoint name to collect the statistics for
+        stream: bool
+            If True, the response body is not read in advance
+        retry: bool
+            If False, the failed request is not retried: the requests with side effects
+            (e.g. the software trigger) may have reached the camera before the failure
+
+        Output:
+        -----------
+        requests.Response object
+        """
+        self.__earn_retry()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                r = self.session.get(url, timeout=self.timeout, stream=stream)
+                ok = r.status_code not in VidarHttpClient.RETRY_STATUSES
+            except (requests.ConnectionError, requests.Timeout) as e:
+                r = None
+                ok = False
+                error = e
+            elapsed = time.perf_counter() - start
+            with self.__lock:
+                self.__endpoint_stats(endpoint).record(elapsed, ok)
+            logger.debug("Vidar %s request took %.1f ms", endpoint, elapsed * 1000)
+            if ok:
+                return r
+            if not retry or attempt >= self.retries or not self.__spend_retry(endpoint):
+                if r is None:
+                    raise error
+                return r
+            attempt += 1
+            logger.warning(f"Vidar {endpoint} request failed, retry {attempt} of {self.retries}")
+            if r is not None:
+                r.close()
+
+    def stats(self) -> dict:
+        """
+        Returns latency statistics per endpoint
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Dictionary:
+            'endpoint': statistics dictionary
+        """
+        with self.__lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in self.__stats.items()}
+
+    def close(self) -> None:
+        """
+        Closes all the pooled connections
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.session.close()
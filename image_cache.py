@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """
+    Class represented LRU cache of the parsed Vidar 'getdata' results
+    keyed by the image ID. The cache is bounded by the total size of the
+    cached values in bytes: least recently used images are evicted until
+    the new one fits. Images older than TTL are treated as missing.
+
+    Parameters:
+    -----------
+    max_bytes: int
+        Maximum total size of the cached images in bytes
+    ttl: float
+        Time to live of the cached image in seconds, 0 for no expiration
+
+    Methods:
+    -----------
+    get(id) --> dict
+        Returns the cached image, None if it is not cached
+    put(id, img) --> None
+        Caches the image
+    stats() --> dict
+        Returns hit/miss counters and the cache size
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 60.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.__images = OrderedDict()
+        self.__bytes = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__images)
+
+    def __contains__(self, id):
+        with self.__lock:
+            return self.__lookup(str(id)) is not None
+
+    @staticmethod
+    def __size(img: dict) -> int:
+        return sum(len(value) for value in img.values() if value)
+
+    def __remove(self, key: str):
+        _, size, _ = self.__images.pop(key)
+        self.__bytes -= size
+
+    def __lookup(self, key: str):
+        entry = self.__images.get(key)
+        if entry is None:
+            return None
+        img, _, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.__remove(key)
+            return None
+        return img
+
+    def get(self, id) -> dict:
+        """
+        Returns the cached image
+
+        Parameters:
+        -----------
+        id: str
+            Image ID
+
+        Output:
+        -----------
+        Image dictionary as returned by VidarService.get_data(), None if it is not cached
+        """
+        key = str(id)
+        with self.__lock:
+            img = self.__lookup(key)
+            if img is None:
+                self.__misses += 1
+                return None
+            self.__images.move_to_end(key)
+            self.__hits += 1
+            return img
+
+    def put(self, id, img: dict) -> None:
+        """
+        Caches the image, images larger than the whole budget are not cached
+
+        Parameters:
+        -----------
+        id: str
+            Image ID
+        img: dict
+            Image dictionary as returned by VidarService.get_data()
+
+        Output:
+        -----------
+        """
+        key = str(id)
+        size = ImageCache.__size(img)
+        if size > self.max_bytes:
+            logger.debug('Image %s of %s bytes exceeds the cache budget', id, size)
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self.__lock:
+            if key in self.__images:
+                self.__remove(key)
+            while self.__images and self.__bytes + size > self.max_bytes:
+                _, (_, evicted, _) = self.__images.popitem(last=False)
+                self.__bytes -= evicted
+                self.__evictions += 1
+            self.__images[key] = (img, size, expires_at)
+            self.__bytes += size
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and the cache size
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Dictionary:
+            'hits', 'misses', 'evictions', 'items', 'bytes'
+        """
+        with self.__lock:
+            return {'hits': self.__hits,
+                    'misses': self.__misses,
+                    'evictions': self.__evictions,
+                    'items': len(self.__images),
+                    'bytes': self.__bytes}
@@ -1,47 +1,162 @@
 from PIL import Image, ImageDraw
 import base64
+import threading
+from collections import OrderedDict
 from io import BytesIO
 
 
+def parse_size(value: str) -> tuple:
+    """
+    Parses the image size written as 'WIDTHxHEIGHT'
+
+    Parameters:
+    -----------
+    value: str
+        Image size, e.g. '1920x1080'
+
+    Output:
+    -----------
+    Tuple (width, height)
+    """
+    width, _, height = value.lower().partition('x')
+    size = (int(width), int(height))
+    if min(size) < 1:
+        raise ValueError(f'invalid image size {value}')
+    return size
+
+
 class ImageGenerator:
     """
-    Class represented service for generating stab images
+    Class represented service for generating stab images.
+    Encoded images are kept in the bounded LRU cache shared by all the
+    generators and keyed by (text, size, format), so the same stab image
+    is drawn and encoded only once.
 
     Constants:
     -----------
+    FORMATS - supported image formats
+    CACHE_SIZE - maximum quantity of cached encoded images
 
     Parameters:
     -----------
     plate_number: str
         plate number to put into the picture
+    image_size: tuple
+        (width, height) of the vehicle image
+    lpr_image_size: tuple
+        (width, height) of the plate image
+    image_format: str
+        PNG or JPEG
+    quality: int
+        JPEG quality
 
     Methods:
     def generate_image_base64() --> base64 str
-        Returns generated 1920x1080 stab image with plate number
+        Returns generated stab image with plate number
         in the center in the base64 string format
     def generate_lpr_image_base64() --> base64 str
-        Returns generated 400x100 stab plate image with plate number
+        Returns generated stab plate image with plate number
         in the center in the base64 string format
+    def image_base64() --> base64 bytes
+        Same as generate_image_base64() returning cached bytes without copying
+    def lpr_image_base64() --> base64 bytes
+        Same as generate_lpr_image_base64() returning cached bytes without copying
+    def cache_info() --> dict
+        Returns the image cache statistics
     """
 
-    def __init__(self, text=''):
+    FORMATS = ('PNG', 'JPEG')
+    CACHE_SIZE = 32
+
+    __cache = OrderedDict()
+    __cache_lock = threading.Lock()
+    __hits = 0
+    __misses = 0
+
+    def __init__(self, text='', image_size: tuple = (1920, 1080),
+                 lpr_image_size: tuple = (400, 100), image_format: str = 'PNG',
+                 quality: int = 85):
+        if image_format.upper() not in ImageGenerator.FORMATS:
+            raise ValueError(f'unsupported image format {image_format}')
         self.text = text
+        self.image_size = tuple(image_size)
+        self.lpr_image_size = tuple(lpr_image_size)
+        self.image_format = image_format.upper()
+        self.quality = quality
 
     def __generate_image(self):
-        img = Image.new('RGB', (1920, 1080), color=(0, 0, 0))
+        img = Image.new('RGB', self.image_size, color=(0, 0, 0))
         d = ImageDraw.Draw(img)
-        d.text((960, 540), self.text, anchor="mm", fill=(255, 255, 255), font_size=30)
+        d.text((self.image_size[0] // 2, self.image_size[1] // 2), self.text,
+               anchor="mm", fill=(255, 255, 255), font_size=30)
         return img
 
     def __generate_lpr_image(self):
-        img = Image.new('RGB', (400, 100), color=(240, 240, 240))
+        img = Image.new('RGB', self.lpr_image_size, color=(240, 240, 240))
         d = ImageDraw.Draw(img)
-        d.text((200, 50), self.text, anchor="mm", fill=(0, 0, 0), font_size=30)
+        d.text((self.lpr_image_size[0] // 2, self.lpr_image_size[1] // 2), self.text,
+               anchor="mm", fill=(0, 0, 0), font_size=30)
         return img
 
+    def __encode(self, img) -> bytes:
+        buffered = BytesIO()
+        if self.image_format == 'JPEG':
+            img.save(buffered, format='JPEG', quality=self.quality)
+        else:
+            img.save(buffered, format='PNG')
+        return base64.b64encode(buffered.getbuffer())
+
+    def __cached(self, kind: str, size: tuple, draw) -> bytes:
+        key = (kind, self.text, size, self.image_format,
+               self.quality if self.image_format == 'JPEG' else None)
+        cls = ImageGenerator
+        with cls.__cache_lock:
+            img_bytes = cls.__cache.get(key)
+            if img_bytes is not None:
+                cls.__cache.move_to_end(key)
+                cls.__hits += 1
+                return img_bytes
+            cls.__misses += 1
+        # drawing is done outside the lock, a concurrent miss only wastes one encoding
+        img_bytes = self.__encode(draw())
+        with cls.__cache_lock:
+            cls.__cache[key] = img_bytes
+            cls.__cache.move_to_end(key)
+            while len(cls.__cache) > cls.CACHE_SIZE:
+                cls.__cache.popitem(last=False)
+        return img_bytes
+
+    def image_base64(self) -> bytes:
+        """
+        Returns generated stab image with plate number
+        in the center in the base64 format as cached bytes
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Stab image in base64 format, ASCII bytes
+        """
+        return self.__cached('image', self.image_size, self.__generate_image)
+
+    def lpr_image_base64(self) -> bytes:
+        """
+        Returns generated stab plate image with plate number
+        in the center in the base64 format as cached bytes
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Stab plate image in base64 format, ASCII bytes
+        """
+        return self.__cached('lpr', self.lpr_image_size, self.__generate_lpr_image)
+
     def generate_image_base64(self):
         """
-        Returns generated 1920x1080 stab image with plate number
+        Returns generated stab image with plate number
         in the center in the base64 string format
 
         Parameters:
@@ -51,15 +166,11 @@ class ImageGenerator:
         -----------
         Stab image in base64 format
         """
-        img = self.__generate_image()
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue())
-        return img_str.decode()
+        return self.image_base64().decode()
 
     def generate_lpr_image_base64(self):
         """
-        Returns generated 400x100 stab plate image with plate number
+        Returns generated stab plate image with plate number
         in the center in the base64 string format
 
         Parameters:
@@ -69,11 +180,23 @@ class ImageGenerator:
         -----------
         Stab plate image in base64 format
         """
-        img = self.__generate_lpr_image()
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue())
-        return img_str.decode()
+        return self.lpr_image_base64().decode()
+
+    @classmethod
+    def cache_info(cls) -> dict:
+        """
+        Returns the image cache statistics
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Dictionary:
+            'hits', 'misses', 'size'
+        """
+        with cls.__cache_lock:
+            return {'hits': cls.__hits, 'misses': cls.__misses, 'size': len(cls.__cache)}
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+import itertools
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from camea_protocol import FrameDecoder
+from metrics import REGISTRY
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# journal file signature
+MAGIC = b'CQJ1'
+# record header: arrival time (s since 1970), session id, frame length
+RECORD = struct.Struct('<dHI')
+
+DROPPED = REGISTRY.counter('journal_frames_dropped_total',
+                           'Inbound frames not captured because the journal writer fell behind')
+
+
+class JournalWriter:
+    """
+    Class represented capture journal of the inbound Camea Management frames.
+    The journal is the binary file starting with the signature and followed by
+    records: arrival time, session (connection) id, frame length and the frame
+    bytes as they were received. Frames decoded from one received chunk are
+    packed on the receiving thread and written with a single write by the
+    writer thread, so a slow disk never stalls the request intake: records
+    that do not fit into the bounded queue are dropped and counted.
+    Capture stops when the journal reaches the size limit.
+
+    Constants:
+    -----------
+    CLOSE_TIMEOUT - time to wait for the queued records to be written on close
+
+    Parameters:
+    -----------
+    path: str
+        Journal file path, the records are appended to the existing journal
+    max_size: int
+        Journal size limit in bytes
+    queue_size: int
+        Maximum quantity of the received chunks waiting to be written
+
+    Methods:
+    -----------
+    session() --> int
+        Returns id for the new connection
+    record(frames, session) --> None
+        Queues the frames received at the moment
+    close() --> None
+        Writes the queued records and closes the journal
+    """
+
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, path: str, max_size: int, queue_size: int = 1024):
+        self.path = path
+        self.max_size = max_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__file = open(path, 'ab', buffering=0)
+        if self.__file.tell() == 0:
+            self.__file.write(MAGIC)
+        self.__size = self.__file.tell()
+        self.__sessions = itertools.count()
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__writer = threading.Thread(target=self.__write, name='journal_writer', daemon=True)
+        self.__writer.start()
+        logger.info(f'Inbound frames are captured to {path}')
+
+    def session(self) -> int:
+        """
+        Returns id for the new connection
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Session id
+        """
+        return next(self.__sessions) % 0x10000
+
+    def record(self, frames: list, session: int) -> None:
+        """
+        Queues the frames received at the moment, the frames are dropped
+        if the writer does not keep up
+
+        Parameters:
+        -----------
+        frames: list
+            Frames decoded from the received chunk
+        session: int
+            Id of the connection the frames were received from
+
+        Output:
+        -----------
+        """
+        if not frames or self.__file is None:
+            return
+        arrived_at = time.time()
+        records = bytearray()
+        for frame in frames:
+            data = frame.to_bytes()
+            records += RECORD.pack(arrived_at, session, len(data))
+            records += data
+        try:
+            self.__queue.put_nowait(records)
+        except queue.Full:
+            DROPPED.inc(len(frames))
+
+    def __write(self):
+        while True:
+            records = self.__queue.get()
+            if records is None:
+                break
+            if self.__file is None:
+                continue
+            if self.__size + len(records) > self.max_size:
+                logger.warning(f'Journal {self.path} reached the size limit, capture stopped')
+                self.__close()
+                continue
+            try:
+                self.__file.write(records)
+            except OSError as e:
+                logger.error(f'Journal {self.path} write failed, capture stopped: {e}')
+                self.__close()
+                continue
+            self.__size += len(records)
+        self.__close()
+
+    def __close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def close(self) -> None:
+        """
+        Writes the queued records and closes the journal
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        try:
+            self.__queue.put(None, timeout=JournalWriter.CLOSE_TIMEOUT)
+        except queue.Full:
+            logger.error(f'Journal {self.path} writer is stuck, the queued records are lost')
+            return
+        self.__writer.join(JournalWriter.CLOSE_TIMEOUT)
+
+
+def read_journal(path: str):
+    """
+    Reads the capture journal
+
+    Parameters:
+    -----------
+    path: str
+        Journal file path
+
+    Output:
+    -----------
+    Generator of tuples (arrival time, session id, Frame),
+    the incomplete last record is skipped
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a capture journal')
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            arrived_at, session, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            for frame in FrameDecoder().feed(data):
+                yield arrived_at, session, frame
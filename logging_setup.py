@@ -0,0 +1,228 @@
+import atexit
+import configparser
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from metrics import REGISTRY
+
+
+LOG_FORMAT = "%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s"
+LOG_DATEFMT = "%d.%m.%Y %H:%M:%S"
+
+DROPPED = REGISTRY.counter('log_records_dropped_total',
+                           'Log records dropped because the logging queue was full')
+SUPPRESSED = REGISTRY.counter('log_records_suppressed_total',
+                              'DEBUG log records suppressed by the rate limit')
+
+# payload length kept in the log messages, see truncated()
+PAYLOAD_LIMIT = 256
+
+
+class truncated:
+    """
+    Class represented lazily truncated payload for the log messages:
+    the payload is converted to text only if the record is emitted,
+    the text is cut to PAYLOAD_LIMIT characters
+
+    Parameters:
+    -----------
+    payload: str, bytes or any object
+        Logged payload
+
+    Methods:
+    -----------
+    __str__() --> str
+        Returns the truncated payload text
+    """
+
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        payload = self.payload
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            size = len(payload)
+            text = str(bytes(payload[:PAYLOAD_LIMIT]))
+        else:
+            text = str(payload)
+            size = len(text)
+        if size > PAYLOAD_LIMIT:
+            return f'{text[:PAYLOAD_LIMIT]}... ({size} total)'
+        return text
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Class represented filter that limits DEBUG records of every call site
+    (logger, source file and line) to the given rate. The quantity of the
+    suppressed records is added to the next passed record of the call site.
+    Call sites are keyed by the source line, so the messages formatted
+    before the logging call are limited too and the state stays bounded.
+
+    Parameters:
+    -----------
+    rate: float
+        Records per second passed for the single call site
+    burst: int
+        Records passed at once before the rate limit applies
+
+    Methods:
+    -----------
+    filter(record) --> bool
+        Checks if the record is passed
+    """
+
+    def __init__(self, rate: float, burst: int = 10):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # call site: (tokens, last update, suppressed records)
+        self.__sites = dict()
+        self.__lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Checks if the record is passed
+
+        Parameters:
+        -----------
+        record: LogRecord
+            Logged record
+
+        Output:
+        -----------
+        True if the record is passed
+        """
+        if record.levelno > logging.DEBUG:
+            return True
+        # the record is passed to every handler, it is checked once
+        passed = getattr(record, 'rate_limit_passed', None)
+        if passed is not None:
+            return passed
+        record.rate_limit_passed = self.__check(record)
+        return record.rate_limit_passed
+
+    def __check(self, record: logging.LogRecord) -> bool:
+        site = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.__lock:
+            tokens, updated, suppressed = self.__sites.get(site, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.__sites[site] = (tokens, now, suppressed + 1)
+                SUPPRESSED.inc()
+                return False
+            self.__sites[site] = (tokens - 1, now, 0)
+        if suppressed:
+            record.msg = f'{record.msg} ({suppressed} similar records suppressed)'
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Class represented queue handler that never blocks the logging thread:
+    records are dropped and counted when the queue is full
+
+    Parameters:
+    -----------
+    queue: Queue
+        Bounded queue the records are put into
+
+    Methods:
+    -----------
+    enqueue(record) --> None
+        Puts the record into the queue, drops it if the queue is full
+    """
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Puts the record into the queue, drops it if the queue is full
+
+        Parameters:
+        -----------
+        record: LogRecord
+            Prepared record
+
+        Output:
+        -----------
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+def setup_logging(log_file: str, config_file: str = 'config.ini') -> None:
+    """
+    Sets up logging to the rotating log file (INFO and above) and to stdout
+    with the [logging] settings of the configuration file.
+    In the queued mode the request threads only put the records into the
+    queue, the files and the console are written by the listener thread
+
+    Parameters:
+    -----------
+    log_file: str
+        Log file path relative to the working directory
+    config_file: str
+        Configuration file with the optional [logging] section
+
+    Output:
+    -----------
+    """
+    global PAYLOAD_LIMIT
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    error = None
+    try:
+        queued = config.getboolean('logging', 'queued', fallback=True)
+        queue_size = config.getint('logging', 'queue_size', fallback=10_000)
+        debug_rate = config.getfloat('logging', 'debug_rate', fallback=20.0)
+        payload_limit = config.getint('logging', 'payload_limit', fallback=256)
+        if queue_size < 1 or payload_limit < 1:
+            raise ValueError('queue_size and payload_limit must be positive')
+    except ValueError as e:
+        # logging is set up with the defaults, the error is logged once it is set up
+        error = e
+        queued, queue_size, debug_rate, payload_limit = True, 10_000, 20.0, 256
+    PAYLOAD_LIMIT = payload_limit
+
+    formatter = logging.Formatter(fmt=LOG_FORMAT, datefmt=LOG_DATEFMT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        filename=os.path.join(os.getcwd(), log_file),
+        encoding="utf-8",
+        mode="a",
+        maxBytes=1_000_000,
+        backupCount=5,
+    )
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler(stream=sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers = [file_handler, stream_handler]
+
+    if queued:
+        log_queue = queue.Queue(maxsize=queue_size)
+        listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                                  respect_handler_level=True)
+        listener.start()
+        # the queued records are written out on exit
+        atexit.register(listener.stop)
+        handlers = [DroppingQueueHandler(log_queue)]
+    if debug_rate > 0:
+        rate_limit = RateLimitFilter(rate=debug_rate)
+        for handler in handlers:
+            handler.addFilter(rate_limit)
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    for handler in handlers:
+        root.addHandler(handler)
+    if error is not None:
+        logging.getLogger(__name__).error(
+            f'Invalid data in logging section, the defaults are used: {error}')
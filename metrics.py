@@ -0,0 +1,402 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# default latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: dict, extra: dict = None) -> str:
+    items = dict(labels)
+    if extra:
+        items.update(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items.items()) + '}'
+
+
+class Counter:
+    """
+    Class represented monotonically increasing counter
+
+    Parameters:
+    -----------
+    name: str
+        Metric name
+    labels: dict
+        Metric labels
+
+    Methods:
+    -----------
+    inc(value) --> None
+        Increases the counter
+    """
+
+    TYPE = 'counter'
+
+    def __init__(self, name: str, labels: dict = None):
+        self.name = name
+        self.labels = labels or dict()
+        self.__value = 0
+        self.__lock = threading.Lock()
+
+    def inc(self, value: float = 1) -> None:
+        """
+        Increases the counter
+
+        Parameters:
+        -----------
+        value: float
+            Increment
+
+        Output:
+        -----------
+        """
+        with self.__lock:
+            self.__value += value
+
+    def samples(self) -> list:
+        return [(self.name + _format_labels(self.labels), self.__value)]
+
+
+class Gauge:
+    """
+    Class represented value that is read from the callback on every scrape
+
+    Parameters:
+    -----------
+    name: str
+        Metric name
+    fn: callable
+        Returns the current value
+    labels: dict
+        Metric labels
+    kind: str
+        Reported metric type, 'gauge' or 'counter' for the counters kept elsewhere
+    """
+
+    def __init__(self, name: str, fn, labels: dict = None, kind: str = 'gauge'):
+        self.name = name
+        self.fn = fn
+        self.labels = labels or dict()
+        self.TYPE = kind
+
+    def samples(self) -> list:
+        return [(self.name + _format_labels(self.labels), self.fn())]
+
+
+class Histogram:
+    """
+    Class represented histogram with the fixed buckets.
+    Observing is a bisect and two additions under the lock,
+    cumulative counts are computed only on scrape
+
+    Parameters:
+    -----------
+    name: str
+        Metric name
+    labels: dict
+        Metric labels
+    buckets: tuple
+        Sorted upper bounds of the buckets
+
+    Methods:
+    -----------
+    observe(value) --> None
+        Records the single value
+    time() --> context manager
+        Records duration of the with block in seconds
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, labels: dict = None, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels or dict()
+        self.buckets = tuple(buckets)
+        self.__counts = [0] * (len(self.buckets) + 1)
+        self.__sum = 0.0
+        self.__lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """
+        Records the single value
+
+        Parameters:
+        -----------
+        value: float
+            Observed value
+
+        Output:
+        -----------
+        """
+        position = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            self.__counts[position] += 1
+            self.__sum += value
+
+    def time(self):
+        """
+        Records duration of the with block in seconds
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Context manager
+        """
+        return _Timer(self)
+
+    def samples(self) -> list:
+        with self.__lock:
+            counts = list(self.__counts)
+            total = self.__sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples.append((self.name + '_bucket' + _format_labels(self.labels, {'le': le}),
+                            cumulative))
+        samples.append((self.name + '_sum' + _format_labels(self.labels), total))
+        samples.append((self.name + '_count' + _format_labels(self.labels), cumulative))
+        return samples
+
+
+class _Timer:
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Class represented registry of the service metrics rendered
+    in the Prometheus text format
+
+    Parameters:
+    -----------
+
+    Methods:
+    -----------
+    counter(name, help, labels) --> Counter
+        Returns the registered counter
+    histogram(name, help, labels, buckets) --> Histogram
+        Returns the registered histogram
+    gauge(name, help, fn, labels, kind) --> Gauge
+        Registers the callback gauge, replaces the one with the same name and labels
+    render() --> str
+        Returns all the metrics in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.__metrics = dict()
+        self.__help = dict()
+        self.__lock = threading.Lock()
+
+    def __register(self, cls, name: str, help: str, labels: dict, replace: bool, **kwargs):
+        key = (name, tuple(sorted((labels or dict()).items())))
+        with self.__lock:
+            metric = self.__metrics.get(key)
+            if metric is None or replace:
+                metric = cls(name=name, labels=labels, **kwargs)
+                self.__metrics[key] = metric
+                self.__help[name] = help
+            return metric
+
+    def counter(self, name: str, help: str, labels: dict = None) -> Counter:
+        """
+        Returns the registered counter, creates it on the first call
+
+        Parameters:
+        -----------
+        name: str
+            Metric name
+        help: str
+            Metric description
+        labels: dict
+            Metric labels
+
+        Output:
+        -----------
+        Counter object
+        """
+        return self.__register(Counter, name, help, labels, replace=False)
+
+    def histogram(self, name: str, help: str, labels: dict = None,
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        """
+        Returns the registered histogram, creates it on the first call
+
+        Parameters:
+        -----------
+        name: str
+            Metric name
+        help: str
+            Metric description
+        labels: dict
+            Metric labels
+        buckets: tuple
+            Sorted upper bounds of the buckets
+
+        Output:
+        -----------
+        Histogram object
+        """
+        return self.__register(Histogram, name, help, labels, replace=False, buckets=buckets)
+
+    def gauge(self, name: str, help: str, fn, labels: dict = None,
+              kind: str = 'gauge') -> Gauge:
+        """
+        Registers the gauge that is read from the callback on every scrape
+
+        Parameters:
+        -----------
+        name: str
+            Metric name
+        help: str
+            Metric description
+        fn: callable
+            Returns the current value
+        labels: dict
+            Metric labels
+        kind: str
+            Reported metric type, 'gauge' or 'counter'
+
+        Output:
+        -----------
+        Gauge object
+        """
+        return self.__register(Gauge, name, help, labels, replace=True, fn=fn, kind=kind)
+
+    def render(self) -> str:
+        """
+        Returns all the metrics in the Prometheus text format
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Metrics text
+        """
+        with self.__lock:
+            metrics = sorted(self.__metrics.items(), key=lambda item: item[0])
+            help = dict(self.__help)
+        lines = []
+        described = set()
+        for (name, _), metric in metrics:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {help[name]}')
+                lines.append(f'# TYPE {name} {metric.TYPE}')
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f'Failed to collect metric {name}: {e}')
+                continue
+            for sample, value in samples:
+                lines.append(f'{sample} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# registry shared by all the service modules
+REGISTRY = MetricsRegistry()
+
+# counted by both the blocking and the asyncio server modes
+CONNECTIONS = REGISTRY.counter('camea_management_connections_total',
+                               'Connections accepted from Camea Management System')
+
+
+class MetricsServer:
+    """
+    Class represented local HTTP server exposing the registry on /metrics
+
+    Parameters:
+    -----------
+    host: str
+        Address to listen on
+    port: int
+        Port to listen on
+    registry: MetricsRegistry
+        Registry to expose
+
+    Methods:
+    -----------
+    start() --> None
+        Starts serving in the background thread
+    stop() --> None
+        Stops serving
+    """
+
+    def __init__(self, host: str, port: int, registry: MetricsRegistry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.__server = None
+
+    def start(self) -> None:
+        """
+        Starts serving in the background thread
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('UTF-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self.__server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, name='metrics',
+                         daemon=True).start()
+        logger.info(f'Metrics are served at http://{self.host}:{self.port}/metrics')
+
+    def stop(self) -> None:
+        """
+        Stops serving
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
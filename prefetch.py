@@ -0,0 +1,111 @@
+import logging
+from delayed_executor import DelayedExecutor
+from transit_index import poll_transits
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class VidarPrefetcher:
+    """
+    Class represented prefetching of the Vidar data on the software trigger.
+    A short time after the trigger the new cffresult rows are polled into the
+    transit index and the 'getdata' results of the newest of them are put into
+    the image cache, so the matching DetectionRequest finds both in memory.
+
+    Parameters:
+    -----------
+    vidar_service: VidarService
+        Service with the attached transit index and image cache
+    delay: float
+        Time in seconds between the trigger and the prefetch
+    zone: list
+        List of appropriate zones to prefetch images for, '0' to ignore zones
+    max_images: int
+        Maximum quantity of images prefetched on the single trigger
+
+    Methods:
+    -----------
+    trigger() --> bool
+        Schedules the prefetch after the delay
+    attach(vidar_service, zone) --> None
+        Replaces the prefetched Vidar service
+    shutdown() --> None
+        Stops the prefetch timer
+    """
+
+    def __init__(self, vidar_service, delay: float, zone, max_images: int = 4):
+        self.attach(vidar_service, zone)
+        self.delay = delay
+        self.max_images = max_images
+        # triggers are prefetched one by one, a burst of them is served by the first poll
+        self.__executor = DelayedExecutor(workers=1, max_pending=16)
+
+    def __prefetch(self):
+        # the service may be replaced by attach() during the prefetch
+        vidar_service, zone = self.__target
+        rows = poll_transits(vidar_service, vidar_service.index)
+        ids = vidar_service.filter_ids(rows, zone)
+        newest = sorted(ids.items(), key=lambda item: int(item[0]))[-self.max_images:]
+        fetched = 0
+        for _, id in newest:
+            if vidar_service.is_cached(id):
+                continue
+            # received images are put into the cache by the vidar service
+            if vidar_service.get_data(id):
+                fetched += 1
+        logger.debug('%s new transits were polled, %s images were prefetched', len(rows), fetched)
+
+    def trigger(self) -> bool:
+        """
+        Schedules the prefetch after the delay
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        True if the prefetch was scheduled
+        """
+        return self.__executor.submit(self.delay, self.__prefetch)
+
+    @property
+    def vidar_service(self):
+        return self.__target[0]
+
+    @property
+    def zone(self):
+        return self.__target[1]
+
+    def attach(self, vidar_service, zone) -> None:
+        """
+        Replaces the prefetched Vidar service, e.g. once the camera is moved
+        to another Vidar unit by the configuration reload
+
+        Parameters:
+        -----------
+        vidar_service: VidarService
+            Service with the attached transit index and image cache
+        zone: list
+            List of appropriate zones to prefetch images for, '0' to ignore zones
+
+        Output:
+        -----------
+        """
+        if vidar_service.index is None or vidar_service.cache is None:
+            raise ValueError('Vidar service has no transit index or image cache attached')
+        # single reference assignment, the running prefetch keeps its service
+        self.__target = (vidar_service, zone)
+
+    def shutdown(self) -> None:
+        """
+        Stops the prefetch timer
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.__executor.shutdown()
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class RangeQueryBatcher:
+    """
+    Class represented micro-batching stage in front of the Vidar range queries.
+    The first caller of the batch waits for the batch window, then the ranges
+    of all the callers collected meanwhile are merged and queried at once,
+    the received rows are split back into the range of every caller.
+    Ranges that are too far from each other are queried separately,
+    so one batch never asks for a long stretch of rows nobody needs.
+
+    Parameters:
+    -----------
+    fetch_rows: callable
+        fetch_rows(t1, t2) --> list of (timestamp, image ID, zone) from the range (t1; t2)
+    window: float
+        Batch window in seconds
+    max_gap: int
+        Maximum gap in ms between the ranges merged into one query
+
+    Methods:
+    -----------
+    get_rows(t1, t2) --> list
+        Returns list of (timestamp, ID, zone) of all the images from the range (t1; t2)
+    stats() --> dict
+        Returns quantities of the served ranges and the sent queries
+    """
+
+    def __init__(self, fetch_rows, window: float, max_gap: int = 1_000):
+        self.fetch_rows = fetch_rows
+        self.window = window
+        self.max_gap = max_gap
+        self.__pending = []
+        self.__collecting = False
+        self.__ranges = 0
+        self.__queries = 0
+        self.__lock = threading.Lock()
+
+    def __merge(self, batch: list) -> list:
+        # group the ranges sorted by start into the clusters of close ranges
+        clusters = []
+        for t1, t2, future in sorted(batch, key=lambda request: request[0]):
+            if clusters and t1 - clusters[-1][1] <= self.max_gap:
+                cluster = clusters[-1]
+                cluster[1] = max(cluster[1], t2)
+                cluster[2].append((t1, t2, future))
+            else:
+                clusters.append([t1, t2, [(t1, t2, future)]])
+        return clusters
+
+    def __run(self, batch: list):
+        clusters = self.__merge(batch)
+        with self.__lock:
+            self.__ranges += len(batch)
+            self.__queries += len(clusters)
+        if len(batch) > 1:
+            logger.debug('%s Vidar range queries were merged into %s', len(batch), len(clusters))
+        for t1, t2, requests in clusters:
+            try:
+                rows = self.fetch_rows(t1, t2)
+            except Exception as e:
+                for _, _, future in requests:
+                    future.set_exception(e)
+                continue
+            for r1, r2, future in requests:
+                future.set_result([row for row in rows if r1 < row[0] < r2])
+
+    def get_rows(self, t1: int, t2: int) -> list:
+        """
+        Returns list of (timestamp, ID, zone) of all the images
+        from the range (t1; t2)
+
+        Parameters:
+        -----------
+        t1: int
+            Range start in ms since 1970
+        t2: int
+            Range end in ms since 1970
+
+        Output:
+        -----------
+        List of tuples:
+            (timestamp: int, image ID: str, zone: str)
+        """
+        future = Future()
+        with self.__lock:
+            self.__pending.append((t1, t2, future))
+            leader = not self.__collecting
+            self.__collecting = True
+        if leader:
+            # collect the ranges of the other callers and query them all at once
+            time.sleep(self.window)
+            with self.__lock:
+                batch = self.__pending
+                self.__pending = []
+                self.__collecting = False
+            self.__run(batch)
+        return future.result()
+
+    def stats(self) -> dict:
+        """
+        Returns quantities of the served ranges and the sent queries
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Dictionary:
+            'ranges', 'queries'
+        """
+        with self.__lock:
+            return {'ranges': self.__ranges, 'queries': self.__queries}
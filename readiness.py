@@ -0,0 +1,172 @@
+import collections
+import logging
+import threading
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class ReadinessPolicy:
+    """
+    Class represented deadline-driven polling policy for the Vidar lookups.
+    Instead of waiting the fixed time after the DetectionRequest arrival,
+    Vidar is queried early and the query is retried with backoff until the
+    matching row is ready or the deadline passes.
+    The lag between the request arrival and the moment its row appears in
+    Vidar is learned from the lookups that missed the row and found it on
+    the retry: the row appeared between the two queries. The hit of the first
+    query only tells the lag is shorter, so it is not recorded as the lag;
+    the next first query is sent earlier instead (FIRST_ATTEMPT_FACTOR per
+    hit in a row), until a miss measures the lag of the faster Vidar again.
+    A hit is accepted early once the rows are expected to be complete.
+
+    Constants:
+    -----------
+    MIN_SAMPLES - quantity of the measured lags needed to trust the estimate
+    FIRST_ATTEMPT_FACTOR - part of the typical lag the first query is sent at,
+        applied once more for every first query hit in a row
+    READY_QUANTILE - lag quantile after which the found rows are treated as complete
+    BACKOFF_MIN, BACKOFF_MAX - range of the delays between retries in seconds
+
+    Parameters:
+    -----------
+    max_wait: float
+        Deadline of the lookup in seconds since the request arrival
+    window: int
+        Quantity of the latest measured lags the lag is estimated from
+
+    Methods:
+    -----------
+    first_delay() --> float
+        Returns delay of the first query in seconds since the request arrival
+    next_delay(attempt, elapsed) --> float
+        Returns delay of the next query, None when the deadline has passed
+    is_ready(vidar_ids, transit_ts, elapsed) --> bool
+        Checks if the found rows can be used without waiting for more rows
+    observe(elapsed, previous) --> None
+        Records the row found at elapsed after the miss at previous
+    lag(quantile) --> float
+        Returns the lag quantile in seconds
+    """
+
+    MIN_SAMPLES = 10
+    FIRST_ATTEMPT_FACTOR = 0.8
+    READY_QUANTILE = 0.9
+    BACKOFF_MIN = 0.1
+    BACKOFF_MAX = 1.0
+
+    def __init__(self, max_wait: float, window: int = 20):
+        self.max_wait = max_wait
+        self.__samples = collections.deque(maxlen=window)
+        # first query hits since the last measured lag
+        self.__early_hits = 0
+        self.__lock = threading.Lock()
+
+    def lag(self, quantile: float) -> float:
+        """
+        Returns the lag quantile
+
+        Parameters:
+        -----------
+        quantile: float
+            Quantile in range 0..1
+
+        Output:
+        -----------
+        Lag in seconds, None while there are not enough measured lags
+        """
+        with self.__lock:
+            if len(self.__samples) < ReadinessPolicy.MIN_SAMPLES:
+                return None
+            samples = sorted(self.__samples)
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def first_delay(self) -> float:
+        """
+        Returns delay of the first query in seconds since the request arrival,
+        the whole max_wait until the lag is learned (less after the first query hits)
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Delay in seconds
+        """
+        lag = self.lag(0.5)
+        with self.__lock:
+            early_hits = self.__early_hits
+        if lag is None:
+            return self.max_wait * ReadinessPolicy.FIRST_ATTEMPT_FACTOR ** early_hits
+        return min(self.max_wait, lag * ReadinessPolicy.FIRST_ATTEMPT_FACTOR ** (1 + early_hits))
+
+    def next_delay(self, attempt: int, elapsed: float) -> float:
+        """
+        Returns delay of the next query, the last query is sent at the deadline
+
+        Parameters:
+        -----------
+        attempt: int
+            Number of the failed query, starting with 1
+        elapsed: float
+            Time in seconds since the request arrival
+
+        Output:
+        -----------
+        Delay in seconds, None when the deadline has passed
+        """
+        remaining = self.max_wait - elapsed
+        if remaining < ReadinessPolicy.BACKOFF_MIN / 10:
+            return None
+        backoff = ReadinessPolicy.BACKOFF_MIN * 2 ** (attempt - 1)
+        return min(backoff, ReadinessPolicy.BACKOFF_MAX, remaining)
+
+    def is_ready(self, vidar_ids: dict, transit_ts: int, elapsed: float) -> bool:
+        """
+        Checks if the found rows can be used without waiting for more rows:
+        the row taken after the transit is already there (Vidar rows arrive
+        in time order) or the rows are expected to be complete by now
+
+        Parameters:
+        -----------
+        vidar_ids: dict
+            Found rows, 'timestamp': image ID
+        transit_ts: int
+            Requested transit timestamp in ms since 1970
+        elapsed: float
+            Time in seconds since the request arrival
+
+        Output:
+        -----------
+        True if the rows can be used
+        """
+        if not vidar_ids:
+            return False
+        if any(int(timestamp) >= transit_ts for timestamp in vidar_ids):
+            return True
+        lag = self.lag(ReadinessPolicy.READY_QUANTILE)
+        return lag is not None and elapsed >= lag
+
+    def observe(self, elapsed: float, previous: float = None) -> None:
+        """
+        Records the row found at elapsed after the miss at previous
+
+        Parameters:
+        -----------
+        elapsed: float
+            Time in seconds since the request arrival the row was found at
+        previous: float
+            Time of the previous query that missed the row, None for the first query
+
+        Output:
+        -----------
+        """
+        with self.__lock:
+            if previous is None:
+                # the row was there before the first query, the lag is not measured
+                self.__early_hits += 1
+                return
+            self.__early_hits = 0
+            # the row appeared between the two queries
+            self.__samples.append((elapsed + previous) / 2)
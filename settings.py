@@ -0,0 +1,279 @@
+import configparser
+import logging
+import os
+import threading
+import zoneinfo
+from dataclasses import dataclass, field
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+# prefix of the config sections describing the additional cameras
+CAMERA_SECTION = 'camera:'
+
+
+def parse_zones(zone: str) -> frozenset:
+    """
+    Parses the zone setting
+
+    Parameters:
+    -----------
+    zone: str
+        Zones separated by comma, '0' to ignore zones
+
+    Output:
+    -----------
+    Frozenset of zones, empty to ignore zones
+    """
+    if zone.strip() == '0':
+        return frozenset()
+    return frozenset(z.strip() for z in zone.split(','))
+
+
+@dataclass(frozen=True)
+class Camera:
+    """
+    Class represented single camera (lane) served by the query processor:
+    the Vidar unit it is looked up in and the module id of the responses
+
+    Parameters:
+    -----------
+    name: str
+        Camera name, 'default' for the camera of the [service] and [vidar] sections
+    unit_id: str
+        Value of the DetectionRequest route field the camera is chosen by
+    module_id: str
+        Module id put into the responses
+    ip: str
+        Vidar camera IP address
+    tolerance: int
+        Search tolerance in ms, 0 to use the tolerance from the request
+    zones: frozenset
+        Appropriate vidar zones, empty to ignore zones
+
+    Methods:
+    -----------
+    zone_filter --> frozenset or '0'
+        Zones in the format accepted by VidarService.get_ids()
+    """
+
+    name: str
+    unit_id: str
+    module_id: str
+    ip: str
+    tolerance: int
+    zones: frozenset
+
+    @property
+    def zone_filter(self):
+        return self.zones if self.zones else '0'
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Class represented immutable snapshot of the settings used on the request
+    path, parsed and typed once when the configuration is (re)loaded.
+    The whole snapshot is replaced on reload, so a request that took the
+    snapshot at its start sees consistent settings until it is finished.
+
+    Parameters:
+    -----------
+    config: ConfigParser
+        Configuration the snapshot was made of
+    mode: str
+        Service mode: VIDAR or TEST
+    default_camera: Camera
+        Camera of the [service] and [vidar] sections
+    cameras: dict
+        Cameras by unit id, including the default one
+    route_field: str
+        DetectionRequest field carrying the unit id
+    timezone: ZoneInfo
+        Timezone of the vidar timestamps
+    delay: int
+        Delay before querying vidar in seconds
+    max_wait: float
+        Deadline of the adaptive vidar lookup in seconds
+    deadline: float
+        Time in seconds since ImageTime the request can still be answered in,
+        0 for no deadline; relies on the camera and host clocks being in sync
+    closest: int
+        Quantity of the rows closest to the transit fetched from vidar, 0 for all the rows
+    buffer: int
+        Quantity of bytes to read from the socket
+    timeout: int
+        Camea Management connection timeout in seconds
+
+    Methods:
+    -----------
+    from_config(config) --> Settings
+        Returns the snapshot of the configuration
+    route(request) --> Camera
+        Returns the camera the DetectionRequest is addressed to
+    """
+
+    config: configparser.ConfigParser = field(repr=False, compare=False)
+    mode: str
+    default_camera: Camera
+    cameras: dict
+    route_field: str
+    timezone: zoneinfo.ZoneInfo
+    delay: int
+    max_wait: float
+    deadline: float
+    closest: int
+    buffer: int
+    timeout: int
+
+    @staticmethod
+    def __cameras(config: configparser.ConfigParser) -> list:
+        vidar = config['vidar']
+        cameras = [Camera(name='default',
+                          unit_id=config['settings']['camera_unit_id'],
+                          module_id=config['service']['module_id'],
+                          ip=vidar['ip'],
+                          tolerance=vidar.getint('tolerance'),
+                          zones=parse_zones(vidar['zone']))]
+        for section in config.sections():
+            if not section.startswith(CAMERA_SECTION):
+                continue
+            name = section[len(CAMERA_SECTION):].strip()
+            camera = config[section]
+            # the missing values are taken from the vidar section
+            cameras.append(Camera(name=name,
+                                  unit_id=camera.get('unit_id', name),
+                                  module_id=camera['module_id'],
+                                  ip=camera['ip'],
+                                  tolerance=camera.getint('tolerance', vidar.getint('tolerance')),
+                                  zones=parse_zones(camera.get('zone', vidar['zone']))))
+        return cameras
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser) -> 'Settings':
+        """
+        Returns the snapshot of the configuration
+
+        Parameters:
+        -----------
+        config: ConfigParser
+            Validated configuration
+
+        Output:
+        -----------
+        Settings object
+        """
+        cameras = Settings.__cameras(config)
+        by_unit = dict()
+        for camera in cameras:
+            if camera.unit_id in by_unit:
+                raise ValueError(f'unit id {camera.unit_id} is used by several cameras')
+            by_unit[camera.unit_id] = camera
+        return cls(config=config,
+                   mode=config['service']['mode'],
+                   default_camera=cameras[0],
+                   cameras=by_unit,
+                   route_field=config.get('service', 'route_field', fallback='UnitID'),
+                   timezone=zoneinfo.ZoneInfo(config['settings']['timezone']),
+                   delay=config.getint('vidar', 'timeout'),
+                   max_wait=config.getfloat('vidar', 'max_wait',
+                                            fallback=config.getint('vidar', 'timeout')),
+                   deadline=config.getfloat('settings', 'deadline', fallback=0.0),
+                   closest=config.getint('vidar', 'closest', fallback=2),
+                   buffer=config.getint('settings', 'buffer'),
+                   timeout=config.getint('settings', 'timeout'))
+
+    def route(self, request: dict) -> Camera:
+        """
+        Returns the camera the DetectionRequest is addressed to
+
+        Parameters:
+        -----------
+        request: dict
+            DetectionRequest fields
+
+        Output:
+        -----------
+        Camera with the unit id from the route field; the default camera
+        if no additional cameras are configured or the request has no route
+        field, None if the unit is unknown
+        """
+        if len(self.cameras) == 1:
+            # single camera deployment, the unit id is not checked
+            return self.default_camera
+        unit_id = request.get(self.route_field)
+        if unit_id is None:
+            return self.default_camera
+        return self.cameras.get(unit_id)
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Class represented background thread that watches the configuration file
+    and calls the callback once the file was modified
+
+    Parameters:
+    -----------
+    path: str
+        Configuration file path
+    interval: float
+        Interval between checks in seconds
+    callback: callable
+        Called without arguments after the file was modified
+
+    Methods:
+    -----------
+    run() --> None
+        Watches the file until stopped
+    stop() --> None
+        Stops watching
+    """
+
+    def __init__(self, path: str, interval: float, callback):
+        super().__init__(name='config_watcher', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.callback = callback
+        self.__stop_event = threading.Event()
+
+    def __mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def run(self) -> None:
+        """
+        Watches the file until stopped
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        mtime = self.__mtime()
+        while not self.__stop_event.wait(self.interval):
+            current = self.__mtime()
+            if current is None or current == mtime:
+                continue
+            mtime = current
+            logger.info(f'Configuration file {self.path} was modified')
+            try:
+                self.callback()
+            except Exception as e:
+                logger.error(f'Failed to reload the configuration: {e}')
+
+    def stop(self) -> None:
+        """
+        Stops watching
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.__stop_event.set()
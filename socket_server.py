@@ -1,46 +1,57 @@
 # import atexit
 import configparser
+import functools
 import logging
-import logging.config
-import os
-import queue
-import re
 import schedule
+import signal
 import socket
 import sys
 import time
 import threading
-import zoneinfo
 from datetime import datetime
+from async_server import AsyncCameaServer
+from camea_protocol import FrameDecoder
+from camea_db_pool import CameaDBPool
 from camea_service import CameaService
+from delayed_executor import DelayedExecutor
 from errors import IncorrectCameaQuery, SocketCorrupted
+from http_client import VidarHttpClient
+from image_cache import ImageCache
+from image_generator import ImageGenerator, parse_size
+from journal import JournalWriter
+from logging_setup import setup_logging, truncated
+from metrics import CONNECTIONS, REGISTRY, MetricsServer
+from prefetch import VidarPrefetcher
+from query_batcher import RangeQueryBatcher
+from readiness import ReadinessPolicy
+from settings import CAMERA_SECTION, ConfigWatcher, Settings
+from software_trigger import SoftwareTrigger
+from spool import SpoolDrainer, UploadSpool
+from transit_index import TransitIndex, TransitIndexer
 from vidar_service import VidarService
 
 
-# Logger settings
+# Logger settings, see logging_setup.py
 LOG_FILE = "logs/log.log"
-LOGGING_SETTINGS = {
-    "handlers": [],
-    "format": "%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s",
-    "datefmt": "%d.%m.%Y %H:%M:%S",
-    "level": logging.DEBUG,
-}
-file_handler = logging.handlers.RotatingFileHandler(
-    filename=os.path.join(os.getcwd(), LOG_FILE),
-    encoding="utf-8",
-    mode="a",
-    maxBytes=1_000_000,
-    backupCount=5,
-)
-file_handler.setLevel(logging.INFO)
-LOGGING_SETTINGS["handlers"].append(file_handler)
-
-stream_handler = logging.StreamHandler(stream=sys.stdout)
-LOGGING_SETTINGS["handlers"].append(stream_handler)
-
-logging.basicConfig(**LOGGING_SETTINGS)
+
+# set logger
 logger = logging.getLogger(__name__)
 
+# metrics of the DetectionRequest processing
+STAGE_LATENCY = {stage: REGISTRY.histogram('detection_stage_seconds',
+                                           'Duration of the DetectionRequest processing stages',
+                                           labels={'stage': stage})
+                 for stage in ('frame_parse', 'delay_wait', 'readiness_wait', 'get_ids',
+                               'best_fit', 'get_data', 'found_response', 'not_found_response',
+                               'image_upload')}
+REQUESTS = {result: REGISTRY.counter('detection_requests_total',
+                                     'DetectionRequests by the processing result',
+                                     labels={'result': result})
+            for result in ('found', 'not_found', 'error', 'rejected', 'expired',
+                           'unknown_unit')}
+VIDAR_RETRIES = REGISTRY.counter('vidar_readiness_retries_total',
+                                 'Vidar lookups repeated while the transit row was not ready')
+
 
 class QUERY_PROCESSOR:
     """
@@ -54,6 +65,9 @@ class QUERY_PROCESSOR:
     -----------
     AVAILABLE_COMMANDS - dict with available commands to receive via TCP/IP.
     Now only "DetectionRequest" command is supported
+    SERVER_MODES - available server modes:
+        'blocking' - serves one CAMEA Management Software connection at a time
+        'asyncio' - serves many CAMEA Management Software connections at once
 
     Parameters:
     -----------
@@ -61,83 +75,397 @@ class QUERY_PROCESSOR:
 
     Methods:
     -----------
-    process_DetectionRequest(data, conn) --> None
+    process_DetectionRequest(frame, conn, submitted_at) --> None
         Tries to process Detection request: get the appropriate photos
         from Vidar database and send it to the CAMEA DB Management Software
+    submit_DetectionRequest(frame, conn) --> bool
+        Schedules Detection request processing after the chosen vidar timeout
+        in the worker pool
     main() --> None
         Main program loop.
     """
 
+    SERVER_MODES = ('blocking', 'asyncio')
+    CONFIG_FILE = 'config.ini'
+
     def __init__(self):
         self.config = configparser.ConfigParser()
-        self.config.read('config.ini')
+        self.config.read(QUERY_PROCESSOR.CONFIG_FILE)
 
-        self.initiated = QUERY_PROCESSOR.__check_config(self.config)
+        # typed snapshot of the request path settings, replaced on reload
+        self.settings = QUERY_PROCESSOR.__check_config(self.config)
+        self.initiated = self.settings is not None
         if self.initiated:
             self.msg_id = 0
-            self.vidar_service = VidarService(ip=self.config['vidar']['ip'])
+            self.msg_id_lock = threading.Lock()
+            # one vidar service per camera, HTTP connections and images cache are shared
+            self.vidar_http = VidarHttpClient(
+                connect_timeout=self.config.getfloat('vidar', 'connect_timeout', fallback=2.0),
+                read_timeout=self.config.getfloat('vidar', 'read_timeout', fallback=5.0),
+                retries=self.config.getint('vidar', 'retries', fallback=2),
+                pool_size=self.config.getint('settings', 'workers', fallback=4),
+                hosts=len(self.settings.cameras))
+            self.image_cache = None
+            cache_size = self.config.getint('vidar', 'cache_size', fallback=64)
+            if cache_size > 0:
+                self.image_cache = ImageCache(
+                    max_bytes=cache_size * 1024 * 1024,
+                    ttl=self.config.getfloat('vidar', 'cache_ttl', fallback=60.0))
+            self.transit_indexers = dict()
+            self.vidar_services = dict()
+            self.vidar_services_lock = threading.Lock()
+            for camera in self.settings.cameras.values():
+                self.__vidar_service(camera)
+            self.vidar_service = self.__vidar_service(self.settings.default_camera)
+            self.prefetcher = None
+            self.software_trigger = None
+            if self.config.getboolean('software_trigger', 'prefetch', fallback=False):
+                self.__start_prefetch()
             self.camea_service = CameaService(db_ip=self.config['camea_db']['ip'],
                                               db_port=self.config.getint('camea_db', 'port'),
-                                              buffer=self.config.getint('settings', 'buffer'))
+                                              buffer=self.config.getint('settings', 'buffer'),
+                                              connections=self.config.getint(
+                                                  'camea_db', 'connections', fallback=1),
+                                              spares=self.config.getint(
+                                                  'camea_db', 'spares', fallback=1),
+                                              ack_by_id=self.config.getboolean(
+                                                  'camea_db', 'ack_by_id', fallback=False))
+            self.spool_drainer = None
+            if self.config.get('camea_db', 'spool', fallback=''):
+                self.__start_spool()
+            self.readiness = None
+            if (self.config['service']['mode'] == 'VIDAR'
+                    and self.config.getboolean('vidar', 'adaptive', fallback=False)):
+                self.readiness = ReadinessPolicy(
+                    max_wait=self.config.getfloat('vidar', 'max_wait',
+                                                  fallback=self.config.getint('vidar', 'timeout')))
+            self.detection_executor = DelayedExecutor(
+                workers=self.config.getint('settings', 'workers', fallback=4),
+                max_pending=self.config.getint('settings', 'max_pending', fallback=100))
+            self.journal = None
+            if self.config.get('service', 'journal', fallback=''):
+                self.journal = JournalWriter(
+                    path=self.config['service']['journal'],
+                    max_size=self.config.getint('service', 'journal_max_size',
+                                                fallback=100) * 1024 * 1024)
+            self.__register_metrics()
+            self.config_watcher = None
+            if self.config.getfloat('service', 'reload_interval', fallback=0) > 0:
+                self.config_watcher = ConfigWatcher(
+                    path=QUERY_PROCESSOR.CONFIG_FILE,
+                    interval=self.config.getfloat('service', 'reload_interval'),
+                    callback=self.reload_config)
+                self.config_watcher.start()
+            self.metrics_server = None
+            if self.config.getint('metrics', 'port', fallback=0) > 0:
+                self.metrics_server = MetricsServer(
+                    host=self.config.get('metrics', 'host', fallback='127.0.0.1'),
+                    port=self.config.getint('metrics', 'port'))
+                self.metrics_server.start()
+
+    def __vidar_service(self, camera):
+        # services are created once per camera, cameras added by reload get them on demand
+        with self.vidar_services_lock:
+            vidar_service = self.vidar_services.get(camera.name)
+            if vidar_service is not None and vidar_service.IP == camera.ip:
+                return vidar_service
+            if camera.name in self.transit_indexers:
+                # the camera was moved to another Vidar unit
+                self.transit_indexers.pop(camera.name).stop()
+            vidar_service = VidarService(ip=camera.ip, http=self.vidar_http)
+            vidar_service.cache = self.image_cache
+            vidar_service.pushdown = self.config.getboolean('vidar', 'pushdown', fallback=True)
+            if self.config.getboolean('vidar', 'index', fallback=False):
+                vidar_service.index = TransitIndex(
+                    retention=self.config.getint('vidar', 'index_retention', fallback=120) * 1_000,
+                    ingestion_lag=self.config.getint('vidar', 'index_lag', fallback=1000))
+                transit_indexer = TransitIndexer(
+                    vidar_service=vidar_service,
+                    index=vidar_service.index,
+                    interval=self.config.getfloat('vidar', 'index_interval', fallback=1.0))
+                transit_indexer.start()
+                self.transit_indexers[camera.name] = transit_indexer
+            batch_window = self.config.getint('vidar', 'batch_window', fallback=0)
+            if batch_window > 0:
+                vidar_service.batcher = RangeQueryBatcher(
+                    fetch_rows=vidar_service.get_rows,
+                    window=batch_window / 1_000)
+            self.vidar_services[camera.name] = vidar_service
+            logger.info(f'Camera {camera.name} (unit {camera.unit_id}) is looked up '
+                        + f'in Vidar at {camera.ip}')
+            return vidar_service
+
+    def __register_metrics(self):
+        # values kept by the services are read on every scrape
+        REGISTRY.gauge('detection_queue_depth',
+                       'DetectionRequests waiting for the delay or for a free worker',
+                       self.detection_executor.pending)
+        REGISTRY.gauge('camea_db_in_flight', 'Uploads waiting for the Camea DB ack',
+                       lambda: sum(stats['in_flight'] for stats in self.camea_service.pool.stats()))
+        for endpoint in ('querydb', 'getdata', 'swtrigger'):
+            for key, name, help in (
+                    ('count', 'vidar_http_requests_total', 'Vidar HTTP requests'),
+                    ('errors', 'vidar_http_errors_total', 'Failed Vidar HTTP requests'),
+                    ('retries', 'vidar_http_retries_total', 'Retried Vidar HTTP requests')):
+                REGISTRY.gauge(name, help,
+                               lambda endpoint=endpoint, key=key:
+                                   self.vidar_http.stats().get(endpoint, {}).get(key, 0),
+                               labels={'endpoint': endpoint}, kind='counter')
+        spool = self.camea_service.spool
+        if spool is not None:
+            REGISTRY.gauge('camea_db_spool_bytes', 'Size of the spooled uploads in bytes',
+                           lambda: spool.stats()['bytes'])
+            REGISTRY.gauge('camea_db_spool_segments', 'Spool segments waiting for the replay',
+                           lambda: spool.stats()['segments'])
+        cache = self.image_cache
+        if cache is not None:
+            for key in ('hits', 'misses', 'evictions'):
+                REGISTRY.gauge(f'vidar_cache_{key}_total', f'Vidar image cache {key}',
+                               lambda key=key: cache.stats()[key], kind='counter')
+            REGISTRY.gauge('vidar_cache_bytes', 'Size of the cached Vidar images in bytes',
+                           lambda: cache.stats()['bytes'])
+        if self.transit_indexers:
+            REGISTRY.gauge('vidar_index_transits', 'Transits kept in the transit indexes',
+                           lambda: sum(len(vidar_service.index)
+                                       for vidar_service in list(self.vidar_services.values())
+                                       if vidar_service.index is not None))
+
+    def reload_config(self) -> bool:
+        """
+        Reloads the configuration file and replaces the settings snapshot.
+        Settings of the request path (mode, cameras, tolerance, zones,
+        timezone, delays, socket buffer and timeout) take effect at once,
+        the others (addresses, pools, workers, optional stages) after restart
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        True if the configuration was reloaded, False if it is invalid
+        """
+        config = configparser.ConfigParser()
+        config.read(QUERY_PROCESSOR.CONFIG_FILE)
+        settings = QUERY_PROCESSOR.__check_config(config)
+        if settings is None:
+            logger.error('Configuration was not reloaded, the current settings are kept')
+            return False
+        for camera in settings.cameras.values():
+            self.__vidar_service(camera)
+        vidar_service = self.__vidar_service(settings.default_camera)
+        if self.prefetcher is not None:
+            # the camera may be moved to another Vidar unit, the triggers follow it
+            self.__prefetch_service(vidar_service)
+            self.prefetcher.attach(vidar_service, settings.default_camera.zone_filter)
+            if self.software_trigger is not None:
+                self.software_trigger.attach(vidar_service)
+        # single reference assignments, the running requests keep their snapshot
+        self.vidar_service = vidar_service
+        self.config = config
+        self.settings = settings
+        if self.readiness is not None:
+            self.readiness.max_wait = settings.max_wait
+        logger.info(f'Configuration was reloaded: {settings}')
+        return True
+
+    def __start_spool(self):
+        # failed uploads are kept on disk and replayed once Camea DB is back
+        self.camea_service.spool = UploadSpool(
+            directory=self.config['camea_db']['spool'],
+            max_size=self.config.getint('camea_db', 'spool_size', fallback=1024) * 1024 * 1024,
+            segment_size=self.config.getint('camea_db', 'spool_segment', fallback=16) * 1024 * 1024)
+        self.spool_drainer = SpoolDrainer(
+            spool=self.camea_service.spool,
+            submit=self.camea_service.pool.submit,
+            rate=self.config.getfloat('camea_db', 'spool_rate', fallback=5.0),
+            ack_timeout=CameaDBPool.ACK_TIMEOUT,
+            next_msg_id=self.__next_msg_id,
+            max_attempts=self.config.getint('camea_db', 'spool_attempts', fallback=3))
+        self.spool_drainer.start()
+
+    def __prefetch_service(self, vidar_service):
+        # prefetched transits are looked up in the index, images in the cache
+        if vidar_service.index is None:
+            # filled by the trigger polls only, so the range without rows is queried directly
+            vidar_service.index = TransitIndex(
+                retention=self.config.getint('vidar', 'index_retention', fallback=120) * 1_000,
+                ingestion_lag=self.config.getint('vidar', 'index_lag', fallback=1000),
+                continuous=False)
+        if vidar_service.cache is None:
+            vidar_service.cache = ImageCache()
+
+    def __start_prefetch(self):
+        # the software trigger and the prefetch serve the default camera only
+        self.__prefetch_service(self.vidar_service)
+        self.prefetcher = VidarPrefetcher(
+            vidar_service=self.vidar_service,
+            delay=self.config.getfloat('software_trigger', 'prefetch_delay', fallback=0.5),
+            zone=self.settings.default_camera.zone_filter,
+            max_images=self.config.getint('software_trigger', 'prefetch_images', fallback=4))
+        # the software trigger runs embedded to share the vidar service with the processor
+        software_trigger = SoftwareTrigger(vidar_service=self.vidar_service,
+                                           prefetcher=self.prefetcher)
+        if software_trigger.initiated:
+            self.software_trigger = software_trigger
+            threading.Thread(target=software_trigger.main, name='software_trigger',
+                             daemon=True).start()
 
     @classmethod
     def __check_config(cls, config):
         # check config structure
         if not {'service', 'settings', 'vidar', 'camea_db'}.issubset(config.sections()):
             logger.critical('Configuration file does not have appropriate structure')
-            return False
+            return None
 
         # check service section
         if not {'host', 'port', 'module_id', 'mode', 'operating_time'}.issubset(config['service']):
             logger.critical('Configuration file service section: missing values')
-            return False
+            return None
         try:
             config.getint('service', 'port')
             config.getint('service', 'operating_time')
         except Exception as e:
             logger.critical('Invalid datatype for data in service section: ' + str(e))
-            return False
+            return None
+        if config.get('service', 'server_mode', fallback='blocking') not in cls.SERVER_MODES:
+            logger.critical('Configuration file service section: unknown server_mode')
+            return None
+        try:
+            if config.getint('service', 'journal_max_size', fallback=100) < 1:
+                raise ValueError('journal_max_size must be positive')
+        except Exception as e:
+            logger.critical('Invalid datatype for data in service section: ' + str(e))
+            return None
 
         # check settings section
         if not {'buffer', 'timezone', 'timeout', 'camera_unit_id'}.issubset(config['settings']):
             logger.critical('Configuration file settings section: missing values')
-            return False
+            return None
         try:
             config.getint('settings', 'buffer')
             config.getint('settings', 'timeout')
+            if config.getint('settings', 'workers', fallback=4) < 1:
+                raise ValueError('workers must be positive')
+            if config.getint('settings', 'max_pending', fallback=100) < 1:
+                raise ValueError('max_pending must be positive')
+            if config.getfloat('settings', 'deadline', fallback=0.0) < 0:
+                raise ValueError('deadline must not be negative')
         except Exception as e:
             logger.critical('Invalid datatype for data in settings section: ' + str(e))
-            return False
+            return None
 
         # check vidar section
         if not {'ip', 'tolerance', 'zone', 'timeout'}.issubset(config['vidar']):
             logger.critical('Configuration file vidar section: missing values')
-            return False
+            return None
         try:
             config.getint('vidar', 'tolerance')
             config.getint('vidar', 'timeout')
+            config.getfloat('vidar', 'connect_timeout', fallback=2.0)
+            config.getfloat('vidar', 'read_timeout', fallback=5.0)
+            config.getint('vidar', 'retries', fallback=2)
+            config.getboolean('vidar', 'index', fallback=False)
+            config.getint('vidar', 'index_retention', fallback=120)
+            config.getfloat('vidar', 'index_interval', fallback=1.0)
+            if config.getint('vidar', 'index_lag', fallback=1000) < 0:
+                raise ValueError('index_lag must not be negative')
+            config.getboolean('vidar', 'adaptive', fallback=False)
+            if config.getfloat('vidar', 'max_wait', fallback=1.0) < 0:
+                raise ValueError('max_wait must not be negative')
+            if config.getint('vidar', 'cache_size', fallback=64) < 0:
+                raise ValueError('cache_size must not be negative')
+            if config.getfloat('vidar', 'cache_ttl', fallback=60.0) < 0:
+                raise ValueError('cache_ttl must not be negative')
+            if config.getint('vidar', 'batch_window', fallback=0) < 0:
+                raise ValueError('batch_window must not be negative')
+            config.getboolean('vidar', 'pushdown', fallback=True)
+            if config.getint('vidar', 'closest', fallback=2) < 0:
+                raise ValueError('closest must not be negative')
         except Exception as e:
             logger.critical('Invalid datatype for data in vidar section: ' + str(e))
-            return False
+            return None
 
         # check camea_db section
         if not {'ip', 'port'}.issubset(config['camea_db']):
             logger.critical('Configuration file camea_db section: missing values')
-            return False
+            return None
         try:
             config.getint('camea_db', 'port')
+            if config.getint('camea_db', 'connections', fallback=1) < 1:
+                raise ValueError('connections must be positive')
+            if config.getint('camea_db', 'spares', fallback=1) < 0:
+                raise ValueError('spares must not be negative')
+            config.getboolean('camea_db', 'ack_by_id', fallback=False)
+            if config.get('camea_db', 'spool', fallback=''):
+                if config.getint('camea_db', 'spool_size', fallback=1024) < 1:
+                    raise ValueError('spool_size must be positive')
+                if config.getint('camea_db', 'spool_segment', fallback=16) < 1:
+                    raise ValueError('spool_segment must be positive')
+                if config.getfloat('camea_db', 'spool_rate', fallback=5.0) <= 0:
+                    raise ValueError('spool_rate must be positive')
+                if config.getint('camea_db', 'spool_attempts', fallback=3) < 1:
+                    raise ValueError('spool_attempts must be positive')
         except Exception as e:
             logger.critical('Invalid datatype for data in camea_db section: ' + str(e))
-            return False
+            return None
 
-        return True
+        # check software_trigger section
+        try:
+            if config.getboolean('software_trigger', 'prefetch', fallback=False):
+                if config.getfloat('software_trigger', 'prefetch_delay', fallback=0.5) < 0:
+                    raise ValueError('prefetch_delay must not be negative')
+                if config.getint('software_trigger', 'prefetch_images', fallback=4) < 1:
+                    raise ValueError('prefetch_images must be positive')
+        except Exception as e:
+            logger.critical('Invalid datatype for data in software_trigger section: ' + str(e))
+            return None
+
+        # check metrics section
+        try:
+            config.getint('metrics', 'port', fallback=0)
+        except Exception as e:
+            logger.critical('Invalid datatype for data in metrics section: ' + str(e))
+            return None
+
+        # check test section
+        if config.has_section('test'):
+            try:
+                parse_size(config.get('test', 'image_size', fallback='1920x1080'))
+                parse_size(config.get('test', 'lpr_image_size', fallback='400x100'))
+                image_format = config.get('test', 'image_format', fallback='PNG')
+                if image_format.upper() not in ImageGenerator.FORMATS:
+                    raise ValueError('image_format must be PNG or JPEG')
+                if not 1 <= config.getint('test', 'jpeg_quality', fallback=85) <= 95:
+                    raise ValueError('jpeg_quality must be in range 1..95')
+            except Exception as e:
+                logger.critical('Invalid datatype for data in test section: ' + str(e))
+                return None
+
+        # check camera sections
+        for section in config.sections():
+            if not section.startswith(CAMERA_SECTION):
+                continue
+            if not {'module_id', 'ip'}.issubset(config[section]):
+                logger.critical(f'Configuration file {section} section: missing values')
+                return None
+            try:
+                config.getint(section, 'tolerance', fallback=0)
+            except Exception as e:
+                logger.critical(f'Invalid datatype for data in {section} section: ' + str(e))
+                return None
+
+        try:
+            return Settings.from_config(config)
+        except Exception as e:
+            logger.critical('Invalid settings in the configuration file: ' + str(e))
+            return None
 
     def __send_keep_alive(self):
         try:
             if self.camea_client:
                 msg = bytearray(b'\x4b\x41\x78\x78\x00\x00\x00\x00\x00\x00\x00\x00')
                 self.camea_client.sendall(msg)
-                logger.debug(f"Keep alive was sent to {self.camea_client.getpeername()}")
+                logger.debug("Keep alive was sent to %s", self.camea_client_address)
         except ConnectionResetError as e:
             logger.error(f'Connection to Camea Management System was reset by the peer: {e}')
         except socket.error as e:
@@ -147,7 +475,34 @@ class QUERY_PROCESSOR:
     def __send_handshake(self):
         self.camea_client.sendall(bytearray(b'\x48\x53\x78\x78'))
 
-    def process_DetectionRequest(self, data, conn):
+    def __shutdown_services(self):
+        for transit_indexer in self.transit_indexers.values():
+            transit_indexer.stop()
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.journal:
+            self.journal.close()
+        if self.config_watcher:
+            self.config_watcher.stop()
+        if self.spool_drainer:
+            self.spool_drainer.stop()
+        self.detection_executor.shutdown()
+        self.camea_service.close_camea_db_connection()
+        if self.camea_service.spool:
+            self.camea_service.spool.close()
+
+    def __next_msg_id(self):
+        with self.msg_id_lock:
+            msg_id = self.msg_id
+            # message id is packed into 2 bytes of the Camea frame header
+            self.msg_id = (self.msg_id + 1) % 0x10000
+        return msg_id
+
+    def process_DetectionRequest(self, frame, conn, submitted_at: float = None,
+                                 attempt: int = 1, previous: float = None,
+                                 deadline: float = None):
         """
         Tries to process Detection request:
         1: VIDAR mode - gets the appropriate photos from Vidar database
@@ -157,21 +512,33 @@ class QUERY_PROCESSOR:
 
         Parameters:
         -----------
-        data: string
-            TCP/IP CAMEA DetectionRequest query decoded in ISO-8859-1 format
+        frame: Frame
+            Framed TCP/IP CAMEA DetectionRequest query
         conn: socket object
             Established connection with CAMEA DB Management Software
+        submitted_at: float
+            time.monotonic() of the submitting, to measure the delay wait
+        attempt: int
+            Number of the Vidar lookup in the adaptive readiness mode
+        previous: float
+            Time since the submitting of the previous failed lookup
+        deadline: float
+            time.monotonic() after which the request is answered as not found
+            without the lookup, None for no deadline
 
         Output:
         -----------
         """
-
-        data = data.rstrip('\x00')
-        # delay processing for the chosen timeout
-        time.sleep(self.config.getint('vidar', 'timeout'))
+        if submitted_at is not None and attempt == 1:
+            STAGE_LATENCY['delay_wait'].observe(time.monotonic() - submitted_at)
+        if deadline is not None and time.monotonic() > deadline:
+            self.__shed(frame, conn, 'expired')
+            return
+        # the request is processed with the settings it was started with
+        settings = self.settings
         try:
-            request_data = {item.split(':')[0]: ''.join(item.split(':')[1:])
-                            for item in data.split('|')}
+            with STAGE_LATENCY['frame_parse'].time():
+                request_data = frame.fields
             try:
                 dt = datetime.strptime(request_data['ImageTime'], '%Y%m%dT%H%M%S%f%z')
             except Exception:
@@ -182,75 +549,202 @@ class QUERY_PROCESSOR:
                 msg = "Missing ID in the DetectionRequest"
                 raise IncorrectCameaQuery(msg)
 
+            # choose the camera the request is addressed to
+            camera = settings.route(request_data)
+            if camera is None:
+                # the images of another lane would be the wrong evidence
+                logger.error('Unknown unit %s in the DetectionRequest %s',
+                             request_data.get(settings.route_field), request_data['RequestID'])
+                self.__shed(frame, conn, 'unknown_unit')
+                return
+
             # use tolerance from the configfile (if set) or from query (if 0)
-            tolerance = (self.config.getint('vidar', 'tolerance')
-                         if self.config.getint('vidar', 'tolerance') > 0
-                         else request_data['ToleranceMS'])
+            if camera.tolerance > 0:
+                tolerance = camera.tolerance
+            else:
+                try:
+                    tolerance = int(request_data['ToleranceMS'])
+                except (KeyError, ValueError):
+                    msg = f"Incorrect ToleranceMS in the DetectionRequest: {frame.text}"
+                    raise IncorrectCameaQuery(msg)
 
             # get transit images
-            if self.config['service']['mode'] == 'VIDAR':
+            if settings.mode == 'VIDAR':
                 # search for IDs in vidar database with given datetime ± tolerance
-                if self.config['vidar']['zone'] != '0':
-                    zones = self.config['vidar']['zone'].split(',')
-                else:
-                    zones = self.config['vidar']['zone']
-                vidar_ids = self.vidar_service.get_ids(transit_timestamp=dt,
-                                                       tolerance=tolerance,
-                                                       zone=zones)
-
+                vidar_service = self.__vidar_service(camera)
+                with STAGE_LATENCY['get_ids'].time():
+                    vidar_ids = vidar_service.get_ids(transit_timestamp=dt,
+                                                      tolerance=tolerance,
+                                                      zone=camera.zone_filter,
+                                                      closest=settings.closest)
+
+                # query again later if the transit row is not in Vidar yet
+                if self.readiness is not None and submitted_at is not None:
+                    if self.__poll_again(frame, conn, submitted_at, attempt, previous,
+                                         deadline, vidar_ids, dt):
+                        return
+
+                msg_id = self.__next_msg_id()
                 if vidar_ids:
                     # search for the image that is the closest to requested timestamp
-                    dt_ts = int(dt.timestamp()*1_000)
-                    vidar_ids_deviation = [abs(dt_ts - int(ts)) for ts in vidar_ids.keys()]
-                    best_fit = vidar_ids_deviation.index(min(vidar_ids_deviation))
-                    id = list(vidar_ids.values())[best_fit]
-                    bt = int(list(vidar_ids.keys())[best_fit]) / 1000
+                    with STAGE_LATENCY['best_fit'].time():
+                        dt_ts = int(dt.timestamp()*1_000)
+                        best_fit, id = min(vidar_ids.items(),
+                                           key=lambda row: abs(dt_ts - int(row[0])))
+                        bt = int(best_fit) / 1000
 
                     # get the image with given ID from the Vidar database
-                    img = self.vidar_service.get_data(id)
+                    with STAGE_LATENCY['get_data'].time():
+                        img = vidar_service.get_data(id)
                     # transfer best_fit from timestamp into datetime
-                    timezone = zoneinfo.ZoneInfo(self.config['settings']['timezone'])
-                    dt_vidar = datetime.fromtimestamp(bt, tz=timezone)
+                    dt_vidar = datetime.fromtimestamp(bt, tz=settings.timezone)
 
                     # send response to the CAMEA Management Software
-                    self.camea_service.send_image_found_response(conn=conn,
-                                                                 id=self.msg_id,
-                                                                 dt_response=dt_vidar,
-                                                                 request=request_data,
-                                                                 config=self.config,
-                                                                 lp=img['LP'],
-                                                                 country=img['ILPC'])
-                    self.camea_service.send_image_data(id=self.msg_id,
-                                                       dt_response=dt_vidar,
-                                                       request=request_data,
-                                                       config=self.config,
-                                                       img=img)
+                    with STAGE_LATENCY['found_response'].time():
+                        self.camea_service.send_image_found_response(conn=conn,
+                                                                     id=msg_id,
+                                                                     dt_response=dt_vidar,
+                                                                     request=request_data,
+                                                                     config=settings.config,
+                                                                     lp=img['LP'],
+                                                                     country=img['ILPC'],
+                                                                     module_id=camera.module_id)
+                    with STAGE_LATENCY['image_upload'].time():
+                        self.camea_service.send_image_data(id=msg_id,
+                                                           dt_response=dt_vidar,
+                                                           request=request_data,
+                                                           config=settings.config,
+                                                           img=img,
+                                                           module_id=camera.module_id)
+                    REQUESTS['found'].inc()
                 else:
                     # send response to the CAMEA DB
                     # that required image was not found
-                    self.camea_service.send_image_not_found_response(conn=conn,
-                                                                     id=self.msg_id,
-                                                                     request=request_data,
-                                                                     config=self.config)
-
-            elif self.config['service']['mode'] == 'TEST':
+                    with STAGE_LATENCY['not_found_response'].time():
+                        self.camea_service.send_image_not_found_response(conn=conn,
+                                                                         id=msg_id,
+                                                                         request=request_data,
+                                                                         config=settings.config,
+                                                                         module_id=camera.module_id)
+                    REQUESTS['not_found'].inc()
+
+            elif settings.mode == 'TEST':
+                msg_id = self.__next_msg_id()
                 # send response to the CAMEA Management Software
-                self.camea_service.send_image_found_response(conn,
-                                                             id=self.msg_id,
-                                                             dt_response=dt,
-                                                             request=request_data,
-                                                             config=self.config)
+                with STAGE_LATENCY['found_response'].time():
+                    self.camea_service.send_image_found_response(conn,
+                                                                 id=msg_id,
+                                                                 dt_response=dt,
+                                                                 request=request_data,
+                                                                 config=settings.config,
+                                                                 module_id=camera.module_id)
                 # send response to the CAMEA DB
-                self.camea_service.send_stab_image_data(id=self.msg_id,
-                                                        dt_response=dt,
-                                                        request=request_data,
-                                                        config=self.config)
-            self.msg_id += 1
+                with STAGE_LATENCY['image_upload'].time():
+                    self.camea_service.send_stab_image_data(id=msg_id,
+                                                            dt_response=dt,
+                                                            request=request_data,
+                                                            config=settings.config,
+                                                            module_id=camera.module_id)
+                REQUESTS['found'].inc()
         # detalize exceptions!!!
         except Exception as e:
+            REQUESTS['error'].inc()
             logger.exception(e)
-        finally:
-            return schedule.CancelJob
+
+    def __poll_again(self, frame, conn, submitted_at, attempt, previous, deadline,
+                     vidar_ids, dt) -> bool:
+        elapsed = time.monotonic() - submitted_at
+        if self.readiness.is_ready(vidar_ids, int(dt.timestamp() * 1_000), elapsed):
+            self.readiness.observe(elapsed, previous)
+        else:
+            delay = self.readiness.next_delay(attempt, elapsed)
+            if (delay is not None and deadline is not None
+                    and time.monotonic() + delay > deadline):
+                # the request would expire before the next lookup
+                delay = None
+            if delay is not None and self.detection_executor.submit(
+                    delay, self.process_DetectionRequest, frame, conn, tag=conn,
+                    expires_at=deadline,
+                    on_expired=functools.partial(self.__shed, frame, conn, 'expired'),
+                    submitted_at=submitted_at, attempt=attempt + 1, previous=elapsed,
+                    deadline=deadline):
+                VIDAR_RETRIES.inc()
+                return True
+            if vidar_ids:
+                # the rows found by the last lookup before the deadline
+                self.readiness.observe(elapsed, previous)
+        STAGE_LATENCY['readiness_wait'].observe(elapsed)
+        return False
+
+    def submit_DetectionRequest(self, frame, conn) -> bool:
+        """
+        Schedules Detection request processing after the chosen vidar timeout
+        in the worker pool, so the caller is not blocked by the delay
+
+        Parameters:
+        -----------
+        frame: Frame
+            Framed TCP/IP CAMEA DetectionRequest query
+        conn: socket object
+            Established connection with CAMEA DB Management Software
+
+        Output:
+        -----------
+        True if the request was scheduled, False if it was answered at once
+        as not found: it has already expired or the queue is full
+        """
+        deadline = self.__deadline(frame)
+        if deadline is not None and time.monotonic() > deadline:
+            self.__shed(frame, conn, 'expired')
+            return False
+        if self.readiness is not None:
+            delay = self.readiness.first_delay()
+        else:
+            delay = self.settings.delay
+        # the request still waiting for the delay or for a free worker at the deadline
+        # is answered as not found by the executor at once
+        submitted = self.detection_executor.submit(delay,
+                                                   self.process_DetectionRequest,
+                                                   frame, conn, tag=conn,
+                                                   expires_at=deadline,
+                                                   on_expired=functools.partial(
+                                                       self.__shed, frame, conn, 'expired'),
+                                                   submitted_at=time.monotonic(),
+                                                   deadline=deadline)
+        if not submitted:
+            self.__shed(frame, conn, 'rejected')
+        return submitted
+
+    def __deadline(self, frame):
+        # the request can be answered within the deadline since the transit time;
+        # ImageTime comes from the camera clock, so the deadline relies on the clocks
+        # of the camera and this host being synchronized
+        if self.settings.deadline <= 0:
+            return None
+        try:
+            dt = datetime.strptime(frame.fields['ImageTime'], '%Y%m%dT%H%M%S%f%z')
+        except Exception:
+            # the incorrect request is reported by the processing
+            return None
+        return time.monotonic() + dt.timestamp() + self.settings.deadline - time.time()
+
+    def __shed(self, frame, conn, result):
+        # the request that can not be answered in time is answered as not found at once,
+        # so Camea Management System does not wait for it until its own timeout
+        REQUESTS[result].inc()
+        settings = self.settings
+        camera = settings.route(frame.fields) or settings.default_camera
+        try:
+            self.camea_service.send_image_not_found_response(conn=conn,
+                                                             id=self.__next_msg_id(),
+                                                             request=frame.fields,
+                                                             config=settings.config,
+                                                             module_id=camera.module_id)
+        except Exception as e:
+            logger.error(f'Failed to answer the {result} DetectionRequest: {e}')
+        else:
+            logger.warning('DetectionRequest %s was answered as not found: %s',
+                           frame.fields.get('RequestID'), result)
 
     def main(self):
         """
@@ -262,6 +756,15 @@ class QUERY_PROCESSOR:
         Output:
         -----------
         """
+        # SIGHUP reloads the configuration (not available on Windows)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+                target=self.reload_config, name='config_reload', daemon=True).start())
+
+        if self.config.get('service', 'server_mode', fallback='blocking') == 'asyncio':
+            AsyncCameaServer(self).run()
+            self.__shutdown_services()
+            return
 
         def __run_scheduler(interval=1):
             scheduler_event = threading.Event()
@@ -282,7 +785,7 @@ class QUERY_PROCESSOR:
             self.camea_client.shutdown(socket.SHUT_RDWR)
             self.camea_client.close()
             socket_server.close()
-            self.camea_service.close_camea_db_connection()
+            self.__shutdown_services()
             logger.info(f'Service was terminated: {msg}')
             self.running = False
 
@@ -297,7 +800,7 @@ class QUERY_PROCESSOR:
                         + f"{self.config['service']['port']}")
             logger.info("Start socket listening in thread:" + socket_thread.name)
         except Exception as e:
-            self.camea_service.close_camea_db_connection()
+            self.__shutdown_services()
             logger.error('An error occured while configuring socket server: ' + str(e))
             sys.exit(1)
 
@@ -319,7 +822,8 @@ class QUERY_PROCESSOR:
                 logger.debug('Waiting for Camea Management System to connect')
                 self.camea_client, self.camea_client_address = socket_server.accept()
                 logger.debug('Get connection request from Camea Management System')
-                self.camea_client.settimeout(self.config.getint('settings', 'timeout'))
+                CONNECTIONS.inc()
+                self.camea_client.settimeout(self.settings.timeout)
 
                 # sending handshake to Camea Management System
                 try:
@@ -335,48 +839,36 @@ class QUERY_PROCESSOR:
                     # sending keep alive messages every 3 seconds
                     keep_alive_job = schedule.every(3).seconds.do(self.__send_keep_alive)
 
-                    buffer = str()
-                    queries = queue.Queue()
+                    decoder = FrameDecoder()
+                    session = self.journal.session() if self.journal else None
 
                     while self.camea_client:
 
-                        # split the input socket stream into the buffer
+                        # split the input socket stream into the frames
                         try:
-                            data = self.camea_client.recv(self.config.getint('settings', 'buffer'))
+                            data = self.camea_client.recv(self.settings.buffer)
                         except AttributeError:
                             raise SocketCorrupted("can't read from socket")
-                        try:
-                            data = data.decode('ISO-8859-1')
-                        except Exception as e:
-                            logger.error(f"Failed to decode: '{data}' - " + str(e))
-                        buffer = buffer + data
-                        data = ''
-
-                        # split the buffer into the list of requests
-                        splitted_buffer = re.findall(r'.+?(?=DAtP|Hsxx|KAxx|$)',
-                                                     buffer, flags=re.DOTALL)
-                        if len(splitted_buffer) > 1:
-                            for i in range(len(splitted_buffer) - 1):
-                                queries.put(splitted_buffer[i])
-                            # left in the buffer last part (may be not full request)
-                            buffer = splitted_buffer[-1]
-
-                        # proceed through the buffer, process the queries one by one
-                        while not queries.empty():
-                            query = queries.get()
-                            logger.debug(f"Received data: {query} from "
-                                         + f"{str(self.camea_client_address)}")
+                        if not data:
+                            raise SocketCorrupted("connection was closed by the peer")
+
+                        # proceed through the received frames one by one
+                        frames = decoder.feed(data)
+                        if self.journal:
+                            self.journal.record(frames, session)
+                        for frame in frames:
+                            logger.debug("Received data: %s from %s",
+                                         truncated(frame), self.camea_client_address)
 
                             # check if it is request for camera images
                             try:
-                                if 'msg:DetectionRequest' in query:
-                                    logger.info(f"Received data: {query} from "
-                                                + str(self.camea_client_address))
+                                if frame.is_detection_request():
+                                    logger.info("Received data: %s from %s",
+                                                truncated(frame), self.camea_client_address)
                                     logger.debug("DetectionRequest catched")
                                     # process the message in separate thread with delay
-                                    schedule.every(3).seconds.do(self.process_DetectionRequest(
-                                                                 data=query,
-                                                                 conn=self.camea_client)).tag("detection")
+                                    self.submit_DetectionRequest(frame=frame,
+                                                                 conn=self.camea_client)
                                 else:
                                     logger.debug('not a DetectionRequest')
                             except IncorrectCameaQuery as e:
@@ -387,16 +879,16 @@ class QUERY_PROCESSOR:
                     logger.error('Connection with Camea Management system was closed by Camea: '
                                  + str(e))
                     schedule.cancel_job(keep_alive_job)
-                    schedule.clear("detection")
+                    self.detection_executor.cancel(self.camea_client)
                 except TimeoutError:
                     logger.error('Connection to Camea Management system was closed due to timeout')
                     schedule.cancel_job(keep_alive_job)
-                    schedule.clear("detection")
+                    self.detection_executor.cancel(self.camea_client)
                 except SocketCorrupted as e:
                     logger.error('Connection with Camea Management system was corrupted: '
                                  + str(e))
                     schedule.cancel_job(keep_alive_job)
-                    schedule.clear("detection")
+                    self.detection_executor.cancel(self.camea_client)
                     continue
             except KeyboardInterrupt:
                 __stop_server(socket_server, 'keyboard interrupt')
@@ -404,11 +896,12 @@ class QUERY_PROCESSOR:
                 logger.error('An error occured during runtime: ' + str(e))
                 logger.info(f'camea client: {self.camea_client}')
                 schedule.cancel_job(keep_alive_job)
-                schedule.clear("detection")
+                self.detection_executor.cancel(self.camea_client)
                 continue
 
 
 if __name__ == "__main__":
+    setup_logging(LOG_FILE, config_file=QUERY_PROCESSOR.CONFIG_FILE)
     query_processor = QUERY_PROCESSOR()
     if query_processor.initiated:
         query_processor.main()
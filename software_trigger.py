@@ -1,37 +1,106 @@
 import configparser
+import select
 import socket
 import logging
-import logging.config
-import os
 import sys
+import time
+from camea_protocol import PushDecoder
+from delayed_executor import DelayedExecutor
+from logging_setup import setup_logging, truncated
+from metrics import REGISTRY
 from vidar_service import VidarService
 
 
+# Logger settings, see logging_setup.py
 LOG_FILE = "logs/sw_trigger.log"
-LOGGING_SETTINGS = {
-    "handlers": [],
-    "format": "%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s",
-    "datefmt": "%d.%m.%Y %H:%M:%S",
-    "level": logging.DEBUG,
-}
-
-
-file_handler = logging.handlers.RotatingFileHandler(
-    filename=os.path.join(os.getcwd(), LOG_FILE),
-    encoding="utf-8",
-    mode="a",
-    maxBytes=1_000_000,
-    backupCount=5,
-)
-file_handler.setLevel(logging.INFO)
-LOGGING_SETTINGS["handlers"].append(file_handler)
-
-stream_handler = logging.StreamHandler(stream=sys.stdout)
-LOGGING_SETTINGS["handlers"].append(stream_handler)
-
-logging.basicConfig(**LOGGING_SETTINGS)
+
+# set logger
 logger = logging.getLogger(__name__)
 
+TRIGGER_LATENCY = REGISTRY.histogram('software_trigger_latency_seconds',
+                                     'Time from the LoopStateChanged push arrival '
+                                     + 'to the software trigger accepted by Vidar')
+TRIGGERS = {result: REGISTRY.counter('software_triggers_total',
+                                     'Software triggers by the sending result',
+                                     labels={'result': result})
+            for result in ('sent', 'failed', 'rejected')}
+
+
+class TriggerDispatcher:
+    """
+    Class represented dispatcher of the software triggers: triggers are sent
+    to Vidar in the worker pool, so the push stream is read on while the
+    trigger HTTP requests are in progress and the triggers of a burst are
+    sent concurrently. The push-to-trigger latency of every trigger is
+    measured from the arrival of its push.
+
+    Parameters:
+    -----------
+    vidar_service: VidarService
+        Service the triggers are sent with
+    workers: int
+        Quantity of the triggers sent at once
+    max_pending: int
+        Maximum quantity of the triggers waiting for a free worker,
+        new triggers are dropped when the limit is reached
+
+    Methods:
+    -----------
+    dispatch(received_at) --> bool
+        Schedules the software trigger for the push received at the given time
+    shutdown() --> None
+        Stops the worker pool
+    """
+
+    def __init__(self, vidar_service, workers: int = 4, max_pending: int = 16):
+        self.vidar_service = vidar_service
+        self.__executor = DelayedExecutor(workers=workers, max_pending=max_pending)
+
+    def __send(self, received_at: float):
+        try:
+            sent = self.vidar_service.send_software_trigger()
+        except Exception as e:
+            sent = False
+            logger.error(f'Failed to send software trigger: {e}')
+        if not sent:
+            TRIGGERS['failed'].inc()
+            return
+        latency = time.monotonic() - received_at
+        TRIGGER_LATENCY.observe(latency)
+        TRIGGERS['sent'].inc()
+        logger.info('Software trigger was sent %.1f ms after the push', latency * 1_000)
+
+    def dispatch(self, received_at: float) -> bool:
+        """
+        Schedules the software trigger for the push received at the given time
+
+        Parameters:
+        -----------
+        received_at: float
+            time.monotonic() of the push arrival
+
+        Output:
+        -----------
+        True if the trigger was scheduled, False if too many triggers are pending
+        """
+        if not self.__executor.submit(0, self.__send, received_at):
+            TRIGGERS['rejected'].inc()
+            logger.error('Software trigger was dropped: too many triggers are pending')
+            return False
+        return True
+
+    def shutdown(self) -> None:
+        """
+        Stops the worker pool
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.__executor.shutdown()
+
 
 class SoftwareTrigger:
     """
@@ -40,30 +109,56 @@ class SoftwareTrigger:
     that is connected via TCP/IP.
     Sends an immediate sofrware trigger for event that is equal to
     configured.
+    Can be embedded into the Query Processor to share its Vidar service,
+    then every trigger also starts the prefetch of the Vidar data.
 
     Constants:
     -----------
+    IDLE_FLUSH - time in seconds after which the unterminated text message
+        that is not followed by more data is taken as complete
+    RECONNECT_MIN, RECONNECT_MAX - bounds of the pause in seconds between
+        the attempts to connect to the Camea Push System, doubled on every failure
 
     Parameters:
     -----------
     Parameters are stored in the 'config.ini' file
+    vidar_service: VidarService
+        Optional Vidar service to share, created from the config if not given
+    prefetcher: VidarPrefetcher
+        Optional prefetcher triggered along with the software trigger
 
     Methods:
     -----------
     send_immediate_trigger() --> None
         Sends an immediate software trigger to the vidar camera
+    attach(vidar_service) --> None
+        Replaces the Vidar service the triggers are sent to
     main() --> None
         Main program loop.
     """
 
-    def __init__(self):
+    IDLE_FLUSH = 0.05
+    RECONNECT_MIN = 1
+    RECONNECT_MAX = 30
+
+    def __init__(self, vidar_service=None, prefetcher=None):
         self.config = configparser.ConfigParser()
         self.config.read('config.ini')
 
+        self.prefetcher = prefetcher
         self.initiated = SoftwareTrigger.__check_config(self.config)
         if self.initiated:
-            self.vidar_service = VidarService(ip=self.config['vidar']['ip'])
+            self.vidar_service = vidar_service or VidarService(
+                ip=self.config['vidar']['ip'],
+                connect_timeout=self.config.getfloat('vidar', 'connect_timeout', fallback=2.0),
+                read_timeout=self.config.getfloat('vidar', 'read_timeout', fallback=5.0),
+                retries=self.config.getint('vidar', 'retries', fallback=2))
             self.state = self.config['software_trigger']['loop_state_changed']
+            self.buffer = self.config.getint('settings', 'buffer', fallback=1024)
+            self.dispatcher = TriggerDispatcher(
+                vidar_service=self.vidar_service,
+                workers=self.config.getint('software_trigger', 'workers', fallback=4),
+                max_pending=self.config.getint('software_trigger', 'max_pending', fallback=16))
 
     @classmethod
     def __check_config(cls, config):
@@ -77,12 +172,24 @@ class SoftwareTrigger:
             logger.critical('Configuration file vidar section: missing values')
             return False
 
+        try:
+            config.getfloat('vidar', 'connect_timeout', fallback=2.0)
+            config.getfloat('vidar', 'read_timeout', fallback=5.0)
+            config.getint('vidar', 'retries', fallback=2)
+        except Exception as e:
+            logger.critical('Invalid datatype for data in vidar section: ' + str(e))
+            return False
+
         # check software_trigger section
         if not {'ip', 'port', 'loop_state_changed'}.issubset(config['software_trigger']):
             logger.critical('Configuration file software__trigger section: missing values')
             return False
         try:
             config.getint('software_trigger', 'port')
+            if config.getint('software_trigger', 'workers', fallback=4) < 1:
+                raise ValueError('workers must be positive')
+            if config.getint('software_trigger', 'max_pending', fallback=16) < 1:
+                raise ValueError('max_pending must be positive')
         except Exception as e:
             logger.critical('Invalid datatype for data in software_trigger section: ' + str(e))
             return False
@@ -90,18 +197,68 @@ class SoftwareTrigger:
         return True
 
     def __create_connection(self):
-        try:
+        # the embedded trigger runs in the daemon thread, so it is never exited
+        ip = self.config['software_trigger']['ip']
+        port = self.config.getint('software_trigger', 'port')
+        pause = SoftwareTrigger.RECONNECT_MIN
+        while True:
             conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            ip = self.config['software_trigger']['ip']
-            port = self.config.getint('software_trigger', 'port')
-            logger.info(f'Connecting to Camea Push System at {ip}: {port}')
-            conn.connect((ip, port))
-        except socket.error as e:
-            logger.error("Failed to connect to Camea Push  System  at: "
-                         + f"{self.config['software_trigger']['ip']}:"
-                         + f"{self.config.getint('software_trigger', 'port')} - {e}")
-            sys.exit(1)
-        return conn
+            try:
+                logger.info(f'Connecting to Camea Push System at {ip}: {port}')
+                conn.connect((ip, port))
+                return conn
+            except socket.error as e:
+                conn.close()
+                logger.error(f"Failed to connect to Camea Push  System  at: {ip}:{port} - {e}, "
+                             + f"next attempt in {pause} s")
+            time.sleep(pause)
+            pause = min(pause * 2, SoftwareTrigger.RECONNECT_MAX)
+
+    def __is_trigger(self, message) -> bool:
+        request_data = message.fields
+        if request_data.get('msg') != 'LoopStateChanged':
+            return False
+        request_state = ''.join(filter(str.isalnum, request_data.get('ChangedTo', '')))
+        return request_state == self.state
+
+    def __receive(self, client, decoder) -> tuple:
+        data = client.recv(self.buffer)
+        if not data:
+            raise ConnectionResetError('connection closed by the peer')
+        received_at = time.monotonic()
+        messages = decoder.feed(data)
+        # the unterminated message is complete only if nothing follows it,
+        # the fields of the message may still be on the way
+        if decoder.buffered() and not select.select([client], [], [],
+                                                    SoftwareTrigger.IDLE_FLUSH)[0]:
+            messages += decoder.flush()
+        return received_at, messages
+
+    def __process(self, message, received_at: float):
+        logger.info("Data received: %s", truncated(message))
+        if message.fields.get('msg') != 'LoopStateChanged':
+            logger.info('Not LoopStateChanged message')
+            return
+        if self.__is_trigger(message):
+            self.dispatcher.dispatch(received_at)
+            if self.prefetcher is not None:
+                self.prefetcher.trigger()
+
+    def attach(self, vidar_service) -> None:
+        """
+        Replaces the Vidar service the triggers are sent to,
+        e.g. once the embedding Query Processor reloads the configuration
+
+        Parameters:
+        -----------
+        vidar_service: VidarService
+            Service of the Vidar camera
+
+        Output:
+        -----------
+        """
+        self.vidar_service = vidar_service
+        self.dispatcher.vidar_service = vidar_service
 
     def main(self):
         """
@@ -115,39 +272,29 @@ class SoftwareTrigger:
         """
         # get connection to the Camea Push System
         client = self.__create_connection()
+        decoder = PushDecoder()
 
         # start the main loop
         while client:
             try:
-                try:
-                    data = client.recv(1024)
-                except AttributeError:
-                    logger.error("Failed to read from socket")
-                try:
-                    data = data.decode('ISO-8859-1')
-                    logger.info(f"Data received: {data}")
-                except Exception as e:
-                    logger.error(f"Failed to decode: '{data}' - " + str(e))
-
-                request_data = {item.split(':')[0]: ''.join(item.split(':')[1:])
-                                for item in data.split('|')}
-
-                if 'msg' not in request_data or request_data['msg'] != 'LoopStateChanged':
-                    logger.info('Not LoopStateChanged message')
-                else:
-                    request_state = ''.join(filter(str.isalnum, request_data['ChangedTo']))
-                    if request_state == self.state:
-                        self.vidar_service.send_software_trigger()
+                received_at, messages = self.__receive(client, decoder)
+                for message in messages:
+                    self.__process(message, received_at)
 
             except ConnectionResetError as e:
                 logger.error('Connection with Camea Push System was closed by Camea: '
                              + str(e))
+                client.close()
                 client = self.__create_connection()
+                decoder = PushDecoder()
             except TimeoutError:
                 logger.error('Connection to Camea Push System was closed due to timeout')
+                client.close()
                 client = self.__create_connection()
+                decoder = PushDecoder()
             except KeyboardInterrupt:
                 logger.error('Connection to Camea Push System was closed due to keyboard interrupt')
+                self.dispatcher.shutdown()
                 sys.exit(1)
             except Exception as e:
                 logger.error('An error occured during runtime: ' + str(e))
@@ -155,6 +302,7 @@ class SoftwareTrigger:
 
 
 if __name__ == "__main__":
+    setup_logging(LOG_FILE)
     sw_trigger = SoftwareTrigger()
     if sw_trigger.initiated:
         sw_trigger.main()
@@ -0,0 +1,399 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from metrics import REGISTRY
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+# segment file signature
+MAGIC = b'CQS1'
+# record header: spooling time (s since 1970), message id, frame length
+RECORD = struct.Struct('<dHI')
+SEGMENT_SUFFIX = '.seg'
+# the uploads that were never acknowledged on replay, in the segment format
+REJECTED_FILE = 'rejected.bad'
+
+SPOOLED = REGISTRY.counter('camea_db_spooled_total',
+                           'Uploads written to the spool after Camea DB failed to ack them')
+REPLAYED = REGISTRY.counter('camea_db_replayed_total',
+                            'Spooled uploads acknowledged by Camea DB on replay')
+DROPPED = REGISTRY.counter('camea_db_spool_dropped_total',
+                           'Failed uploads that did not fit into the spool')
+REJECTED = REGISTRY.counter('camea_db_spool_rejected_total',
+                            'Spooled uploads set aside after Camea DB failed to ack every replay')
+
+
+class UploadSpool:
+    """
+    Class represented durable on-disk spool of the failed Camea DB uploads.
+    The spool is the directory of append-only segment files: the signature
+    followed by records (spooling time, message id, frame length and the
+    encoded frame as it is sent over the wire). Records are appended to the
+    active segment, a new segment is started once the active one reaches
+    the segment size. Segments are drained oldest first and removed once
+    all their records are delivered; segments left by the previous run are
+    drained after restart.
+
+    Parameters:
+    -----------
+    directory: str
+        Spool directory
+    max_size: int
+        Spool size limit in bytes, uploads that do not fit are dropped
+    segment_size: int
+        Size in bytes after which the new segment is started
+
+    Methods:
+    -----------
+    append(msg_id, buffers) --> bool
+        Writes the encoded frame to the spool
+    take(timeout) --> str
+        Returns path of the oldest segment to drain
+    release(path, keep) --> None
+        Removes the drained segment
+    reject(spooled_at, msg_id, frame) --> None
+        Sets aside the upload that is never acknowledged
+    stats() --> dict
+        Returns quantity of segments and the spool size
+    close() --> None
+        Closes the active segment
+    """
+
+    def __init__(self, directory: str, max_size: int, segment_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self.__segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                                 if name.endswith(SEGMENT_SUFFIX)
+                                 and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        self.__size = sum(os.path.getsize(self.__path(seq)) for seq in self.__segments)
+        self.__file = None
+        self.__active = None
+        self.__condition = threading.Condition()
+        if self.__segments:
+            logger.warning(f'{len(self.__segments)} spool segments ({self.__size} bytes) '
+                           + 'are left to replay to Camea DB')
+
+    def __path(self, seq: int) -> str:
+        return os.path.join(self.directory, f'{seq:08d}{SEGMENT_SUFFIX}')
+
+    def __seal(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            self.__active = None
+
+    def __rotate(self):
+        self.__seal()
+        seq = self.__segments[-1] + 1 if self.__segments else 0
+        self.__file = open(self.__path(seq), 'ab')
+        self.__file.write(MAGIC)
+        self.__active = seq
+        self.__segments.append(seq)
+        self.__size += len(MAGIC)
+
+    def append(self, msg_id: int, buffers: list) -> bool:
+        """
+        Writes the encoded frame to the spool and flushes it to the disk
+
+        Parameters:
+        -----------
+        msg_id: int
+            Message id of the frame
+        buffers: list
+            Frame buffers produced by camea_protocol.encode_frame()
+
+        Output:
+        -----------
+        True if the frame was spooled, False if the spool is full
+        """
+        length = sum(memoryview(buffer).nbytes for buffer in buffers)
+        with self.__condition:
+            if self.__size + RECORD.size + length > self.max_size:
+                DROPPED.inc()
+                logger.error(f'Spool {self.directory} is full, upload {msg_id} was dropped')
+                return False
+            if self.__file is None or self.__file.tell() >= self.segment_size:
+                self.__rotate()
+            self.__file.write(RECORD.pack(time.time(), msg_id, length))
+            for buffer in buffers:
+                self.__file.write(buffer)
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__size += RECORD.size + length
+            self.__condition.notify()
+        SPOOLED.inc()
+        return True
+
+    def take(self, timeout: float) -> str:
+        """
+        Returns path of the oldest segment to drain, the active segment
+        is sealed so the new records go to the next one
+
+        Parameters:
+        -----------
+        timeout: float
+            Time to wait for the segment in seconds
+
+        Output:
+        -----------
+        Segment path, None if the spool is empty
+        """
+        with self.__condition:
+            if not self.__segments:
+                self.__condition.wait(timeout)
+                if not self.__segments:
+                    return None
+            seq = self.__segments[0]
+            if seq == self.__active:
+                self.__seal()
+            return self.__path(seq)
+
+    def release(self, path: str, keep: bool = False) -> None:
+        """
+        Removes the drained segment
+
+        Parameters:
+        -----------
+        path: str
+            Segment path returned by take()
+        keep: bool
+            If True, the segment is renamed to *.bad instead of removing
+
+        Output:
+        -----------
+        """
+        with self.__condition:
+            size = os.path.getsize(path)
+            if keep:
+                os.replace(path, path + '.bad')
+            else:
+                os.remove(path)
+            self.__segments.remove(int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)]))
+            self.__size -= size
+
+    def reject(self, spooled_at: float, msg_id: int, frame) -> None:
+        """
+        Sets aside the upload that is never acknowledged: the record is appended
+        to the rejected.bad file (readable with read_segment()) and is not replayed
+
+        Parameters:
+        -----------
+        spooled_at: float
+            Spooling time of the upload in seconds since 1970
+        msg_id: int
+            Message id of the frame
+        frame: bytes-like object
+            Encoded frame
+
+        Output:
+        -----------
+        """
+        path = os.path.join(self.directory, REJECTED_FILE)
+        with self.__condition:
+            with open(path, 'ab') as f:
+                if f.tell() == 0:
+                    f.write(MAGIC)
+                f.write(RECORD.pack(spooled_at, msg_id, len(frame)))
+                f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+        REJECTED.inc()
+
+    def stats(self) -> dict:
+        """
+        Returns quantity of segments and the spool size
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Dictionary:
+            'segments', 'bytes'
+        """
+        with self.__condition:
+            return {'segments': len(self.__segments), 'bytes': self.__size}
+
+    def close(self) -> None:
+        """
+        Closes the active segment
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        with self.__condition:
+            self.__seal()
+            self.__condition.notify_all()
+
+
+def read_segment(path: str):
+    """
+    Reads the spool segment
+
+    Parameters:
+    -----------
+    path: str
+        Segment path
+
+    Output:
+    -----------
+    Generator of tuples (spooling time, message id, frame bytes),
+    the incomplete last record is skipped
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a spool segment')
+        offset = len(MAGIC)
+        while offset + RECORD.size <= len(data):
+            spooled_at, msg_id, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if offset + length > len(data):
+                return
+            yield spooled_at, msg_id, data[offset:offset + length]
+            offset += length
+
+
+class SpoolDrainer(threading.Thread):
+    """
+    Class represented background thread that replays the spooled uploads
+    to Camea DB at the limited rate, so the recovered link is not flooded
+    by the outage backlog. Every upload is replayed until it is acknowledged
+    or set aside with UploadSpool.reject() after max_attempts unacknowledged
+    replays (the attempts while no Camea DB connection is available are not
+    counted), so it does not block the uploads behind it. The segment is removed
+    once all its uploads are handled, so an upload may be delivered twice
+    if the service stops in the middle of the segment.
+
+    Constants:
+    -----------
+    RETRY_INTERVAL - time between the attempts while Camea DB is unreachable
+
+    Parameters:
+    -----------
+    spool: UploadSpool
+        Spool to drain
+    submit: callable
+        CameaDBPool.submit() or the like, returns the future of the ack
+    rate: float
+        Maximum quantity of the replayed uploads per second
+    ack_timeout: float
+        Time to wait for the ack of the replayed upload in seconds
+    next_msg_id: callable
+        Returns the message id for the replayed frame, the spooled id is kept if None
+    max_attempts: int
+        Quantity of the unacknowledged replays after which the upload is set aside
+
+    Methods:
+    -----------
+    run() --> None
+        Drains the spool until stopped
+    stop() --> None
+        Stops draining
+    """
+
+    RETRY_INTERVAL = 1
+
+    def __init__(self, spool: UploadSpool, submit, rate: float, ack_timeout: float = 11,
+                 next_msg_id=None, max_attempts: int = 3):
+        super().__init__(name='spool_drainer', daemon=True)
+        self.spool = spool
+        self.submit = submit
+        self.rate = rate
+        self.ack_timeout = ack_timeout
+        self.next_msg_id = next_msg_id
+        self.max_attempts = max_attempts
+        self.__next_at = 0.0
+        self.__stop_event = threading.Event()
+
+    def __throttle(self):
+        now = time.monotonic()
+        if self.__next_at > now:
+            self.__stop_event.wait(self.__next_at - now)
+        self.__next_at = max(self.__next_at, now) + 1 / self.rate
+
+    def __replay(self, msg_id: int, frame: bytes):
+        # True if delivered, False if not acknowledged, None if not sent
+        if self.next_msg_id is not None:
+            # the spooled id may be reused by the live uploads by now
+            msg_id = self.next_msg_id()
+            buffers = [frame[:4], msg_id.to_bytes(2, 'little'), memoryview(frame)[6:]]
+        else:
+            buffers = [frame]
+        try:
+            future = self.submit(msg_id=msg_id, buffers=buffers, timeout=self.ack_timeout)
+        except Exception as e:
+            logger.debug('Spooled upload was not sent: %s', e)
+            return None
+        try:
+            future.result(self.ack_timeout)
+        except Exception as e:
+            logger.debug('Spooled upload was not acknowledged: %s', e)
+            return False
+        REPLAYED.inc()
+        return True
+
+    def __drain(self, path: str) -> bool:
+        for spooled_at, msg_id, frame in read_segment(path):
+            attempts = 0
+            while True:
+                delivered = self.__replay(msg_id, frame)
+                if delivered:
+                    break
+                if delivered is False:
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        logger.error(f'Spooled upload {msg_id} was not acknowledged by Camea DB '
+                                     + f'{attempts} times, it was set aside')
+                        self.spool.reject(spooled_at, msg_id, frame)
+                        break
+                if self.__stop_event.wait(SpoolDrainer.RETRY_INTERVAL):
+                    return False
+            if self.__stop_event.is_set():
+                return False
+            self.__throttle()
+        return True
+
+    def run(self) -> None:
+        """
+        Drains the spool until stopped
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        while not self.__stop_event.is_set():
+            path = self.spool.take(timeout=SpoolDrainer.RETRY_INTERVAL)
+            if path is None:
+                continue
+            try:
+                if self.__drain(path):
+                    self.spool.release(path)
+                    logger.info(f'Spool segment {path} was replayed to Camea DB')
+            except (OSError, ValueError) as e:
+                # the unreadable segment would block the spool forever, it is kept aside
+                logger.error(f'Spool segment {path} was skipped: {e}')
+                self.spool.release(path, keep=True)
+
+    def stop(self) -> None:
+        """
+        Stops draining
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.__stop_event.set()
@@ -0,0 +1,87 @@
+import asyncio
+import configparser
+import socket
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from async_server import AsyncCameaServer, SessionConnection
+from camea_protocol import encode_frame
+
+ANSWER = b'x' * 128 * 1024
+
+
+class FakeProcessor:
+    """
+    QUERY_PROCESSOR stand-in answering every DetectionRequest at once from the loop,
+    as the requests rejected on arrival are answered
+    """
+
+    def __init__(self):
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({'service': {'host': '127.0.0.1', 'port': '0',
+                                           'operating_time': '0'}})
+        self.settings = SimpleNamespace(timeout=10, buffer=1024)
+        self.journal = None
+        self.detection_executor = SimpleNamespace(cancel=lambda tag: None)
+        self.answered = 0
+        self.errors = []
+
+    def submit_DetectionRequest(self, frame, conn):
+        try:
+            conn.sendall(ANSWER)
+        except ConnectionError as e:
+            self.errors.append(e)
+        self.answered += 1
+        return False
+
+
+class AsyncCameaServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.processor = FakeProcessor()
+        self.server = AsyncCameaServer(self.processor)
+        thread = threading.Thread(target=self.server.run, daemon=True)
+        thread.start()
+        for _ in range(100):
+            if self.server.server is not None and self.server.server.sockets:
+                break
+            time.sleep(0.01)
+        port = self.server.server.sockets[0].getsockname()[1]
+        self.addCleanup(thread.join, 2)
+        self.addCleanup(lambda: self.server.loop.call_soon_threadsafe(self.server.stop, 'test'))
+        self.client = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.addCleanup(self.client.close)
+        self.assertEqual(self.client.recv(4), AsyncCameaServer.HANDSHAKE)
+
+    def wait(self, condition, timeout: float = 5) -> bool:
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_client_that_does_not_read_is_not_read_either(self):
+        requests = 200
+        for msg_id in range(requests):
+            self.client.sendall(b''.join(encode_frame(msg_id, {'msg': 'DetectionRequest',
+                                                               'RequestID': msg_id})))
+        time.sleep(0.5)
+        # the answers fill the socket buffers and the loop waits for the drain
+        stalled = self.processor.answered
+        self.assertLess(stalled, requests)
+        received = 0
+        while received < requests * len(ANSWER):
+            received += len(self.client.recv(1024 * 1024))
+        self.assertTrue(self.wait(lambda: self.processor.answered == requests))
+        self.assertEqual(self.processor.errors, [])
+
+    def test_write_from_the_worker_thread_waits_for_the_flush(self):
+        self.assertTrue(self.wait(lambda: len(self.server.sessions) == 1))
+        writer = next(iter(self.server.sessions))
+        conn = SessionConnection(self.server.loop, writer, timeout=5)
+        self.assertEqual(conn.sendmsg([b'ab', memoryview(b'cd')]), 4)
+        self.assertEqual(self.client.recv(4), b'abcd')
+
+
+if __name__ == '__main__':
+    unittest.main()
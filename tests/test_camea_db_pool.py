@@ -0,0 +1,152 @@
+import socket
+import threading
+import time
+import unittest
+from camea_db_pool import CameaDBConnection
+from camea_protocol import FrameDecoder, encode_frame
+
+
+class FakeCameaDB:
+    """
+    Camea DB that answers the handshake (unless handshake is unset) and then
+    acks the uploads only if ack is set, with ack_id in place of the upload id if given
+    """
+
+    def __init__(self, ack: bool = False, ack_id: int = None, handshake: bool = True):
+        self.ack = ack
+        self.ack_id = ack_id
+        self.handshake = handshake
+        self.received = []
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self.__serve, daemon=True)
+        self.thread.start()
+
+    def __serve(self):
+        conn, _ = self.server.accept()
+        with conn:
+            conn.recv(12)
+            if not self.handshake:
+                conn.recv(1)
+                return
+            conn.sendall(b'KAxx\x00\x00\x00\x00\x00\x00\x00\x00')
+            decoder = FrameDecoder()
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                for frame in decoder.feed(data):
+                    self.received.append(frame.msg_id)
+                    if self.ack:
+                        msg_id = frame.msg_id if self.ack_id is None else self.ack_id
+                        conn.sendall(b''.join(encode_frame(msg_id, {'msg': 'ack'})))
+
+    def close(self):
+        self.server.close()
+
+
+class CameaDBConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeCameaDB()
+        self.broken = threading.Event()
+        self.conn = CameaDBConnection('127.0.0.1', self.db.port, 1024, max_in_flight=2,
+                                      on_broken=lambda conn: self.broken.set())
+
+    def tearDown(self):
+        self.conn.close()
+        self.db.close()
+
+    def frame(self, msg_id: int) -> list:
+        return encode_frame(msg_id, {'msg': 'LargeDetection'})
+
+    def assert_send_fails_or_future(self, msg_id: int) -> bool:
+        try:
+            future = self.conn.send(msg_id, self.frame(msg_id), timeout=5)
+        except ConnectionError:
+            return True
+        return future.exception(2) is not None
+
+    def test_expire_fails_waiting_and_queued_uploads(self):
+        first = self.conn.send(1, self.frame(1))
+        second = self.conn.send(2, self.frame(2))
+        late = []
+        sender = threading.Thread(target=lambda: late.append(
+            self.assert_send_fails_or_future(3)))
+        sender.start()
+        # the third sender waits for the free in-flight slot
+        time.sleep(0.2)
+        self.conn.expire(0)
+        sender.join(2)
+        self.assertFalse(sender.is_alive())
+        self.assertIsInstance(first.exception(1), TimeoutError)
+        self.assertIsInstance(second.exception(1), TimeoutError)
+        self.assertTrue(late[0])
+        self.assertTrue(self.broken.is_set())
+        self.assertEqual(self.conn.in_flight(), 0)
+
+    def test_send_after_break_raises(self):
+        self.conn.close()
+        with self.assertRaises(ConnectionError):
+            self.conn.send(1, self.frame(1))
+
+    def test_ack_resolves_upload_by_msg_id(self):
+        self.conn.close()
+        db = FakeCameaDB(ack=True)
+        conn = CameaDBConnection('127.0.0.1', db.port, 1024, max_in_flight=2, ack_by_id=True)
+        try:
+            futures = [conn.send(msg_id, self.frame(msg_id)) for msg_id in (5, 6, 7)]
+            for future in futures:
+                response, rtt = future.result(2)
+                self.assertEqual(response, 'msg:ack')
+                self.assertGreaterEqual(rtt, 0)
+            self.assertEqual(conn.stats()['acks'], 3)
+        finally:
+            conn.close()
+            db.close()
+
+    def test_any_reply_acks_the_oldest_upload_by_default(self):
+        self.conn.close()
+        db = FakeCameaDB(ack=True, ack_id=0)
+        conn = CameaDBConnection('127.0.0.1', db.port, 1024, max_in_flight=2)
+        try:
+            futures = [conn.send(msg_id, self.frame(msg_id)) for msg_id in (5, 6, 7)]
+            for future in futures:
+                self.assertEqual(future.result(2)[0], 'msg:ack')
+            self.assertEqual(conn.stats()['acks'], 3)
+        finally:
+            conn.close()
+            db.close()
+
+    def test_reply_of_unknown_id_does_not_ack_when_matching_by_id(self):
+        self.conn.close()
+        db = FakeCameaDB(ack=True, ack_id=0)
+        conn = CameaDBConnection('127.0.0.1', db.port, 1024, max_in_flight=2, ack_by_id=True)
+        try:
+            future = conn.send(5, self.frame(5))
+            time.sleep(0.2)
+            self.assertFalse(future.done())
+            self.assertEqual(conn.in_flight(), 1)
+        finally:
+            conn.close()
+            db.close()
+
+    def test_silent_camea_db_fails_the_handshake(self):
+        db = FakeCameaDB(handshake=False)
+        timeout = CameaDBConnection.HANDSHAKE_TIMEOUT
+        CameaDBConnection.HANDSHAKE_TIMEOUT = 0.2
+        try:
+            started = time.monotonic()
+            with self.assertRaises(OSError):
+                CameaDBConnection('127.0.0.1', db.port, 1024)
+            self.assertLess(time.monotonic() - started, 2)
+        finally:
+            CameaDBConnection.HANDSHAKE_TIMEOUT = timeout
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from camea_protocol import DATA, KEEP_ALIVE, FrameDecoder, PushDecoder, encode_frame
+
+
+def framed(msg_id: int, body: bytes) -> bytes:
+    return b''.join(encode_frame(msg_id, {'msg': body.decode('ISO-8859-1')}))
+
+
+class FrameDecoderTest(unittest.TestCase):
+
+    STREAM = (b'HSxx'
+              + framed(1, b'DetectionRequest|RequestID:1')
+              + b'KAxx\x00\x00\x00\x00\x00\x00\x00\x00'
+              + framed(2, b'DetectionRequest|RequestID:2'))
+
+    def decoded(self, frames: list) -> list:
+        return [(frame.marker, frame.msg_id, frame.text) for frame in frames]
+
+    def test_whole_stream(self):
+        frames = FrameDecoder().feed(self.STREAM)
+        self.assertEqual(self.decoded(frames),
+                         [(b'HSxx', 0, ''),
+                          (DATA, 1, 'msg:DetectionRequest|RequestID:1'),
+                          (KEEP_ALIVE, 0, ''),
+                          (DATA, 2, 'msg:DetectionRequest|RequestID:2')])
+        self.assertTrue(frames[1].is_detection_request())
+        self.assertEqual(frames[3].fields['RequestID'], '2')
+
+    def test_every_split_of_the_stream(self):
+        expected = self.decoded(FrameDecoder().feed(self.STREAM))
+        for i in range(len(self.STREAM) + 1):
+            for j in range(i, len(self.STREAM) + 1):
+                decoder = FrameDecoder()
+                frames = (decoder.feed(self.STREAM[:i]) + decoder.feed(self.STREAM[i:j])
+                          + decoder.feed(self.STREAM[j:]))
+                self.assertEqual(self.decoded(frames), expected, (i, j))
+                self.assertEqual(decoder.buffered(), 0)
+
+    def test_incomplete_frame_stays_buffered(self):
+        decoder = FrameDecoder()
+        frame = framed(7, b'DetectionRequest')
+        self.assertEqual(decoder.feed(frame[:-1]), [])
+        self.assertEqual(decoder.buffered(), len(frame) - 1)
+        self.assertEqual([f.msg_id for f in decoder.feed(frame[-1:])], [7])
+
+    def test_unknown_data_is_skipped_up_to_the_next_marker(self):
+        decoder = FrameDecoder()
+        frames = decoder.feed(b'garbage' + framed(3, b'A') + b'xxDA')
+        self.assertEqual([f.msg_id for f in frames], [3])
+        # the tail that may start the marker is kept
+        frames = decoder.feed(b'tP' + framed(4, b'B')[4:])
+        self.assertEqual([f.msg_id for f in frames], [4])
+
+    def test_too_long_frame_is_skipped(self):
+        decoder = FrameDecoder(max_frame_size=8)
+        frames = decoder.feed(framed(5, b'too long body') + framed(6, b'A'))
+        self.assertEqual([f.msg_id for f in frames], [6])
+
+    def test_to_bytes_round_trip(self):
+        frame = FrameDecoder().feed(framed(9, b'LargeDetection'))[0]
+        self.assertEqual(frame.to_bytes(), framed(9, b'LargeDetection'))
+
+
+class PushDecoderTest(unittest.TestCase):
+
+    def test_text_messages_split_by_terminators_and_message_start(self):
+        decoder = PushDecoder()
+        frames = decoder.feed(b'msg:LoopStateChanged|ChangedTo:high\n'
+                              b'msg:Other|A:1\x00msg:LoopStateChanged|ChangedTo:low')
+        self.assertEqual([frame.fields['msg'] for frame in frames], ['LoopStateChanged', 'Other'])
+        # the last message is not terminated yet
+        self.assertEqual(decoder.flush()[0].fields['ChangedTo'], 'low')
+
+    def test_unterminated_message_waits_for_flush(self):
+        decoder = PushDecoder()
+        self.assertEqual(decoder.feed(b'msg:LoopStateChanged|Chan'), [])
+        self.assertEqual(decoder.feed(b'gedTo:high'), [])
+        self.assertGreater(decoder.buffered(), 0)
+        frames = decoder.flush()
+        self.assertEqual(frames[0].fields, {'msg': 'LoopStateChanged', 'ChangedTo': 'high'})
+        self.assertEqual(decoder.buffered(), 0)
+        self.assertEqual(decoder.flush(), [])
+
+    def test_text_message_fragmented_byte_by_byte(self):
+        decoder = PushDecoder()
+        stream = b'msg:LoopStateChanged|ChangedTo:high\r\nmsg:LoopStateChanged|ChangedTo:low\r\n'
+        frames = []
+        for i in range(len(stream)):
+            frames += decoder.feed(stream[i:i + 1])
+        self.assertEqual([frame.fields['ChangedTo'] for frame in frames], ['high', 'low'])
+
+    def test_framed_stream_fragmented_byte_by_byte(self):
+        decoder = PushDecoder()
+        stream = (b'KAxx\x00\x00\x00\x00\x00\x00\x00\x00'
+                  + framed(1, b'LoopStateChanged') + framed(2, b'Other'))
+        frames = []
+        for i in range(len(stream)):
+            frames += decoder.feed(stream[i:i + 1])
+        # keep alive frames are not returned
+        self.assertEqual([(frame.marker, frame.msg_id, frame.fields['msg']) for frame in frames],
+                         [(DATA, 1, 'LoopStateChanged'), (DATA, 2, 'Other')])
+        self.assertEqual(decoder.flush(), [])
+
+    def test_too_long_text_message_is_skipped(self):
+        decoder = PushDecoder(max_frame_size=16)
+        self.assertEqual(decoder.feed(b'msg:' + b'x' * 32), [])
+        self.assertEqual(decoder.buffered(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from delayed_executor import DelayedExecutor
+
+
+class DelayedExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = DelayedExecutor(workers=1, max_pending=10)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_task_runs_after_delay(self):
+        done = threading.Event()
+        started = time.monotonic()
+        self.assertTrue(self.executor.submit(0.1, done.set))
+        self.assertTrue(done.wait(2))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_queued_task_expires_at_its_deadline(self):
+        release = threading.Event()
+        expired_at = []
+        ran = []
+        expired = threading.Event()
+        # the only worker is busy, the next task waits for it
+        self.executor.submit(0, release.wait, 5)
+        deadline = time.monotonic() + 0.2
+        self.executor.submit(0, ran.append, 1, expires_at=deadline,
+                             on_expired=lambda: expired_at.append(time.monotonic())
+                             or expired.set())
+        self.assertTrue(expired.wait(2))
+        self.assertLess(expired_at[0] - deadline, 0.1)
+        release.set()
+        time.sleep(0.1)
+        self.assertEqual(ran, [])
+        self.assertEqual(self.executor.pending(), 0)
+
+    def test_delayed_task_expires_before_its_due_time(self):
+        expired = threading.Event()
+        ran = []
+        self.executor.submit(5, ran.append, 1, expires_at=time.monotonic() + 0.1,
+                             on_expired=expired.set)
+        self.assertTrue(expired.wait(2))
+        self.assertEqual(ran, [])
+        self.assertEqual(self.executor.pending(), 0)
+
+    def test_started_task_does_not_expire(self):
+        done = threading.Event()
+        expired = []
+        self.executor.submit(0, lambda: time.sleep(0.2) or done.set(),
+                             expires_at=time.monotonic() + 0.1,
+                             on_expired=lambda: expired.append(1))
+        self.assertTrue(done.wait(2))
+        time.sleep(0.05)
+        self.assertEqual(expired, [])
+
+    def test_cancel_and_max_pending(self):
+        executor = DelayedExecutor(workers=1, max_pending=2)
+        try:
+            self.assertTrue(executor.submit(5, print, tag='a'))
+            self.assertTrue(executor.submit(5, print, tag='b'))
+            self.assertFalse(executor.submit(5, print, tag='a'))
+            self.assertEqual(executor.cancel('a'), 1)
+            self.assertEqual(executor.pending(), 1)
+            self.assertTrue(executor.submit(5, print, tag='a'))
+        finally:
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import requests
+from http_client import VidarHttpClient
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """
+    requests.Session stand-in answering with the next of the given outcomes:
+    HTTP status or exception to raise, the last one is repeated
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.urls = []
+
+    def get(self, url, timeout, stream):
+        self.urls.append(url)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+    def close(self):
+        pass
+
+
+class VidarHttpClientTest(unittest.TestCase):
+
+    def client(self, outcomes, retries: int = 2, retry_ratio: float = 0.2) -> VidarHttpClient:
+        client = VidarHttpClient(retries=retries, retry_ratio=retry_ratio)
+        client.session = FakeSession(outcomes)
+        return client
+
+    def test_retry_statuses_are_retried(self):
+        client = self.client([503, 502, 200])
+        self.assertEqual(client.get('http://vidar/a', endpoint='querydb').status_code, 200)
+        self.assertEqual(len(client.session.urls), 3)
+
+    def test_other_statuses_are_not_retried(self):
+        client = self.client([404, 200])
+        self.assertEqual(client.get('http://vidar/a', endpoint='querydb').status_code, 404)
+        self.assertEqual(len(client.session.urls), 1)
+
+    def test_last_failed_response_is_returned_after_the_retries(self):
+        client = self.client([503])
+        self.assertEqual(client.get('http://vidar/a', endpoint='querydb').status_code, 503)
+        self.assertEqual(len(client.session.urls), 3)
+
+    def test_connection_error_is_raised_after_the_retries(self):
+        client = self.client([requests.ConnectionError('refused')], retries=1)
+        with self.assertRaises(requests.ConnectionError):
+            client.get('http://vidar/a', endpoint='querydb')
+        self.assertEqual(len(client.session.urls), 2)
+
+    def test_request_without_retry_is_sent_once(self):
+        client = self.client([requests.Timeout('read timeout'), 200])
+        with self.assertRaises(requests.Timeout):
+            client.get('http://vidar/swtrigger', endpoint='swtrigger', retry=False)
+        self.assertEqual(len(client.session.urls), 1)
+        self.assertEqual(client.stats()['swtrigger']['retries'], 0)
+
+    def test_retry_budget_limits_the_retries_of_the_failing_camera(self):
+        client = self.client([503], retries=2, retry_ratio=0)
+        for _ in range(10):
+            client.get('http://vidar/a', endpoint='querydb')
+        # the full budget of MAX_RETRY_TOKENS retries is spent, then no request is retried
+        self.assertEqual(client.stats()['querydb']['retries'], VidarHttpClient.MAX_RETRY_TOKENS)
+        sent = len(client.session.urls)
+        client.get('http://vidar/a', endpoint='querydb')
+        self.assertEqual(len(client.session.urls), sent + 1)
+
+    def test_requests_earn_the_retry_budget_back(self):
+        client = self.client([503], retries=1, retry_ratio=0.5)
+        for _ in range(20):
+            client.get('http://vidar/a', endpoint='querydb')
+        # the budget is refilled by every request, so it lasts longer than MAX_RETRY_TOKENS
+        self.assertGreater(client.stats()['querydb']['retries'], VidarHttpClient.MAX_RETRY_TOKENS)
+        self.assertLess(client.stats()['querydb']['retries'], 20)
+
+    def test_stats_are_collected_per_endpoint(self):
+        client = self.client([503, 200, 200])
+        client.get('http://vidar/a', endpoint='querydb')
+        client.get('http://vidar/b', endpoint='getdata')
+        stats = client.stats()
+        self.assertEqual(stats['querydb']['count'], 2)
+        self.assertEqual(stats['querydb']['errors'], 1)
+        self.assertEqual(stats['querydb']['retries'], 1)
+        self.assertEqual(stats['getdata'], {**stats['getdata'], 'count': 1, 'errors': 0,
+                                            'retries': 0})
+        self.assertGreaterEqual(stats['querydb']['max'], stats['querydb']['last'])
+
+
+if __name__ == '__main__':
+    unittest.main()
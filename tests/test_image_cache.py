@@ -0,0 +1,65 @@
+import time
+import unittest
+from image_cache import ImageCache
+
+
+def image(size: int) -> dict:
+    # the size of the cached image is the total length of its values
+    return {'image': 'x' * size, 'lp': '', 'country': None}
+
+
+class ImageCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_images_are_evicted_first(self):
+        cache = ImageCache(max_bytes=300, ttl=0)
+        for id in (1, 2, 3):
+            cache.put(id, image(100))
+        # 1 is used, so 2 is the least recently used one
+        self.assertIsNotNone(cache.get(1))
+        cache.put(4, image(150))
+        self.assertIsNone(cache.get(2))
+        self.assertIsNone(cache.get(3))
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNotNone(cache.get(4))
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 2, 'evictions': 2,
+                                         'items': 2, 'bytes': 250})
+
+    def test_replaced_image_is_counted_once(self):
+        cache = ImageCache(max_bytes=300, ttl=0)
+        cache.put('7', image(100))
+        cache.put(7, image(200))
+        self.assertEqual(cache.get(7)['image'], 'x' * 200)
+        self.assertEqual(cache.stats()['bytes'], 200)
+        self.assertEqual(cache.stats()['evictions'], 0)
+
+    def test_expired_image_is_missing(self):
+        cache = ImageCache(max_bytes=300, ttl=0.05)
+        cache.put(1, image(100))
+        self.assertIn(1, cache)
+        time.sleep(0.1)
+        self.assertNotIn(1, cache)
+        self.assertIsNone(cache.get(1))
+        # the expired image does not take the budget anymore
+        self.assertEqual(cache.stats()['bytes'], 0)
+        self.assertEqual(len(cache), 0)
+
+    def test_image_larger_than_the_budget_is_not_cached(self):
+        cache = ImageCache(max_bytes=300, ttl=0)
+        cache.put(1, image(100))
+        cache.put(2, image(301))
+        self.assertIsNone(cache.get(2))
+        # the cached images are kept
+        self.assertIsNotNone(cache.get(1))
+        self.assertEqual(cache.stats()['evictions'], 0)
+
+    def test_image_of_the_whole_budget_evicts_everything(self):
+        cache = ImageCache(max_bytes=300, ttl=0)
+        cache.put(1, image(100))
+        cache.put(2, image(100))
+        cache.put(3, image(300))
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'evictions': 2,
+                                         'items': 1, 'bytes': 300})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import base64
+import unittest
+from image_generator import ImageGenerator
+
+
+class ImageGeneratorCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        # the cache is shared by all the generators
+        self.cache = ImageGenerator._ImageGenerator__cache
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+        cache_size = ImageGenerator.CACHE_SIZE
+        ImageGenerator.CACHE_SIZE = 3
+        self.addCleanup(setattr, ImageGenerator, 'CACHE_SIZE', cache_size)
+
+    def generator(self, text: str, **kwargs) -> ImageGenerator:
+        return ImageGenerator(text, image_size=(64, 32), lpr_image_size=(40, 10), **kwargs)
+
+    def info(self, before: dict) -> dict:
+        after = ImageGenerator.cache_info()
+        return {'hits': after['hits'] - before['hits'],
+                'misses': after['misses'] - before['misses'],
+                'size': after['size']}
+
+    def test_same_image_is_encoded_once(self):
+        before = ImageGenerator.cache_info()
+        first = self.generator('AA1234BB').image_base64()
+        # another generator of the same image shares the cached bytes
+        self.assertIs(self.generator('AA1234BB').image_base64(), first)
+        self.assertEqual(self.generator('AA1234BB').generate_image_base64(), first.decode())
+        self.assertTrue(base64.b64decode(first).startswith(b'\x89PNG'))
+        self.assertEqual(self.info(before), {'hits': 2, 'misses': 1, 'size': 1})
+
+    def test_every_key_field_makes_the_separate_entry(self):
+        before = ImageGenerator.cache_info()
+        self.generator('A').image_base64()
+        self.generator('A').lpr_image_base64()
+        self.generator('B').image_base64()
+        ImageGenerator('A', image_size=(32, 32)).image_base64()
+        self.assertEqual(self.info(before), {'hits': 0, 'misses': 4, 'size': 3})
+        before = ImageGenerator.cache_info()
+        self.generator('A', image_format='JPEG', quality=50).image_base64()
+        self.generator('A', image_format='JPEG', quality=90).image_base64()
+        self.assertEqual(self.info(before), {'hits': 0, 'misses': 2, 'size': 3})
+
+    def test_png_ignores_the_quality(self):
+        before = ImageGenerator.cache_info()
+        self.generator('A', quality=50).image_base64()
+        self.generator('A', quality=90).image_base64()
+        self.assertEqual(self.info(before), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_least_recently_used_image_is_evicted(self):
+        for text in ('A', 'B', 'C'):
+            self.generator(text).image_base64()
+        # A is used, so B is the least recently used one
+        self.generator('A').image_base64()
+        self.generator('D').image_base64()
+        self.assertEqual(ImageGenerator.cache_info()['size'], 3)
+        self.assertEqual([key[1] for key in self.cache], ['C', 'A', 'D'])
+        before = ImageGenerator.cache_info()
+        self.generator('B').image_base64()
+        self.assertEqual(self.info(before), {'hits': 0, 'misses': 1, 'size': 3})
+
+    def test_unsupported_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ImageGenerator('A', image_format='GIF')
+
+
+if __name__ == '__main__':
+    unittest.main()
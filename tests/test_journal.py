@@ -0,0 +1,72 @@
+import os
+import tempfile
+import threading
+import unittest
+from camea_protocol import DATA, Frame
+from journal import JournalWriter, read_journal
+
+
+class BlockingFile:
+    """
+    File stand-in whose writes wait until released
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.written = []
+
+    def write(self, data):
+        self.release.wait(5)
+        self.written.append(bytes(data))
+
+    def close(self):
+        pass
+
+
+class JournalWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'capture.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def frame(self, msg_id: int) -> Frame:
+        return Frame(DATA, msg_id, f'msg:DetectionRequest|RequestID:{msg_id}'.encode())
+
+    def test_recorded_frames_are_read_back(self):
+        journal = JournalWriter(self.path, max_size=1024 * 1024)
+        session = journal.session()
+        journal.record([self.frame(1), self.frame(2)], session)
+        journal.record([self.frame(3)], journal.session())
+        journal.close()
+        records = list(read_journal(self.path))
+        self.assertEqual([(session_id, frame.msg_id) for _, session_id, frame in records],
+                         [(session, 1), (session, 2), (session + 1, 3)])
+        self.assertEqual(records[0][2].fields['RequestID'], '1')
+
+    def test_capture_stops_at_the_size_limit(self):
+        journal = JournalWriter(self.path, max_size=100)
+        for msg_id in range(10):
+            journal.record([self.frame(msg_id)], 0)
+        journal.close()
+        self.assertLessEqual(os.path.getsize(self.path), 100)
+        # a record takes 62 bytes after the 4 bytes signature
+        self.assertEqual([frame.msg_id for _, _, frame in read_journal(self.path)], [0])
+
+    def test_records_are_dropped_while_the_disk_is_slow(self):
+        journal = JournalWriter(self.path, max_size=1024 * 1024, queue_size=2)
+        slow = BlockingFile()
+        journal._JournalWriter__file = slow
+        # the first record is taken by the writer, two more fit into the queue
+        for msg_id in range(10):
+            journal.record([self.frame(msg_id)], 0)
+        slow.release.set()
+        journal.close()
+        self.assertLess(len(slow.written), 10)
+        self.assertGreaterEqual(len(slow.written), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import logging
+import unittest
+from logging_setup import RateLimitFilter
+
+
+def record(msg: str, lineno: int, level: int = logging.DEBUG) -> logging.LogRecord:
+    return logging.LogRecord('test', level, 'module.py', lineno, msg, None, None)
+
+
+class RateLimitFilterTest(unittest.TestCase):
+
+    def test_formatted_messages_share_the_call_site_limit(self):
+        rate_limit = RateLimitFilter(rate=0.001, burst=3)
+        passed = [rate_limit.filter(record(f'Image {i} exceeds the budget', 10))
+                  for i in range(10)]
+        self.assertEqual(passed, [True] * 3 + [False] * 7)
+
+    def test_call_sites_are_limited_separately(self):
+        rate_limit = RateLimitFilter(rate=0.001, burst=1)
+        self.assertTrue(rate_limit.filter(record('same', 10)))
+        self.assertFalse(rate_limit.filter(record('same', 10)))
+        self.assertTrue(rate_limit.filter(record('same', 11)))
+
+    def test_suppressed_records_are_reported_with_the_next_passed_one(self):
+        rate_limit = RateLimitFilter(rate=0.001, burst=1)
+        rate_limit.filter(record('message', 10))
+        rate_limit.filter(record('message', 10))
+        rate_limit.rate = 1_000_000
+        passed = record('message', 10)
+        self.assertTrue(rate_limit.filter(passed))
+        self.assertEqual(passed.getMessage(), 'message (1 similar records suppressed)')
+
+    def test_info_records_are_not_limited(self):
+        rate_limit = RateLimitFilter(rate=0.001, burst=1)
+        self.assertTrue(all(rate_limit.filter(record('info', 10, logging.INFO))
+                            for _ in range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
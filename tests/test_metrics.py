@@ -0,0 +1,90 @@
+import unittest
+import urllib.error
+import urllib.request
+from metrics import MetricsRegistry, MetricsServer
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_is_registered_once_per_name_and_labels(self):
+        first = self.registry.counter('requests_total', 'Requests', labels={'result': 'found'})
+        again = self.registry.counter('requests_total', 'Requests', labels={'result': 'found'})
+        other = self.registry.counter('requests_total', 'Requests', labels={'result': 'error'})
+        self.assertIs(first, again)
+        self.assertIsNot(first, other)
+        first.inc()
+        again.inc(2)
+        self.assertEqual(first.samples(), [('requests_total{result="found"}', 3)])
+
+    def test_histogram_counts_are_cumulative(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.samples(),
+                         [('latency_seconds_bucket{le="0.1"}', 2),
+                          ('latency_seconds_bucket{le="1.0"}', 3),
+                          ('latency_seconds_bucket{le="+Inf"}', 4),
+                          ('latency_seconds_sum', 2.65),
+                          ('latency_seconds_count', 4)])
+
+    def test_histogram_times_the_block(self):
+        histogram = self.registry.histogram('stage_seconds', 'Stage', labels={'stage': 'parse'})
+        with histogram.time():
+            pass
+        samples = dict(histogram.samples())
+        self.assertEqual(samples['stage_seconds_count{stage="parse"}'], 1)
+        self.assertEqual(samples['stage_seconds_bucket{stage="parse",le="+Inf"}'], 1)
+
+    def test_gauge_is_read_on_render_and_replaced(self):
+        value = [1]
+        self.registry.gauge('queue_depth', 'Queue depth', lambda: value[0])
+        value[0] = 5
+        self.assertIn('queue_depth 5\n', self.registry.render())
+        self.registry.gauge('queue_depth', 'Queue depth', lambda: 7)
+        self.assertIn('queue_depth 7\n', self.registry.render())
+        self.assertNotIn('queue_depth 5', self.registry.render())
+
+    def test_render_prometheus_text_format(self):
+        self.registry.counter('b_total', 'B things', labels={'kind': 'x'}).inc()
+        self.registry.counter('b_total', 'B things', labels={'kind': 'y'})
+        self.registry.gauge('a_hits_total', 'A hits', lambda: 3, kind='counter')
+        self.assertEqual(self.registry.render(),
+                         '# HELP a_hits_total A hits\n'
+                         '# TYPE a_hits_total counter\n'
+                         'a_hits_total 3\n'
+                         '# HELP b_total B things\n'
+                         '# TYPE b_total counter\n'
+                         'b_total{kind="x"} 1\n'
+                         'b_total{kind="y"} 0\n')
+
+    def test_failing_gauge_does_not_break_the_render(self):
+        self.registry.gauge('broken', 'Broken', lambda: 1 / 0)
+        self.registry.counter('ok_total', 'Ok').inc()
+        with self.assertLogs('metrics', level='ERROR'):
+            text = self.registry.render()
+        self.assertIn('ok_total 1\n', text)
+        self.assertIn('# TYPE broken gauge\n', text)
+
+
+class MetricsServerTest(unittest.TestCase):
+
+    def test_metrics_are_served_over_http(self):
+        registry = MetricsRegistry()
+        registry.counter('served_total', 'Served').inc()
+        server = MetricsServer('127.0.0.1', 0, registry=registry)
+        server.start()
+        self.addCleanup(server.stop)
+        port = server._MetricsServer__server.server_address[1]
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=2) as r:
+            self.assertTrue(r.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+            self.assertEqual(r.read().decode('UTF-8'), registry.render())
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/other', timeout=2)
+        self.assertEqual(error.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import unittest
+from query_batcher import RangeQueryBatcher
+
+ROWS = [(timestamp, str(timestamp), '1') for timestamp in range(0, 10_000, 100)]
+
+
+class FakeVidar:
+    """
+    fetch_rows() stand-in recording the queried ranges, fails if error is set
+    """
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def fetch_rows(self, t1: int, t2: int) -> list:
+        with self.lock:
+            self.queries.append((t1, t2))
+        if self.error is not None:
+            raise self.error
+        return [row for row in ROWS if t1 < row[0] < t2]
+
+
+class RangeQueryBatcherTest(unittest.TestCase):
+
+    def get_rows(self, batcher: RangeQueryBatcher, ranges: list) -> list:
+        # every range is asked by its own caller at the same time
+        results = [None] * len(ranges)
+        barrier = threading.Barrier(len(ranges))
+
+        def call(i, t1, t2):
+            barrier.wait()
+            try:
+                results[i] = batcher.get_rows(t1, t2)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=call, args=(i, t1, t2))
+                   for i, (t1, t2) in enumerate(ranges)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_close_ranges_are_merged_into_one_query(self):
+        vidar = FakeVidar()
+        batcher = RangeQueryBatcher(vidar.fetch_rows, window=0.2, max_gap=1_000)
+        results = self.get_rows(batcher, [(1_000, 1_500), (1_200, 2_000), (2_500, 3_000)])
+        self.assertEqual(vidar.queries, [(1_000, 3_000)])
+        self.assertEqual(batcher.stats(), {'ranges': 3, 'queries': 1})
+        # every caller gets the rows of its own range only
+        self.assertEqual([[row[0] for row in rows] for rows in results],
+                         [[1_100, 1_200, 1_300, 1_400],
+                          [1_300, 1_400, 1_500, 1_600, 1_700, 1_800, 1_900],
+                          [2_600, 2_700, 2_800, 2_900]])
+
+    def test_distant_ranges_are_queried_separately(self):
+        vidar = FakeVidar()
+        batcher = RangeQueryBatcher(vidar.fetch_rows, window=0.2, max_gap=1_000)
+        results = self.get_rows(batcher, [(5_000, 5_500), (1_000, 1_500)])
+        self.assertEqual(vidar.queries, [(1_000, 1_500), (5_000, 5_500)])
+        self.assertEqual(batcher.stats(), {'ranges': 2, 'queries': 2})
+        self.assertEqual([row[0] for row in results[0]], [5_100, 5_200, 5_300, 5_400])
+
+    def test_failed_query_reaches_every_caller_of_the_batch(self):
+        error = ConnectionError('vidar is down')
+        vidar = FakeVidar(error=error)
+        batcher = RangeQueryBatcher(vidar.fetch_rows, window=0.2)
+        results = self.get_rows(batcher, [(1_000, 1_500), (1_200, 2_000), (1_400, 1_600)])
+        self.assertEqual(len(vidar.queries), 1)
+        self.assertEqual(results, [error, error, error])
+
+    def test_next_batch_is_collected_after_the_query(self):
+        vidar = FakeVidar()
+        batcher = RangeQueryBatcher(vidar.fetch_rows, window=0)
+        self.assertEqual([row[0] for row in batcher.get_rows(1_000, 1_300)], [1_100, 1_200])
+        self.assertEqual([row[0] for row in batcher.get_rows(1_000, 1_300)], [1_100, 1_200])
+        self.assertEqual(vidar.queries, [(1_000, 1_300), (1_000, 1_300)])
+
+
+if __name__ == '__main__':
+    unittest.main()
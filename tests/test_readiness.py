@@ -0,0 +1,78 @@
+import unittest
+from readiness import ReadinessPolicy
+
+
+class ReadinessPolicyTest(unittest.TestCase):
+
+    def learned(self, previous: float = 1.0, elapsed: float = 1.2) -> ReadinessPolicy:
+        policy = ReadinessPolicy(max_wait=3)
+        for _ in range(ReadinessPolicy.MIN_SAMPLES):
+            policy.observe(elapsed, previous)
+        return policy
+
+    def test_first_query_waits_the_whole_deadline_until_learned(self):
+        policy = ReadinessPolicy(max_wait=3)
+        self.assertEqual(policy.first_delay(), 3)
+        for _ in range(ReadinessPolicy.MIN_SAMPLES - 1):
+            policy.observe(1.2, 1.0)
+        self.assertIsNone(policy.lag(0.5))
+        self.assertEqual(policy.first_delay(), 3)
+
+    def test_lag_is_measured_between_the_miss_and_the_hit(self):
+        policy = self.learned(previous=1.0, elapsed=1.2)
+        self.assertAlmostEqual(policy.lag(0.5), 1.1)
+        self.assertAlmostEqual(policy.first_delay(), 1.1 * ReadinessPolicy.FIRST_ATTEMPT_FACTOR)
+
+    def test_first_query_hits_do_not_shrink_the_lag(self):
+        policy = self.learned()
+        delays = []
+        for _ in range(20):
+            delay = policy.first_delay()
+            delays.append(delay)
+            # the row is already there at the first query
+            policy.observe(delay, None)
+        self.assertAlmostEqual(policy.lag(0.5), 1.1)
+        # the first query is probed earlier until it misses the row
+        self.assertTrue(all(later < earlier for earlier, later in zip(delays, delays[1:])))
+
+    def test_miss_after_early_hits_restores_the_first_delay(self):
+        policy = self.learned()
+        policy.observe(0.8, None)
+        policy.observe(0.7, None)
+        policy.observe(1.2, 1.0)
+        self.assertAlmostEqual(policy.first_delay(), 1.1 * ReadinessPolicy.FIRST_ATTEMPT_FACTOR)
+
+    def test_first_query_hits_probe_earlier_while_learning(self):
+        policy = ReadinessPolicy(max_wait=3)
+        policy.observe(3, None)
+        self.assertAlmostEqual(policy.first_delay(), 3 * ReadinessPolicy.FIRST_ATTEMPT_FACTOR)
+        self.assertIsNone(policy.lag(0.5))
+
+    def test_slower_vidar_raises_the_lag(self):
+        policy = self.learned(previous=1.0, elapsed=1.2)
+        for _ in range(20):
+            policy.observe(2.2, 2.0)
+        self.assertAlmostEqual(policy.lag(0.5), 2.1)
+
+    def test_backoff_doubles_up_to_the_maximum_and_stops_at_the_deadline(self):
+        policy = ReadinessPolicy(max_wait=3)
+        self.assertEqual([policy.next_delay(attempt, 1.0) for attempt in range(1, 6)],
+                         [0.1, 0.2, 0.4, 0.8, 1.0])
+        # the last query is sent at the deadline
+        self.assertAlmostEqual(policy.next_delay(5, 2.7), 0.3)
+        self.assertIsNone(policy.next_delay(1, 3))
+
+    def test_rows_are_ready_once_the_row_after_the_transit_is_found(self):
+        policy = ReadinessPolicy(max_wait=3)
+        self.assertFalse(policy.is_ready({}, 1_000, 0.5))
+        self.assertFalse(policy.is_ready({'990': '1'}, 1_000, 0.5))
+        self.assertTrue(policy.is_ready({'990': '1', '1010': '2'}, 1_000, 0.5))
+
+    def test_rows_are_ready_after_the_learned_lag(self):
+        policy = self.learned(previous=1.0, elapsed=1.2)
+        self.assertFalse(policy.is_ready({'990': '1'}, 1_000, 1.0))
+        self.assertTrue(policy.is_ready({'990': '1'}, 1_000, 1.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
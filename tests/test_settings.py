@@ -0,0 +1,74 @@
+import configparser
+import unittest
+from settings import Settings
+
+CONFIG = """
+[service]
+module_id = KY-DV-V2
+mode = VIDAR
+
+[settings]
+buffer = 1024
+timezone = Europe/Kyiv
+timeout = 11
+camera_unit_id = CAMERA_1
+
+[vidar]
+ip = 192.168.6.161
+tolerance = 500
+zone = 0
+timeout = 3
+"""
+
+LANE2 = """
+[camera:lane2]
+unit_id = CAMERA_2
+module_id = KY-DV-V3
+ip = 192.168.6.162
+zone = 2, 3
+"""
+
+
+def settings(text: str) -> Settings:
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return Settings.from_config(config)
+
+
+class SettingsRouteTest(unittest.TestCase):
+
+    def test_single_camera_ignores_the_unit(self):
+        single = settings(CONFIG)
+        self.assertIs(single.route({'UnitID': 'CAMERA_1'}), single.default_camera)
+        self.assertIs(single.route({'UnitID': 'OTHER'}), single.default_camera)
+        self.assertIs(single.route({}), single.default_camera)
+
+    def test_routes_by_unit(self):
+        multi = settings(CONFIG + LANE2)
+        camera = multi.route({'UnitID': 'CAMERA_2'})
+        self.assertEqual(camera.name, 'lane2')
+        self.assertEqual(camera.module_id, 'KY-DV-V3')
+        self.assertEqual(camera.zone_filter, frozenset({'2', '3'}))
+        self.assertEqual(camera.tolerance, 500)
+        self.assertIs(multi.route({'UnitID': 'CAMERA_1'}), multi.default_camera)
+
+    def test_unknown_unit_is_not_routed(self):
+        multi = settings(CONFIG + LANE2)
+        self.assertIsNone(multi.route({'UnitID': 'OTHER', 'RequestID': '1'}))
+
+    def test_missing_unit_goes_to_the_default_camera(self):
+        multi = settings(CONFIG + LANE2)
+        self.assertIs(multi.route({}), multi.default_camera)
+
+    def test_custom_route_field(self):
+        multi = settings(CONFIG.replace('mode = VIDAR', 'mode = VIDAR\nroute_field = Lane')
+                         + LANE2)
+        self.assertEqual(multi.route({'Lane': 'CAMERA_2', 'UnitID': 'CAMERA_1'}).name, 'lane2')
+
+    def test_duplicate_unit_is_rejected(self):
+        with self.assertRaises(ValueError):
+            settings(CONFIG + LANE2.replace('CAMERA_2', 'CAMERA_1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import configparser
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from camea_protocol import DATA, Frame
+from delayed_executor import DelayedExecutor
+from http_client import VidarHttpClient
+from prefetch import VidarPrefetcher
+from settings import Settings
+from socket_server import QUERY_PROCESSOR
+from tests.test_settings import CONFIG, LANE2
+
+
+class FakeCameaService:
+    """
+    CameaService stand-in recording the not found responses
+    """
+
+    def __init__(self):
+        self.not_found = []
+        self.answered = threading.Event()
+
+    def send_image_not_found_response(self, conn, id, request, config, module_id=None):
+        self.not_found.append((request['RequestID'], module_id))
+        self.answered.set()
+
+
+def processor(text: str) -> QUERY_PROCESSOR:
+    # the processor without the connections, the request path only
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    query_processor = QUERY_PROCESSOR.__new__(QUERY_PROCESSOR)
+    query_processor.config = config
+    query_processor.settings = Settings.from_config(config)
+    query_processor.msg_id = 0
+    query_processor.msg_id_lock = threading.Lock()
+    query_processor.readiness = None
+    query_processor.camea_service = FakeCameaService()
+    query_processor.looked_up = []
+    query_processor._QUERY_PROCESSOR__vidar_service = query_processor.looked_up.append
+    return query_processor
+
+
+def request(unit: str = None, image_time: str = '20240101T120000000+0000') -> Frame:
+    body = f'msg:DetectionRequest|RequestID:42|ImageTime:{image_time}|ToleranceMS:500'
+    if unit:
+        body += f'|UnitID:{unit}'
+    return Frame(DATA, 1, body.encode('ISO-8859-1'))
+
+
+class UnknownUnitTest(unittest.TestCase):
+
+    def test_unknown_unit_is_answered_as_not_found_without_lookup(self):
+        query_processor = processor(CONFIG + LANE2)
+        with self.assertLogs('socket_server', level='ERROR'):
+            query_processor.process_DetectionRequest(request('OTHER'), conn=None)
+        self.assertEqual(query_processor.camea_service.not_found, [('42', 'KY-DV-V2')])
+        self.assertEqual(query_processor.looked_up, [])
+
+
+def image_time(age: float) -> str:
+    dt = datetime.now(timezone.utc) - timedelta(seconds=age)
+    return dt.strftime('%Y%m%dT%H%M%S%f')[:-3] + '+0000'
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def processor(self, deadline: float) -> QUERY_PROCESSOR:
+        query_processor = processor(CONFIG.replace('camera_unit_id = CAMERA_1',
+                                                   f'camera_unit_id = CAMERA_1\n'
+                                                   f'deadline = {deadline}'))
+        query_processor.detection_executor = DelayedExecutor(workers=1, max_pending=10)
+        self.addCleanup(query_processor.detection_executor.shutdown)
+        return query_processor
+
+    def test_no_deadline_processes_old_requests(self):
+        query_processor = self.processor(deadline=0)
+        self.assertTrue(query_processor.submit_DetectionRequest(request(
+            image_time=image_time(3600)), conn=None))
+        self.assertEqual(query_processor.camea_service.not_found, [])
+
+    def test_expired_request_is_answered_at_once(self):
+        query_processor = self.processor(deadline=10)
+        self.assertFalse(query_processor.submit_DetectionRequest(request(
+            image_time=image_time(20)), conn=None))
+        self.assertEqual(query_processor.camea_service.not_found, [('42', 'KY-DV-V2')])
+
+    def test_request_expiring_during_the_delay_is_answered_at_the_deadline(self):
+        # the vidar timeout (3 s) is longer than the time left to the deadline
+        query_processor = self.processor(deadline=10)
+        started = time.monotonic()
+        self.assertTrue(query_processor.submit_DetectionRequest(request(
+            image_time=image_time(9.7)), conn=None))
+        self.assertTrue(query_processor.camea_service.answered.wait(3))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(query_processor.looked_up, [])
+
+
+class FakeSoftwareTrigger:
+
+    def __init__(self, vidar_service):
+        self.vidar_service = vidar_service
+
+    def attach(self, vidar_service):
+        self.vidar_service = vidar_service
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               'config.ini')) as f:
+            self.text = f.read()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.config_file = os.path.join(directory.name, 'config.ini')
+        config_file = QUERY_PROCESSOR.CONFIG_FILE
+        QUERY_PROCESSOR.CONFIG_FILE = self.config_file
+        self.addCleanup(setattr, QUERY_PROCESSOR, 'CONFIG_FILE', config_file)
+
+    def processor(self) -> QUERY_PROCESSOR:
+        # the processor with the embedded prefetch, without the trigger connection
+        query_processor = processor(self.text)
+        del query_processor._QUERY_PROCESSOR__vidar_service
+        query_processor.vidar_http = VidarHttpClient()
+        query_processor.image_cache = None
+        query_processor.transit_indexers = dict()
+        query_processor.vidar_services = dict()
+        query_processor.vidar_services_lock = threading.Lock()
+        vidar_service = query_processor._QUERY_PROCESSOR__vidar_service(
+            query_processor.settings.default_camera)
+        query_processor.vidar_service = vidar_service
+        query_processor._QUERY_PROCESSOR__prefetch_service(vidar_service)
+        query_processor.prefetcher = VidarPrefetcher(vidar_service, delay=0, zone='0')
+        self.addCleanup(query_processor.prefetcher.shutdown)
+        query_processor.software_trigger = FakeSoftwareTrigger(vidar_service)
+        return query_processor
+
+    def test_prefetch_follows_the_camera_moved_to_another_unit(self):
+        query_processor = self.processor()
+        with open(self.config_file, 'w') as f:
+            f.write(self.text.replace('ip = 192.168.6.161', 'ip = 192.168.6.170')
+                    .replace('zone = 0', 'zone = 1, 2', 1))
+        self.assertTrue(query_processor.reload_config())
+        vidar_service = query_processor.vidar_service
+        self.assertEqual(vidar_service.IP, '192.168.6.170')
+        self.assertIs(query_processor.prefetcher.vidar_service, vidar_service)
+        self.assertEqual(query_processor.prefetcher.zone, {'1', '2'})
+        self.assertIs(query_processor.software_trigger.vidar_service, vidar_service)
+        self.assertIsNotNone(vidar_service.index)
+        self.assertIsNotNone(vidar_service.cache)
+
+    def test_unchanged_camera_keeps_the_service(self):
+        query_processor = self.processor()
+        vidar_service = query_processor.vidar_service
+        with open(self.config_file, 'w') as f:
+            f.write(self.text)
+        self.assertTrue(query_processor.reload_config())
+        self.assertIs(query_processor.vidar_service, vidar_service)
+        self.assertIs(query_processor.prefetcher.vidar_service, vidar_service)
+
+
+if __name__ == '__main__':
+    unittest.main()
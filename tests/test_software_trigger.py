@@ -0,0 +1,52 @@
+import socket
+import threading
+import time
+import unittest
+from camea_protocol import PushDecoder
+from software_trigger import SoftwareTrigger
+
+
+class SoftwareTriggerReceiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client, self.push = socket.socketpair()
+        self.addCleanup(self.client.close)
+        self.addCleanup(self.push.close)
+        # the trigger without the config and the Camea Push System connection
+        self.trigger = SoftwareTrigger.__new__(SoftwareTrigger)
+        self.trigger.buffer = 1024
+        self.decoder = PushDecoder()
+
+    def receive(self) -> list:
+        _, messages = self.trigger._SoftwareTrigger__receive(self.client, self.decoder)
+        return messages
+
+    def test_fragmented_message_is_not_taken_before_its_end(self):
+        self.push.sendall(b'msg:LoopStateChanged|ChangedTo:high')
+        # the rest of the message follows within the idle flush time
+        sender = threading.Timer(SoftwareTrigger.IDLE_FLUSH / 5,
+                                 self.push.sendall, args=(b'|Lane:2\n',))
+        sender.start()
+        self.addCleanup(sender.cancel)
+        messages = self.receive()
+        while not messages:
+            messages = self.receive()
+        self.assertEqual([message.fields for message in messages],
+                         [{'msg': 'LoopStateChanged', 'ChangedTo': 'high', 'Lane': '2'}])
+        self.assertEqual(self.decoder.buffered(), 0)
+
+    def test_unterminated_message_is_taken_after_the_idle_time(self):
+        self.push.sendall(b'msg:LoopStateChanged|ChangedTo:high')
+        started = time.monotonic()
+        messages = self.receive()
+        self.assertGreaterEqual(time.monotonic() - started, SoftwareTrigger.IDLE_FLUSH * 0.9)
+        self.assertEqual([message.fields['ChangedTo'] for message in messages], ['high'])
+
+    def test_closed_connection_is_reported(self):
+        self.push.close()
+        with self.assertRaises(ConnectionResetError):
+            self.receive()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import Future
+from camea_protocol import encode_frame
+from spool import SpoolDrainer, UploadSpool, read_segment
+
+
+def frame(msg_id: int, size: int = 100) -> list:
+    return encode_frame(msg_id, {'msg': 'LargeDetection', 'FullImage64': b'x' * size})
+
+
+class FakeSubmit:
+    """
+    CameaDBPool.submit() stand-in that fails the given quantity of uploads first
+    and never acknowledges the uploads with the unacked message ids
+    """
+
+    def __init__(self, failures: int = 0, unacked=()):
+        self.failures = failures
+        self.unacked = set(unacked)
+        self.frames = []
+
+    def __call__(self, msg_id, buffers, timeout):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('no Camea DB connection is available')
+        self.frames.append(b''.join(bytes(buffer) for buffer in buffers))
+        future = Future()
+        if msg_id in self.unacked:
+            future.set_exception(TimeoutError('Camea DB ack timeout'))
+        else:
+            future.set_result(('ack', 0.0))
+        return future
+
+
+class UploadSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def segments(self) -> list:
+        return sorted(name for name in os.listdir(self.path) if name.endswith('.seg'))
+
+    def test_segments_rotate_at_the_segment_size(self):
+        spool = UploadSpool(self.path, max_size=1024 * 1024, segment_size=300)
+        for msg_id in range(5):
+            self.assertTrue(spool.append(msg_id, frame(msg_id)))
+        spool.close()
+        self.assertEqual(self.segments(), ['00000000.seg', '00000001.seg', '00000002.seg'])
+        records = [(msg_id, bytes(data)) for name in self.segments()
+                   for _, msg_id, data in read_segment(os.path.join(self.path, name))]
+        self.assertEqual([msg_id for msg_id, _ in records], [0, 1, 2, 3, 4])
+        self.assertEqual(records[3][1], b''.join(bytes(buffer) for buffer in frame(3)))
+        self.assertEqual(spool.stats()['segments'], 3)
+        self.assertEqual(spool.stats()['bytes'],
+                         sum(os.path.getsize(os.path.join(self.path, name))
+                             for name in self.segments()))
+
+    def test_full_spool_drops_the_upload(self):
+        spool = UploadSpool(self.path, max_size=200, segment_size=1024)
+        self.assertTrue(spool.append(1, frame(1)))
+        self.assertFalse(spool.append(2, frame(2)))
+        spool.close()
+
+    def test_take_seals_the_active_segment_and_release_removes_it(self):
+        spool = UploadSpool(self.path, max_size=1024 * 1024, segment_size=1024 * 1024)
+        spool.append(1, frame(1))
+        path = spool.take(timeout=0)
+        # the next upload goes to the new segment
+        spool.append(2, frame(2))
+        self.assertEqual(len(self.segments()), 2)
+        spool.release(path)
+        self.assertEqual(self.segments(), ['00000001.seg'])
+        self.assertEqual(spool.take(timeout=0), os.path.join(self.path, '00000001.seg'))
+        spool.close()
+
+    def test_segments_of_the_previous_run_are_kept(self):
+        spool = UploadSpool(self.path, max_size=1024 * 1024, segment_size=100)
+        spool.append(1, frame(1))
+        spool.append(2, frame(2))
+        spool.close()
+        reopened = UploadSpool(self.path, max_size=1024 * 1024, segment_size=100)
+        self.assertEqual(reopened.stats()['segments'], 2)
+        reopened.append(3, frame(3))
+        reopened.close()
+        self.assertEqual(self.segments()[-1], '00000002.seg')
+
+    def test_incomplete_last_record_is_skipped(self):
+        spool = UploadSpool(self.path, max_size=1024 * 1024, segment_size=1024 * 1024)
+        spool.append(1, frame(1))
+        spool.append(2, frame(2))
+        spool.close()
+        path = os.path.join(self.path, self.segments()[0])
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 10)
+        self.assertEqual([msg_id for _, msg_id, _ in read_segment(path)], [1])
+
+
+class SpoolDrainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = UploadSpool(self.directory.name, max_size=1024 * 1024, segment_size=300)
+        self.retry_interval = SpoolDrainer.RETRY_INTERVAL
+        SpoolDrainer.RETRY_INTERVAL = 0.01
+
+    def tearDown(self):
+        SpoolDrainer.RETRY_INTERVAL = self.retry_interval
+        self.spool.close()
+        self.directory.cleanup()
+
+    def drain(self, submit, next_msg_id=None, max_attempts=3):
+        drainer = SpoolDrainer(self.spool, submit, rate=1000, next_msg_id=next_msg_id,
+                               max_attempts=max_attempts)
+        path = self.spool.take(timeout=0)
+        while path is not None:
+            self.assertTrue(drainer._SpoolDrainer__drain(path))
+            self.spool.release(path)
+            path = self.spool.take(timeout=0)
+
+    def test_uploads_are_replayed_in_order_until_acked(self):
+        for msg_id in range(4):
+            self.spool.append(msg_id, frame(msg_id))
+        submit = FakeSubmit(failures=2)
+        self.drain(submit)
+        self.assertEqual(submit.frames,
+                         [b''.join(bytes(buffer) for buffer in frame(msg_id))
+                          for msg_id in range(4)])
+        self.assertEqual(self.spool.stats(), {'segments': 0, 'bytes': 0})
+
+    def test_unacked_upload_is_set_aside_after_max_attempts(self):
+        for msg_id in range(3):
+            self.spool.append(msg_id, frame(msg_id))
+        # the unreachable Camea DB does not use up the attempts
+        submit = FakeSubmit(failures=5, unacked={1})
+        self.drain(submit, max_attempts=2)
+        self.assertEqual([data[4:6] for data in submit.frames],
+                         [b'\x00\x00', b'\x01\x00', b'\x01\x00', b'\x02\x00'])
+        self.assertEqual(self.spool.stats(), {'segments': 0, 'bytes': 0})
+        rejected = list(read_segment(os.path.join(self.directory.name, 'rejected.bad')))
+        self.assertEqual([(msg_id, bytes(data)) for _, msg_id, data in rejected],
+                         [(1, b''.join(bytes(buffer) for buffer in frame(1)))])
+
+    def test_replayed_frames_get_the_new_msg_id(self):
+        self.spool.append(5, frame(5))
+        submit = FakeSubmit()
+        self.drain(submit, next_msg_id=lambda: 0x0102)
+        self.assertEqual(submit.frames[0][4:6], b'\x02\x01')
+        self.assertEqual(submit.frames[0][6:], b''.join(bytes(buffer)
+                                                        for buffer in frame(5))[6:])
+
+
+if __name__ == '__main__':
+    unittest.main()
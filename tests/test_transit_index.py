@@ -0,0 +1,104 @@
+import time
+import unittest
+from datetime import datetime, timezone
+from transit_index import TransitIndex, poll_transits
+from vidar_service import VidarService
+
+NOW = 1_700_000_000_000
+
+
+class FakeVidar:
+    """
+    Vidar that has the given rows and counts the querydb calls
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.new_rows_queries = []
+
+    def get_new_rows(self, last_timestamp, last_id):
+        self.new_rows_queries.append(last_timestamp)
+        return [row for row in self.rows if row[0] > last_timestamp]
+
+
+class TransitIndexCoversTest(unittest.TestCase):
+
+    def test_covers_up_to_the_ingestion_lag_before_the_poll(self):
+        index = TransitIndex(retention=60_000, ingestion_lag=1_000)
+        index.add([], polled_at=NOW)
+        self.assertTrue(index.covers(NOW - 60_000, NOW - 1_000))
+        self.assertFalse(index.covers(NOW - 60_000, NOW - 999))
+        self.assertFalse(index.covers(NOW - 60_001, NOW - 1_000))
+
+    def test_covers_up_to_the_poll_without_lag(self):
+        index = TransitIndex(retention=60_000)
+        index.add([], polled_at=NOW)
+        self.assertTrue(index.covers(NOW - 1_000, NOW))
+        self.assertFalse(index.covers(NOW - 1_000, NOW + 1))
+
+    def test_empty_index_covers_nothing(self):
+        index = TransitIndex(retention=60_000)
+        self.assertFalse(index.covers(NOW - 1_000, NOW - 500))
+
+    def test_pruned_range_is_not_covered(self):
+        index = TransitIndex(retention=10_000)
+        index.add([(NOW - 5_000, '1', 'A')], polled_at=NOW)
+        index.add([], polled_at=NOW + 20_000)
+        self.assertFalse(index.covers(NOW - 6_000, NOW - 4_000))
+        self.assertEqual(index.get_ids(NOW - 6_000, NOW - 4_000, '0'), {})
+
+    def test_get_ids_filters_range_and_zone(self):
+        index = TransitIndex(retention=60_000)
+        index.add([(NOW - 300, '1', 'A'), (NOW - 200, '2', 'B'), (NOW - 100, '3', 'A')],
+                  polled_at=NOW)
+        self.assertEqual(index.get_ids(NOW - 300, NOW, '0'),
+                         {str(NOW - 200): '2', str(NOW - 100): '3'})
+        self.assertEqual(index.get_ids(NOW - 400, NOW, ['A']),
+                         {str(NOW - 300): '1', str(NOW - 100): '3'})
+
+    def test_poll_repeats_the_ingestion_lag(self):
+        # poll_transits polls since the wall clock time
+        now = int(time.time() * 1_000)
+        vidar = FakeVidar([(now - 500, '1', 'A')])
+        index = TransitIndex(retention=60_000, ingestion_lag=1_000)
+        poll_transits(vidar, index)
+        # the row written late with the older timestamp
+        vidar.rows.append((now - 700, '2', 'A'))
+        poll_transits(vidar, index)
+        self.assertEqual(vidar.new_rows_queries[-1], now - 1_500)
+        self.assertEqual(len(index), 2)
+
+
+class TriggerIndexLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = []
+        self.vidar = VidarService('127.0.0.1')
+        self.vidar.pushdown = False
+        self.vidar.get_rows = lambda t1, t2: self.queries.append((t1, t2)) or [
+            (NOW - 1_500, '7', 'A')]
+        self.transit = datetime.fromtimestamp((NOW - 1_500) / 1000, tz=timezone.utc)
+
+    def test_trigger_index_without_hit_queries_vidar(self):
+        self.vidar.index = TransitIndex(retention=60_000, ingestion_lag=0, continuous=False)
+        self.vidar.index.add([], polled_at=NOW)
+        ids = self.vidar.get_ids(self.transit, tolerance=100, zone='0')
+        self.assertEqual(ids, {str(NOW - 1_500): '7'})
+        self.assertEqual(len(self.queries), 1)
+
+    def test_continuous_index_without_hit_is_trusted(self):
+        self.vidar.index = TransitIndex(retention=60_000, ingestion_lag=0)
+        self.vidar.index.add([], polled_at=NOW)
+        self.assertEqual(self.vidar.get_ids(self.transit, tolerance=100, zone='0'), {})
+        self.assertEqual(self.queries, [])
+
+    def test_index_hit_is_not_queried(self):
+        self.vidar.index = TransitIndex(retention=60_000, ingestion_lag=0, continuous=False)
+        self.vidar.index.add([(NOW - 1_480, '8', 'A')], polled_at=NOW)
+        ids = self.vidar.get_ids(self.transit, tolerance=100, zone='0')
+        self.assertEqual(ids, {str(NOW - 1_480): '8'})
+        self.assertEqual(self.queries, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
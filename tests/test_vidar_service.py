@@ -0,0 +1,91 @@
+import io
+import unittest
+import urllib.parse
+from datetime import datetime, timezone
+from errors import VidarUnavailable
+from vidar_service import VidarService
+
+ROWS = (b'<result><row><ID value="7"/><FRAMETIMEMS value="1700000000000"/>'
+        b'<ZONE_NAME value="1"/></row></result>')
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, body: bytes):
+        self.status_code = status_code
+        self.raw = io.BytesIO(body)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class FakeHttp:
+    """
+    Answers every querydb request with the next (predicate, status, body) the
+    SQL matches, records the SQL of the requests
+    """
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.queries = []
+
+    def get(self, url, endpoint, stream=False):
+        sql = urllib.parse.unquote(url.split('sql=', 1)[1])
+        self.queries.append(sql)
+        for predicate, status, body in self.answers:
+            if predicate(sql):
+                return FakeResponse(status, body)
+        return FakeResponse(200, ROWS)
+
+
+def filtered(sql: str) -> bool:
+    return 'order by' in sql
+
+
+class VidarPushdownTest(unittest.TestCase):
+
+    def get_ids(self, vidar):
+        transit = datetime.fromtimestamp(1_700_000_000, tz=timezone.utc)
+        return vidar.get_ids(transit, tolerance=500, zone=['1'], closest=2)
+
+    def test_transient_status_keeps_the_pushdown(self):
+        http = FakeHttp([(filtered, 503, b'')])
+        vidar = VidarService('vidar', http=http)
+        with self.assertRaises(VidarUnavailable):
+            self.get_ids(vidar)
+        self.assertTrue(vidar.pushdown)
+        self.assertTrue(vidar.projection)
+        # the unit is back, the next query is still filtered by vidar
+        http.answers.clear()
+        self.assertEqual(self.get_ids(vidar), {'1700000000000': '7'})
+        self.assertEqual(len(http.queries), 2)
+        self.assertIn('order by', http.queries[1])
+
+    def test_rejected_query_switches_the_pushdown_off(self):
+        http = FakeHttp([(filtered, 200, b'<error>syntax')])
+        vidar = VidarService('vidar', http=http)
+        self.assertEqual(self.get_ids(vidar), {'1700000000000': '7'})
+        self.assertFalse(vidar.pushdown)
+        # the column list passed with the plain query
+        self.assertTrue(vidar.projection)
+        http.queries.clear()
+        self.get_ids(vidar)
+        self.assertEqual(len(http.queries), 1)
+        self.assertNotIn('order by', http.queries[0])
+
+    def test_unavailable_vidar_is_reported(self):
+        http = FakeHttp([(lambda sql: True, 503, b'')])
+        vidar = VidarService('vidar', http=http)
+        with self.assertRaises(VidarUnavailable):
+            self.get_ids(vidar)
+        # neither the plain query nor the query of all the columns is tried
+        self.assertEqual(len(http.queries), 1)
+        self.assertTrue(vidar.pushdown)
+        self.assertTrue(vidar.projection)
+
+
+if __name__ == '__main__':
+    unittest.main()
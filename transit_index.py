@@ -0,0 +1,267 @@
+import bisect
+import logging
+import threading
+import time
+
+
+# set logger
+logger = logging.getLogger(__name__)
+
+
+class TransitIndex:
+    """
+    Class represented time-sorted, zone-aware in-memory index of the Vidar transits.
+    Rows are kept in parallel lists sorted by the image timestamp,
+    ranges are looked up with bisect. Rows older than the retention window
+    are dropped. Vidar writes the rows with the ingestion lag, so the index
+    is taken as complete only up to the ingestion lag before the last poll.
+
+    Parameters:
+    -----------
+    retention: int
+        Retention window in ms
+    ingestion_lag: int
+        Time in ms the Vidar rows may appear after their image timestamp
+    continuous: bool
+        True if the index is kept updated by the TransitIndexer,
+        False if it is polled on the software triggers only
+
+    Methods:
+    -----------
+    add(rows, polled_at) --> None
+        Adds the rows received by the poll that was started at polled_at
+    covers(t1, t2) --> bool
+        Checks if the index holds all the rows of the range
+    get_ids(t1, t2, zone) --> dict
+        Returns image timestamps along with IDs from the range with appropriate zone
+    last() --> tuple
+        Returns timestamp and ID of the newest row
+    """
+
+    def __init__(self, retention: int, ingestion_lag: int = 0, continuous: bool = True):
+        self.retention = retention
+        self.ingestion_lag = ingestion_lag
+        self.continuous = continuous
+        self.__timestamps = []
+        self.__ids = []
+        self.__zones = []
+        self.__known_ids = set()
+        self.__last = (None, None)
+        # range (valid_from; valid_to) the index is complete for
+        self.__valid_from = None
+        self.__valid_to = None
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __order(timestamp: int, id: str) -> tuple:
+        # Vidar IDs are numeric, compare them as numbers when possible
+        return (timestamp, int(id)) if id.isdigit() else (timestamp, 0)
+
+    def __len__(self):
+        return len(self.__timestamps)
+
+    def __prune(self, now: int):
+        cutoff = now - self.retention
+        position = bisect.bisect_left(self.__timestamps, cutoff)
+        if position:
+            for id in self.__ids[:position]:
+                self.__known_ids.discard(id)
+            del self.__timestamps[:position]
+            del self.__ids[:position]
+            del self.__zones[:position]
+        self.__valid_from = max(self.__valid_from, cutoff)
+
+    def add(self, rows, polled_at: int) -> None:
+        """
+        Adds the rows received by the poll that was started at polled_at
+
+        Parameters:
+        -----------
+        rows: iterable
+            Tuples (timestamp, image ID, zone)
+        polled_at: int
+            Time in ms since 1970 the poll was started at
+
+        Output:
+        -----------
+        """
+        with self.__lock:
+            if self.__valid_from is None:
+                self.__valid_from = polled_at - self.retention
+            for timestamp, id, zone in rows:
+                if id in self.__known_ids:
+                    continue
+                self.__known_ids.add(id)
+                if not self.__timestamps or timestamp >= self.__timestamps[-1]:
+                    position = len(self.__timestamps)
+                else:
+                    position = bisect.bisect_right(self.__timestamps, timestamp)
+                self.__timestamps.insert(position, timestamp)
+                self.__ids.insert(position, id)
+                self.__zones.insert(position, zone)
+                if self.__last[0] is None or (TransitIndex.__order(timestamp, id)
+                                              > TransitIndex.__order(*self.__last)):
+                    self.__last = (timestamp, id)
+            self.__valid_to = polled_at
+            self.__prune(polled_at)
+
+    def covers(self, t1: int, t2: int) -> bool:
+        """
+        Checks if the index holds all the rows of the range (t1; t2),
+        i.e. the range is inside the retention window and the last poll
+        was started at least the ingestion lag after the range end
+
+        Parameters:
+        -----------
+        t1: int
+            Range start in ms since 1970
+        t2: int
+            Range end in ms since 1970
+
+        Output:
+        -----------
+        True if the range can be answered from the index
+        """
+        with self.__lock:
+            return (self.__valid_to is not None
+                    and self.__valid_from <= t1
+                    and t2 <= self.__valid_to - self.ingestion_lag)
+
+    def get_ids(self, t1: int, t2: int, zone) -> dict:
+        """
+        Returns image timestamps along with IDs from the range (t1; t2)
+        with appropriate zone
+
+        Parameters:
+        -----------
+        t1: int
+            Range start in ms since 1970
+        t2: int
+            Range end in ms since 1970
+        zone: list
+            List of appropriate zones to compare to, '0' to ignore zones
+
+        Output:
+        -----------
+        Dictionary:
+            'timestamp': image ID
+        """
+        result = dict()
+        with self.__lock:
+            start = bisect.bisect_right(self.__timestamps, t1)
+            end = bisect.bisect_left(self.__timestamps, t2)
+            for i in range(start, end):
+                if zone != '0' and self.__zones[i] not in zone:
+                    continue
+                result[str(self.__timestamps[i])] = self.__ids[i]
+        return result
+
+    def last(self) -> tuple:
+        """
+        Returns timestamp and ID of the newest row
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        Tuple (timestamp, image ID), (None, None) for the empty index
+        """
+        with self.__lock:
+            return self.__last
+
+
+def poll_transits(vidar_service, index: TransitIndex) -> list:
+    """
+    Polls the Vidar cffresult table for the rows newer than the last
+    indexed one and adds them to the index. The rows of the ingestion lag
+    before the last indexed one are polled again, so the rows written late
+    are not missed
+
+    Parameters:
+    -----------
+    vidar_service: VidarService
+        Service to query the Vidar database with
+    index: TransitIndex
+        Index to fill
+
+    Output:
+    -----------
+    List of the received rows (timestamp, image ID, zone)
+    """
+    polled_at = int(time.time() * 1_000)
+    last_timestamp, last_id = index.last()
+    if last_timestamp is None:
+        rows = vidar_service.get_new_rows(polled_at - index.retention, None)
+    elif index.ingestion_lag > 0:
+        # already indexed rows are skipped by the index
+        rows = vidar_service.get_new_rows(last_timestamp - index.ingestion_lag, None)
+    else:
+        rows = vidar_service.get_new_rows(last_timestamp, last_id)
+    index.add(rows, polled_at)
+    return rows
+
+
+class TransitIndexer(threading.Thread):
+    """
+    Class represented background thread that polls the Vidar cffresult table
+    incrementally (only rows newer than the last seen one) into the TransitIndex
+
+    Parameters:
+    -----------
+    vidar_service: VidarService
+        Service to query the Vidar database with
+    index: TransitIndex
+        Index to fill
+    interval: float
+        Interval between polls in seconds
+
+    Methods:
+    -----------
+    run() --> None
+        Polls Vidar until stopped
+    stop() --> None
+        Stops polling
+    """
+
+    def __init__(self, vidar_service, index: TransitIndex, interval: float):
+        super().__init__(name='transit_indexer', daemon=True)
+        self.vidar_service = vidar_service
+        self.index = index
+        self.interval = interval
+        self.__stop_event = threading.Event()
+
+    def __poll(self):
+        rows = poll_transits(self.vidar_service, self.index)
+        if rows:
+            logger.debug('%s new transits were indexed, index size %s', len(rows), len(self.index))
+
+    def run(self) -> None:
+        """
+        Polls Vidar until stopped
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        logger.info(f'Vidar transit indexer started with {self.interval} s interval')
+        while not self.__stop_event.is_set():
+            try:
+                self.__poll()
+            except Exception as e:
+                logger.error(f'Failed to poll Vidar transits: {e}')
+            self.__stop_event.wait(self.interval)
+
+    def stop(self) -> None:
+        """
+        Stops polling
+
+        Parameters:
+        -----------
+
+        Output:
+        -----------
+        """
+        self.__stop_event.set()
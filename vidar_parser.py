@@ -0,0 +1,216 @@
+import xml.parsers.expat
+
+
+class GetDataParser:
+    """
+    Class represented streaming parser of the Vidar 'getdata' response.
+    The response is parsed with expat straight from the HTTP stream, no element
+    tree is built: only 'value' attributes of the needed elements are picked up,
+    every image comes back as the single string produced by the parser.
+
+    Constants:
+    -----------
+    FIELDS - paths of the needed elements along with the result keys
+    MIN_CHUNK, MAX_CHUNK - range of the read sizes, the read size is doubled
+        after every read: expat rescans the unfinished attribute on every
+        chunk, so growing chunks keep the parsing of the large images linear
+
+    Parameters:
+    -----------
+
+    Methods:
+    -----------
+    parse(stream) --> dict
+        Parses the response from the file-like object
+    parse_bytes(data) --> dict
+        Parses the response from bytes
+    """
+
+    FIELDS = {
+        ('ID',): 'ID',
+        ('capture', 'frametimems'): 'timestamp',
+        ('anpr', 'text'): 'LP',
+        ('anpr', 'country'): 'ILPC',
+        ('images', 'lp_img'): 'LpJpeg',
+        ('images', 'normal_img'): 'FullImage64',
+    }
+    MIN_CHUNK = 65536
+    MAX_CHUNK = 8 * 1024 * 1024
+
+    def __init__(self):
+        self.__path = []
+        self.__result = dict()
+        self.__parser = xml.parsers.expat.ParserCreate()
+        self.__parser.StartElementHandler = self.__start_element
+        self.__parser.EndElementHandler = self.__end_element
+
+    def __start_element(self, name, attrs):
+        self.__path.append(name)
+        # skip the root element of the response
+        key = GetDataParser.FIELDS.get(tuple(self.__path[1:]))
+        if key is not None:
+            self.__result[key] = attrs.get('value')
+
+    def __end_element(self, name):
+        self.__path.pop()
+
+    def __build_result(self) -> dict:
+        if not self.__result.get('ID'):
+            return dict()
+        result = dict()
+        for key in ('timestamp', 'LP', 'ILPC', 'LpJpeg', 'FullImage64'):
+            result[key] = self.__result.get(key)
+        return result
+
+    def parse(self, stream) -> dict:
+        """
+        Parses the response from the file-like object
+
+        Parameters:
+        -----------
+        stream: file-like object
+            Response stream with read() method
+
+        Output:
+        -----------
+        Dictionary:
+            'timestamp': image timestamp
+            'LP': vehicle license plate number
+            'ILPC': vehile country code
+            'LpJpeg':  license plate image in base64 format
+            'FullImage64': vehicle image in base64 format
+        Empty dictionary if the response has no image ID
+        """
+        size = GetDataParser.MIN_CHUNK
+        while True:
+            chunk = stream.read(size)
+            if not chunk:
+                break
+            self.__parser.Parse(chunk, False)
+            size = min(size * 2, GetDataParser.MAX_CHUNK)
+        self.__parser.Parse(b'', True)
+        return self.__build_result()
+
+    def parse_bytes(self, data: bytes) -> dict:
+        """
+        Parses the response from bytes
+
+        Parameters:
+        -----------
+        data: bytes
+            Response body
+
+        Output:
+        -----------
+        Same as parse()
+        """
+        self.__parser.Parse(data, True)
+        return self.__build_result()
+
+
+class QueryDbParser:
+    """
+    Class represented streaming parser of the Vidar 'querydb' response.
+    Only the ID, FRAMETIMEMS and ZONE_NAME columns of every row are picked up
+    with expat, no element tree is built; the zone names are shared by the
+    rows of the same zone.
+
+    Constants:
+    -----------
+    COLUMNS - needed columns along with their positions in the row tuple
+    CHUNK - read size
+
+    Parameters:
+    -----------
+
+    Methods:
+    -----------
+    parse(stream) --> list
+        Parses the response from the file-like object
+    parse_bytes(data) --> list
+        Parses the response from bytes
+    """
+
+    COLUMNS = {
+        'FRAMETIMEMS': 0,
+        'ID': 1,
+        'ZONE_NAME': 2,
+    }
+    CHUNK = 65536
+
+    def __init__(self):
+        self.__rows = []
+        self.__parser = xml.parsers.expat.ParserCreate()
+        # attributes come as the flat [name, value, ...] list, cheaper than the dict
+        self.__parser.ordered_attributes = True
+        (self.__parser.StartElementHandler,
+         self.__parser.EndElementHandler) = QueryDbParser.__handlers(self.__rows)
+
+    @staticmethod
+    def __handlers(rows: list) -> tuple:
+        # the handlers run for every column of every row, so the state
+        # is kept in the closure variables instead of the attributes
+        columns = QueryDbParser.COLUMNS
+        zones = dict()
+        row = [None, None, None]
+
+        def start_element(name, attrs):
+            column = columns.get(name)
+            if column is not None:
+                if attrs and attrs[0] == 'value':
+                    row[column] = attrs[1]
+                else:
+                    row[column] = dict(zip(attrs[::2], attrs[1::2])).get('value')
+            elif name == 'row':
+                row[:] = (None, None, None)
+
+        def end_element(name):
+            if name != 'row':
+                return
+            timestamp, id, zone = row
+            if timestamp is None or id is None:
+                return
+            if zone is not None:
+                zone = zones.setdefault(zone, zone)
+            rows.append((int(timestamp), id, zone))
+
+        return start_element, end_element
+
+    def parse(self, stream) -> list:
+        """
+        Parses the response from the file-like object
+
+        Parameters:
+        -----------
+        stream: file-like object
+            Response stream with read() method
+
+        Output:
+        -----------
+        List of tuples:
+            (timestamp: int, image ID: str, zone: str)
+        Rows without the ID or FRAMETIMEMS column are skipped
+        """
+        while True:
+            chunk = stream.read(QueryDbParser.CHUNK)
+            if not chunk:
+                break
+            self.__parser.Parse(chunk, False)
+        self.__parser.Parse(b'', True)
+        return self.__rows
+
+    def parse_bytes(self, data: bytes) -> list:
+        """
+        Parses the response from bytes
+
+        Parameters:
+        -----------
+        data: bytes
+            Response body
+
+        Output:
+        -----------
+        Same as parse()
+        """
+        self.__parser.Parse(data, True)
+        return self.__rows
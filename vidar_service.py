@@ -1,8 +1,12 @@
+import bisect
 import logging
-import requests
 import sys
-import xml.etree.ElementTree as ET
+import urllib.parse
+import xml.parsers.expat
 from datetime import datetime
+from errors import VidarQueryRejected, VidarUnavailable
+from http_client import VidarHttpClient
+from vidar_parser import GetDataParser, QueryDbParser
 
 
 # set logger
@@ -15,27 +19,77 @@ class VidarService:
 
     Constants:
     -----------
+    QUERYDB_COLUMNS - columns of the cffresult table the range queries select
+    TRANSIENT_STATUSES - querydb answer statuses other than 5xx that do not
+        reject the query itself, so they never switch the pushdown off
 
     Parameters:
     -----------
+    ip: str
+        Vidar camera IP address
+    connect_timeout: float
+        Connect deadline of the single HTTP request in seconds
+    read_timeout: float
+        Read deadline of the single HTTP request in seconds
+    retries: int
+        Maximum quantity of retries of the single HTTP request
+    pool_size: int
+        Maximum quantity of kept alive HTTP connections
+    http: VidarHttpClient
+        Client shared with the services of the other Vidar units,
+        the client is created from the parameters above if not given
 
     Methods:
-    send_software_trigger() --> None
+    send_software_trigger() --> bool
         Sends software trigger to vidar
         Software trigger needs to be configured at vidar
-    get_ids(transit_timestamp: datetime string, tolerance: ms) --> dict
+    get_rows(t1: ms, t2: ms) --> list
+        Returns list of (timestamp, ID, zone) of all the images
+        from the range (t1; t2)
+    get_new_rows(last_timestamp: ms, last_id: str) --> list
+        Returns list of (timestamp, ID, zone) of the images
+        that are newer than the given one
+    get_ids(transit_timestamp: datetime string, tolerance: ms, zone, closest) --> dict
         Returns dict of image timestamps in int format (since 1970) along
         with IDs from the range with appropriate zone
-        (transit_timestamp - tolerance; transit_timestamp + tolerance)
+        (transit_timestamp - tolerance; transit_timestamp + tolerance),
+        only the closest rows to the transit if closest is given
+        Answered from the transit index if it is attached and covers the range,
+        range queries go through the batcher if it is attached
+    nearest_ids(ids: dict, timestamp: ms, closest: int) --> dict
+        Returns the given quantity of the rows closest to the timestamp
     get_data(id: str) --> dict
         Returns dictionary with vehicle image in base64 format,
         license plate image in base64 format and license plate text
+        Answered from the image cache if it is attached and holds the image,
+        received images are put into the cache
+    is_cached(id: str) --> bool
+        Checks if the image is in the attached image cache
     """
 
-    def __init__(self, ip):
+    QUERYDB_COLUMNS = 'ID, FRAMETIMEMS, ZONE_NAME'
+    TRANSIENT_STATUSES = (408, 429)
+
+    def __init__(self, ip, connect_timeout: float = 2.0, read_timeout: float = 5.0,
+                 retries: int = 2, pool_size: int = 4, http: VidarHttpClient = None):
         self.IP = ip
+        self.http = http or VidarHttpClient(connect_timeout=connect_timeout,
+                                            read_timeout=read_timeout,
+                                            retries=retries,
+                                            pool_size=pool_size)
+        # optional in-memory TransitIndex, see transit_index.py
+        self.index = None
+        # optional RangeQueryBatcher merging concurrent range queries, see query_batcher.py
+        self.batcher = None
+        # optional ImageCache of the get_data results, see image_cache.py
+        self.cache = None
+        # zone and closest row predicates are put into the querydb SQL,
+        # switched off once the unit rejects them (not on the 5xx answers)
+        self.pushdown = True
+        # only the needed columns are selected, switched off once the unit rejects the list
+        self.projection = True
 
-    def send_software_trigger(self) -> None:
+    def send_software_trigger(self) -> bool:
         """
         Sends software trigger to vidar
         Software trigger needs to be configured at vidar
@@ -45,19 +99,197 @@ class VidarService:
 
         Output:
         -----------
+        True if vidar accepted the trigger
         """
         url = 'http://' + self.IP + '/trigger/swtrigger?wfilter=1&sendtrigger=1'
-        r = requests.get(url)
+        # the retried trigger would make vidar capture the vehicle twice
+        r = self.http.get(url, endpoint='swtrigger', retry=False)
         if r.status_code == 200:
             logger.info("Software trigger sending was successfull")
-        else:
-            logger.info("Software trigger sending was unsuccessfull")
+            return True
+        logger.info("Software trigger sending was unsuccessfull")
+        return False
+
+    def __select(self, columns: str, where: str) -> list:
+        # where may be followed by the order by and limit clauses
+        sql = urllib.parse.quote(f'select {columns} from cffresult where {where}', safe='*')
+        url = 'http://' + self.IP + '/lpr/cff?cmd=querydb&sql=' + sql
+        # parse the response while it is being received, without the element tree
+        with self.http.get(url, endpoint='querydb', stream=True) as r:
+            if r.status_code >= 500 or r.status_code in VidarService.TRANSIENT_STATUSES:
+                raise VidarUnavailable(f'querydb answered with status {r.status_code}')
+            if r.status_code != 200:
+                raise VidarQueryRejected(f'querydb answered with status {r.status_code}')
+            r.raw.decode_content = True
+            try:
+                return QueryDbParser().parse(r.raw)
+            except xml.parsers.expat.ExpatError as e:
+                raise VidarQueryRejected(f'querydb answer is not valid XML: {e}')
+
+    def __querydb(self, where: str) -> list:
+        if not self.projection:
+            return self.__select('*', where)
+        try:
+            return self.__select(VidarService.QUERYDB_COLUMNS, where)
+        except VidarUnavailable:
+            raise
+        except VidarQueryRejected as e:
+            rows = self.__select('*', where)
+            # the query passed without the column list, so it is the list the unit does not accept
+            self.projection = False
+            logger.warning(f'Vidar at {self.IP} rejected the column list ({e}), '
+                           + 'all the columns are queried')
+            return rows
+
+    def get_rows(self, t1: int, t2: int) -> list:
+        """
+        Returns list of (timestamp, ID, zone) of all the images
+        from the range (t1; t2)
+
+        Parameters:
+        -----------
+        t1: int
+            Range start in ms since 1970
+        t2: int
+            Range end in ms since 1970
+
+        Output:
+        -----------
+        List of tuples:
+            (timestamp: int, image ID: str, zone: str)
+        """
+        return self.__querydb(f'frametimems > {t1} and frametimems < {t2}')
+
+    def get_new_rows(self, last_timestamp: int, last_id: str) -> list:
+        """
+        Returns list of (timestamp, ID, zone) of the images
+        that are newer than the given one
+
+        Parameters:
+        -----------
+        last_timestamp: int
+            Timestamp of the last known image in ms since 1970
+        last_id: str
+            ID of the last known image, None if there is no known image yet
+
+        Output:
+        -----------
+        List of tuples:
+            (timestamp: int, image ID: str, zone: str)
+        """
+        if last_id is None:
+            return self.__querydb(f'frametimems > {last_timestamp}')
+        return self.__querydb(f'frametimems > {last_timestamp} or '
+                              + f'(frametimems = {last_timestamp} and id > {last_id})')
+
+    @staticmethod
+    def filter_ids(rows, zone) -> dict:
+        """
+        Returns dictionary of image timestamps along with IDs
+        of the rows with appropriate zone
+
+        Parameters:
+        -----------
+        rows: iterable
+            Tuples (timestamp, image ID, zone)
+        zone: list
+            List of appropriate zones to compare to, '0' to ignore zones
+
+        Output:
+        -----------
+        Dictionary:
+            'timestamp': image ID
+        """
+        result = dict()
+        for timestamp, id, row_zone in rows:
+            # check if it is appropriate zone
+            if zone != '0' and row_zone not in zone:
+                continue
+            result[str(timestamp)] = id
+        return result
+
+    @staticmethod
+    def nearest_ids(ids: dict, timestamp: int, closest: int) -> dict:
+        """
+        Returns the given quantity of the rows closest to the timestamp,
+        the earlier row is taken first if two rows are equally close
+
+        Parameters:
+        -----------
+        ids: dict
+            Rows to choose from, 'timestamp': image ID
+        timestamp: int
+            Transit timestamp in ms since 1970
+        closest: int
+            Quantity of the rows to return
+
+        Output:
+        -----------
+        Dictionary ordered from the closest row:
+            'timestamp': image ID
+        """
+        timestamps = sorted(int(ts) for ts in ids)
+        right = bisect.bisect_left(timestamps, timestamp)
+        left = right - 1
+        result = dict()
+        while len(result) < closest and (left >= 0 or right < len(timestamps)):
+            if right >= len(timestamps) or (
+                    left >= 0 and timestamp - timestamps[left] <= timestamps[right] - timestamp):
+                ts = timestamps[left]
+                left -= 1
+            else:
+                ts = timestamps[right]
+                right += 1
+            result[str(ts)] = ids[str(ts)]
+        return result
 
-    def get_ids(self, transit_timestamp, tolerance: int, zone: str) -> list:
+    @staticmethod
+    def __sql_zones(zone) -> str:
+        return ', '.join("'" + z.replace("'", "''") + "'" for z in sorted(zone))
+
+    def __get_ids_pushdown(self, t1: int, t2: int, t: int, zone, closest: int) -> dict:
+        where = f'frametimems > {t1} and frametimems < {t2}'
+        if zone != '0':
+            where += f' and zone_name in ({VidarService.__sql_zones(zone)})'
+        if closest > 0:
+            where += f' order by abs(frametimems - {t}), frametimems limit {closest}'
+        try:
+            rows = self.__querydb(where)
+        except VidarUnavailable:
+            # the unit may be restarting, the plain query would only double its load;
+            # the pushdown is kept for the next queries
+            raise
+        except VidarQueryRejected as e:
+            rows = self.get_rows(t1, t2)
+            # the plain query passed, so it is the predicates the unit does not accept
+            self.pushdown = False
+            logger.warning(f'Vidar at {self.IP} rejected the filtered query ({e}), '
+                           + 'the rows are filtered locally')
+        # the rows are checked again in case the unit ignored some of the predicates
+        return VidarService.filter_ids(rows, zone)
+
+    def __query_ids(self, t1: int, t2: int, t: int, zone, closest: int) -> dict:
+        if self.batcher is not None:
+            # the merged ranges of the batch serve different zones and transits,
+            # so the batched queries are never pushed down
+            return VidarService.filter_ids(self.batcher.get_rows(t1, t2), zone)
+        if self.pushdown:
+            return self.__get_ids_pushdown(t1, t2, t, zone, closest)
+        return VidarService.filter_ids(self.get_rows(t1, t2), zone)
+
+    def get_ids(self, transit_timestamp, tolerance: int, zone, closest: int = 0) -> dict:
         """
         Returns list of IDs along with image time in int format (since 1970)
         from the range (transit_timestamp - tolerance; timestamp + tolerance)
-        with appropriate zone
+        with appropriate zone.
+        The range is looked up in the transit index if it is attached
+        and already covers the range, otherwise (or if the index polled
+        on the triggers only has no rows of the range) Vidar is queried
+        (along with the concurrent requests if the batcher is attached).
+        The single Vidar query is filtered by the zone and limited to the
+        closest rows by Vidar itself, the rows are filtered locally
+        if the unit rejects such a query (the batched queries are always
+        filtered locally)
 
         Parameters:
         -----------
@@ -66,25 +298,29 @@ class VidarService:
         tolerance: int
             Tolerance in ms to define the search range
         zone: list
-            List of appropriate zones to compare to
+            List of appropriate zones to compare to, '0' to ignore zones
+        closest: int
+            Quantity of the rows closest to the transit to return, 0 for all the rows
         Output:
         -----------
-        Dictionary:
+        Dictionary (ordered from the closest row if closest is given):
             'timestamp': image ID
         """
-        result = dict()
-        t1 = int(transit_timestamp.timestamp()*1_000) - tolerance
-        t2 = int(transit_timestamp.timestamp()*1_000) + tolerance
-        url = ('http://' + self.IP + '/lpr/cff?cmd=querydb&sql=select%20*%20from%20cffresult%20'
-                         + f'where%20frametimems%20%3E%20{t1}%20and%20frametimems%20%3C%20{t2}')
-        r = requests.get(url)
-        root = ET.fromstring(r.content)
-        for row in root.findall('row'):
-            # check if it is appropriate zone
-            if zone != '0' and row.find('ZONE_NAME').get('value') not in zone:
-                continue
-            result[row.find('FRAMETIMEMS').get('value')] = row.find('ID').get('value')
-        return result
+        t = int(transit_timestamp.timestamp()*1_000)
+        t1 = t - tolerance
+        t2 = t + tolerance
+        ids = None
+        if self.index is not None and self.index.covers(t1, t2):
+            logger.debug('Range (%s; %s) was looked up in the transit index', t1, t2)
+            ids = self.index.get_ids(t1, t2, zone)
+            if not ids and not self.index.continuous:
+                # the index polled on the triggers only may miss the row written late
+                ids = None
+        if ids is None:
+            ids = self.__query_ids(t1, t2, t, zone, closest)
+        if closest > 0:
+            return VidarService.nearest_ids(ids, t, closest)
+        return ids
 
     def get_data(self, id: int) -> dict:
         """
@@ -105,17 +341,38 @@ class VidarService:
             'LpJpeg':  license plate image in base64 format
             'FullImage64': vehicle image in base64 format
         """
-        result = dict()
+        if self.cache is not None:
+            img = self.cache.get(self.__cache_key(id))
+            if img is not None:
+                logger.debug('Image %s was taken from the cache', id)
+                return img
         url = 'http://' + self.IP + f'/lpr/cff?cmd=getdata&id={id}'
-        r = requests.get(url)
-        root = ET.fromstring(r.content)
-        if root.find('ID').get('value'):
-            result['timestamp'] = root.find('capture').find('frametimems').get('value')
-            result['LP'] = root.find('anpr').find('text').get('value')
-            result['ILPC'] = root.find('anpr').find('country').get('value')
-            result['LpJpeg'] = root.find('images').find('lp_img').get('value')
-            result['FullImage64'] = root.find('images').find('normal_img').get('value')
-        return result
+        # parse the response while it is being received, without the element tree
+        with self.http.get(url, endpoint='getdata', stream=True) as r:
+            r.raw.decode_content = True
+            img = GetDataParser().parse(r.raw)
+        if img and self.cache is not None:
+            self.cache.put(self.__cache_key(id), img)
+        return img
+
+    def __cache_key(self, id) -> str:
+        # image IDs are unique within the unit only, the cache can be shared by the units
+        return f'{self.IP}/{id}'
+
+    def is_cached(self, id) -> bool:
+        """
+        Checks if the image is in the attached image cache
+
+        Parameters:
+        -----------
+        id: str
+            Image ID
+
+        Output:
+        -----------
+        True if the image is cached
+        """
+        return self.cache is not None and self.__cache_key(id) in self.cache
 
 
 if __name__ == '__main__':
@@ -133,7 +390,7 @@ if __name__ == '__main__':
     tolerance = int(sys.argv[3])
 
     vidar_service = VidarService(IP)
-    ids = vidar_service.get_ids(transit_timestamp, tolerance)
+    ids = vidar_service.get_ids(transit_timestamp, tolerance, '0')
     for id in ids.values():
         result = vidar_service.get_data(id)
         if result: